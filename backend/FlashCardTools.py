@@ -1,18 +1,247 @@
 import os
 import re
 import random
+import time
 from dotenv import load_dotenv
-from typing import Dict, Any, Optional, List
-from PyPDF2 import PdfReader # type: ignore
+from typing import Dict, Any, Optional, List, Tuple
 from fastapi import UploadFile, HTTPException
 import uuid
+import hashlib
 import json
-import anthropic
+from services.anthropic_client import get_anthropic_client
+from services.llm_limiter import LLMUnavailable, estimate_tokens, llm_limiter, service_unavailable
+from services.doc_index import chunk_word_stream, get_document_index, iter_words
+from services.pdf_text import WHITESPACE, DocumentTooLarge, MemoryBudget, extract_text, is_large_document, iter_page_texts, normalise_pages
+from services.tracing import log_payload, logger, observe, span
 
 
 load_dotenv()
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
 
+# "tool" asks Claude for structured tool input, "text" asks for free-text JSON
+OUTPUT_MODES = ("tool", "text")
+FLASHCARD_OUTPUT_MODE = os.getenv('FLASHCARD_OUTPUT_MODE', 'tool')
+
+# Characters of source text sent to Claude: the document prefix, or retrieved library chunks
+DOCUMENT_CONTEXT_CHARS = 4000
+LIBRARY_CONTEXT_CHARS = int(os.getenv('LIBRARY_CONTEXT_CHARS', '8000'))
+LIBRARY_TOP_CHUNKS = int(os.getenv('LIBRARY_TOP_CHUNKS', '12'))
+
+FLASHCARD_TOOL = {
+    "name": "record_flashcards",
+    "description": "Record the generated flashcards.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "flashcards": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "string", "description": "Sequential id starting at 1"},
+                        "question": {"type": "string"},
+                        "answer": {"type": "string"}
+                    },
+                    "required": ["id", "question", "answer"]
+                }
+            }
+        },
+        "required": ["flashcards"]
+    }
+}
+
+TOOL_SYSTEM_PROMPT = """You are a flashcard generation assistant. Always record your flashcards with the record_flashcards tool.
+Important Rules:
+1. Generate EXACTLY the number of flashcards requested - no more, no less
+2. Each flashcard must have an id, question, and answer
+3. Number flashcard IDs sequentially from 1 to N"""
+
+TEXT_SYSTEM_PROMPT = """You are a flashcard generation assistant. Generate flashcards in this exact JSON format:
+{
+    "flashcards": [
+        {
+            "id": "1",
+            "question": "Question text here",
+            "answer": "Answer text here - if multi-line, use \\n for line breaks"
+        }
+    ]
+}
+Important Rules:
+1. Generate EXACTLY the number of flashcards requested - no more, no less
+2. Use proper JSON escaping for any special characters
+3. For multi-line answers, use \\n instead of actual line breaks
+4. Do not include any other text or formatting in your response
+5. Only output valid JSON
+6. Make sure all JSON objects end with proper commas
+7. Double-check your JSON is valid before responding
+8. Number flashcard IDs sequentially from 1 to N"""
+
+
+class ParseStats:
+    """Parse outcome and post-processing time for one output mode."""
+    def __init__(self):
+        self.responses = 0
+        self.parse_failures = 0
+        # Tool input fixed up in place, and tool input given up on for text
+        self.repairs = 0
+        self.fallbacks = 0
+        self.postprocess_seconds = 0.0
+
+    def record(self, seconds: float):
+        self.responses += 1
+        self.postprocess_seconds += seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "responses": self.responses,
+            "parse_failures": self.parse_failures,
+            "parse_failure_rate": self.parse_failures / self.responses if self.responses else 0.0,
+            "repairs": self.repairs,
+            "fallbacks": self.fallbacks,
+            "avg_postprocess_ms": 1000 * self.postprocess_seconds / self.responses if self.responses else 0.0,
+        }
+
+
+parse_stats = {mode: ParseStats() for mode in OUTPUT_MODES}
+
+
+# Patterns used on every free-text response, compiled at import rather than on the first one
+FLASHCARDS_ARRAY = re.compile(r'"flashcards"\s*:\s*(\[.*?\])', re.DOTALL)
+# Applied in order to fix common JSON formatting issues
+JSON_REPAIRS = (
+    (re.compile(r',\s*}'), '}'),  # Remove trailing commas
+    (re.compile(r',\s*]'), ']'),  # Remove trailing commas in arrays
+    (re.compile(r'\}\s*\{'), '},{'),  # Fix missing commas between objects
+    (re.compile(r'\]\s*\['), '],['),  # Fix missing commas between arrays
+)
+
+
+def clean_json_text(text: str) -> str:
+    """More aggressive cleaning of a free-text JSON response"""
+    # Remove any non-JSON text before the first { and after the last }
+    start = text.find('{')
+    end = text.rfind('}') + 1
+    if start >= 0 and end > start:
+        text = text[start:end]
+    
+    # Handle newlines and spaces within strings
+    in_string = False
+    cleaned = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        
+        # Handle escape sequences
+        if char == '\\' and i + 1 < len(text):
+            cleaned.extend([char, text[i + 1]])
+            i += 2
+            continue
+            
+        # Track string boundaries
+        if char == '"' and (i == 0 or text[i-1] != '\\'):
+            in_string = not in_string
+            
+        # Clean up characters within strings
+        if in_string:
+            if char in '\n\r\t':
+                cleaned.append(' ')
+            else:
+                cleaned.append(char)
+        else:
+            if char in '\n\r\t ':
+                # Only add one space between JSON tokens
+                if cleaned and cleaned[-1] not in '\n\r\t ':
+                    cleaned.append(' ')
+            else:
+                cleaned.append(char)
+        i += 1
+    
+    # Join and normalize spaces outside strings
+    result = ''.join(cleaned)
+    
+    # Fix common JSON formatting issues
+    for pattern, replacement in JSON_REPAIRS:
+        result = pattern.sub(replacement, result)
+    
+    return result
+
+
+def parse_flashcards_text(response_text: str) -> List[Dict[str, Any]]:
+    """Clean, repair and parse a free-text JSON response into a list of cards"""
+    # Clean and parse the JSON
+    cleaned_text = clean_json_text(response_text)
+    log_payload("Cleaned JSON", cleaned_text)
+    
+    try:
+        parsed_response = json.loads(cleaned_text)
+    except json.JSONDecodeError as e:
+        logger.debug("JSON still invalid after cleaning (%s), attempting to fix common JSON issues", e)
+        
+        # Try to extract just the flashcards array if the outer structure is broken
+        flashcards_match = FLASHCARDS_ARRAY.search(cleaned_text)
+        if flashcards_match:
+            flashcards_json = flashcards_match.group(1)
+            try:
+                cards = json.loads(flashcards_json)
+                parsed_response = {"flashcards": cards}
+            except json.JSONDecodeError:
+                raise ValueError("Could not parse flashcards array")
+        else:
+            raise ValueError("Could not find flashcards array in response")
+
+    if isinstance(parsed_response, dict) and "flashcards" in parsed_response:
+        return parsed_response["flashcards"]
+    raise ValueError("Response must have a 'flashcards' array")
+
+
+def validate_flashcards(cards: Any) -> None:
+    """Validate the structure of a parsed flashcard list"""
+    if not isinstance(cards, list):
+        raise ValueError("Flashcards must be an array")
+        
+    # Validate each flashcard
+    for card in cards:
+        if not isinstance(card, dict):
+            raise ValueError("Each flashcard must be an object")
+        if not all(key in card for key in ['id', 'question', 'answer']):
+            raise ValueError("Each flashcard must have id, question, and answer fields")
+        if not all(isinstance(card[key], str) for key in ['id', 'question', 'answer']):
+            raise ValueError("All flashcard fields must be strings")
+
+
+def tool_flashcards(tool_input: Any) -> Tuple[Optional[List[Dict[str, Any]]], bool]:
+    """
+    The valid cards in record_flashcards tool input (None if there are none)
+    and whether the input had to be repaired to get them
+    """
+    if not isinstance(tool_input, dict):
+        return None, False
+    cards = tool_input.get("flashcards")
+    repaired = False
+    if isinstance(cards, str):
+        # Models occasionally send the array as a JSON string
+        repaired = True
+        try:
+            cards = json.loads(cards)
+        except json.JSONDecodeError:
+            try:
+                cards = parse_flashcards_text(f'{{"flashcards": {cards}}}')
+            except ValueError:
+                return None, repaired
+        if isinstance(cards, dict):
+            cards = cards.get("flashcards")
+    if not isinstance(cards, list):
+        return None, repaired
+    # Models occasionally return numeric ids despite the schema
+    for card in cards:
+        if isinstance(card, dict) and isinstance(card.get("id"), int):
+            card["id"] = str(card["id"])
+    try:
+        validate_flashcards(cards)
+    except ValueError:
+        return None, repaired
+    return cards, repaired
+
 
 class Flashcard:
     """Flashcard class to store question and answer pairs."""
@@ -27,28 +256,17 @@ class FlashcardGenerator:
     """Class to handle generation of flashcards from PDFs using Claude."""
     
     def __init__(self):
-        self.client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+        # Shared client, so connections are reused across requests
+        self.client = get_anthropic_client()
         self.upload_dir = "uploads"
         os.makedirs(self.upload_dir, exist_ok=True)
    
     def extract_text_from_pdf(self, pdf_content: bytes) -> str:
         """Extract text content from PDF"""
         try:
-            # Create a temporary file to store the PDF content
-            temp_path = os.path.join(self.upload_dir, "testpdf.pdf")
-            with open(temp_path, "wb") as f:
-                f.write(pdf_content)
-            
-            # Read the PDF
-            reader = PdfReader(temp_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text()
-                
-            # Clean up
-            os.remove(temp_path)
-            return text
-            
+            return extract_text(pdf_content)
+        except DocumentTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error reading PDF: {str(e)}")
 
@@ -63,172 +281,222 @@ class FlashcardGenerator:
             raise ValueError("Cannot process empty text")
         
         # Removes extra whitespace
-        text = re.sub(r'\s+', ' ', text)
+        text = WHITESPACE.sub(' ', text)
         # Additional preprocessing
         return text.strip()
 
-    def generate_flashcards(self, text: str, count: int = 10, subject: Optional[str] = None) -> Dict[str, Any]:
-        """Generate flashcards from the provided text using Claude."""
+    def read_large_document(self, pdf_content: bytes, user_id: Optional[str] = None, filename: Optional[str] = None, prefix_chars: int = DOCUMENT_CONTEXT_CHARS) -> str:
+        """
+        Large-document mode: extraction, whitespace normalisation and chunking
+        run as one pipeline over pages, so only a window of pages, one chunk
+        and the prompt prefix are held at once. Returns the first prefix_chars
+        of the processed text, which is all the flashcard prompt uses. The
+        whole document is only read when it is added to the user's library;
+        otherwise the PDF reader is released once the prefix is complete.
+        """
+        budget = MemoryBudget()
+        budget.charge(len(pdf_content), "the upload")
+        doc_hash = hashlib.sha256(pdf_content).hexdigest()
+        prefix: List[str] = []
+        kept = 0
+        pieces = normalise_pages(iter_page_texts(pdf_content, budget=budget, document_hash=doc_hash))
+
+        def capture_prefix():
+            nonlocal kept
+            for piece in pieces:
+                if kept < prefix_chars:
+                    prefix.append(piece[:prefix_chars - kept])
+                    kept += len(prefix[-1])
+                yield piece
+
+        index = get_document_index()
+        try:
+            if user_id and not index.has_document(user_id, doc_hash):
+                with span("library_index", mode="large"):
+                    index.index_chunks(user_id, doc_hash, chunk_word_stream(iter_words(capture_prefix())), filename)
+            else:
+                for _ in capture_prefix():
+                    if kept >= prefix_chars:
+                        break
+        finally:
+            pieces.close()
+        if not prefix:
+            raise ValueError("The PDF has no text layer and OCR could not recover any text")
+        return "".join(prefix)
+
+    def generate_flashcards(self, text: str, count: int = 10, subject: Optional[str] = None, mode: Optional[str] = None, max_chars: int = DOCUMENT_CONTEXT_CHARS) -> Dict[str, Any]:
+        """
+        Generate flashcards from the provided text using Claude.
+        In "tool" mode the cards come back as structured tool input; in "text"
+        mode (and as a fallback) the free-text JSON response is cleaned and repaired.
+        """
+        mode = mode or FLASHCARD_OUTPUT_MODE
+        if mode not in OUTPUT_MODES:
+            raise HTTPException(status_code=400, detail=f"Unknown flashcard output mode: {mode}")
+        stats = parse_stats[mode]
         try:
-            message = self.client.messages.create(
+            prompt_text = text[:max_chars]
+            topic = f" about {subject}" if subject else ""
+            if mode == "tool":
+                request = {
+                    "system": TOOL_SYSTEM_PROMPT,
+                    "tools": [FLASHCARD_TOOL],
+                    "tool_choice": {"type": "tool", "name": FLASHCARD_TOOL["name"]},
+                    "messages": [{
+                        "role": "user",
+                        "content": f"Create EXACTLY {count} flashcards from this text{topic} and record them with the {FLASHCARD_TOOL['name']} tool. Focus on key concepts and important information. Number flashcard IDs sequentially from 1 to {count}. The text is:\n\n{prompt_text}"
+                    }],
+                }
+            else:
+                request = {
+                    "system": TEXT_SYSTEM_PROMPT,
+                    "messages": [{
+                        "role": "user",
+                        "content": f"Create EXACTLY {count} flashcards from this text{topic}. You must generate {count} cards - no more, no less. Focus on key concepts and important information. Each flashcard must have an id, question, and answer. For multi-line answers, use \\n for line breaks. IMPORTANT: Ensure your response is valid JSON with proper commas between objects. The text is:\n\n{prompt_text}"
+                    }],
+                }
+
+            message = llm_limiter.call(
+                self.client.messages.create,
+                input_tokens=estimate_tokens(prompt_text) + 400,
+                max_output_tokens=4000,
                 model="claude-3-haiku-20240307",
                 max_tokens=4000,
                 temperature=0.7,
-                system="""You are a flashcard generation assistant. Generate flashcards in this exact JSON format:
-{
-    "flashcards": [
-        {
-            "id": "1",
-            "question": "Question text here",
-            "answer": "Answer text here - if multi-line, use \\n for line breaks"
-        }
-    ]
-}
-Important Rules:
-1. Generate EXACTLY the number of flashcards requested - no more, no less
-2. Use proper JSON escaping for any special characters
-3. For multi-line answers, use \\n instead of actual line breaks
-4. Do not include any other text or formatting in your response
-5. Only output valid JSON
-6. Make sure all JSON objects end with proper commas
-7. Double-check your JSON is valid before responding
-8. Number flashcard IDs sequentially from 1 to N""",
-                messages=[{
-                    "role": "user",
-                    "content": f"Create EXACTLY {count} flashcards from this text{' about ' + subject if subject else ''}. You must generate {count} cards - no more, no less. Focus on key concepts and important information. Each flashcard must have an id, question, and answer. For multi-line answers, use \\n for line breaks. IMPORTANT: Ensure your response is valid JSON with proper commas between objects. The text is:\n\n{text[:4000]}"
-                }]
+                **request
             )
-            
-            # Get the response text and clean it
-            response_text = message.content[0].text.strip()
-            
-            # Debug logging
-            print("Raw Claude response:")
-            print(response_text)
-            
+
+            started = time.perf_counter()
+            retry_as_text = False
             try:
-                # More aggressive cleaning of the response text
-                def clean_json_text(text: str) -> str:
-                    # Remove any non-JSON text before the first { and after the last }
-                    start = text.find('{')
-                    end = text.rfind('}') + 1
-                    if start >= 0 and end > start:
-                        text = text[start:end]
-                    
-                    # Handle newlines and spaces within strings
-                    in_string = False
-                    cleaned = []
-                    i = 0
-                    while i < len(text):
-                        char = text[i]
-                        
-                        # Handle escape sequences
-                        if char == '\\' and i + 1 < len(text):
-                            cleaned.extend([char, text[i + 1]])
-                            i += 2
-                            continue
-                            
-                        # Track string boundaries
-                        if char == '"' and (i == 0 or text[i-1] != '\\'):
-                            in_string = not in_string
-                            
-                        # Clean up characters within strings
-                        if in_string:
-                            if char in '\n\r\t':
-                                cleaned.append(' ')
-                            else:
-                                cleaned.append(char)
-                        else:
-                            if char in '\n\r\t ':
-                                # Only add one space between JSON tokens
-                                if cleaned and cleaned[-1] not in '\n\r\t ':
-                                    cleaned.append(' ')
-                            else:
-                                cleaned.append(char)
-                        i += 1
-                    
-                    # Join and normalize spaces outside strings
-                    result = ''.join(cleaned)
-                    
-                    # Fix common JSON formatting issues
-                    result = re.sub(r',\s*}', '}', result)  # Remove trailing commas
-                    result = re.sub(r',\s*]', ']', result)  # Remove trailing commas in arrays
-                    result = re.sub(r'\}\s*\{', '},{', result)  # Fix missing commas between objects
-                    result = re.sub(r'\]\s*\[', '],[', result)  # Fix missing commas between arrays
-                    
-                    return result
-
-                # Clean and parse the JSON
-                cleaned_text = clean_json_text(response_text)
-                print("\nCleaned JSON:")
-                print(cleaned_text)
-                
-                try:
-                    parsed_response = json.loads(cleaned_text)
-                except json.JSONDecodeError as e:
-                    print(f"\nJSON still invalid after cleaning. Error: {str(e)}")
-                    print("Attempting to fix common JSON issues...")
-                    
-                    # Try to extract just the flashcards array if the outer structure is broken
-                    flashcards_match = re.search(r'"flashcards"\s*:\s*(\[.*?\])', cleaned_text, re.DOTALL)
-                    if flashcards_match:
-                        flashcards_json = flashcards_match.group(1)
-                        try:
-                            cards = json.loads(flashcards_json)
-                            parsed_response = {"flashcards": cards}
-                        except json.JSONDecodeError:
-                            raise ValueError("Could not parse flashcards array")
+                cards = None
+                if mode == "tool":
+                    tool_input = next(
+                        (block.input for block in message.content if getattr(block, "type", None) == "tool_use"),
+                        None
+                    )
+                    cards, repaired = tool_flashcards(tool_input)
+                    if cards is None:
+                        stats.fallbacks += 1
+                    elif repaired:
+                        stats.repairs += 1
+
+                if cards is None:
+                    # Get the response text and repair it
+                    response_text = "".join(
+                        block.text for block in message.content if getattr(block, "type", None) == "text"
+                    ).strip()
+
+                    log_payload("Raw Claude response", response_text)
+
+                    if mode == "tool" and not response_text:
+                        # The forced tool call leaves no text to fall back on; ask again for free text
+                        retry_as_text = True
                     else:
-                        raise ValueError("Could not find flashcards array in response")
-
-                # Validate the response structure
-                if isinstance(parsed_response, dict) and "flashcards" in parsed_response:
-                    cards = parsed_response["flashcards"]
-                    if not isinstance(cards, list):
-                        raise ValueError("Flashcards must be an array")
-                        
-                    # Validate each flashcard
-                    for card in cards:
-                        if not isinstance(card, dict):
-                            raise ValueError("Each flashcard must be an object")
-                        if not all(key in card for key in ['id', 'question', 'answer']):
-                            raise ValueError("Each flashcard must have id, question, and answer fields")
-                        if not all(isinstance(card[key], str) for key in ['id', 'question', 'answer']):
-                            raise ValueError("All flashcard fields must be strings")
-                    
-                    return {"flashcards": json.dumps(cards)}
-                else:
-                    raise ValueError("Response must have a 'flashcards' array")
-                
-            except json.JSONDecodeError as e:
-                print(f"JSON decode error at line {e.lineno}, column {e.colno}")
-                print(f"Error message: {str(e)}")
-                raise ValueError(f"Failed to parse Claude response as JSON: {str(e)}")
+                        cards = parse_flashcards_text(response_text)
+                        validate_flashcards(cards)
             except Exception as e:
-                print(f"Error processing response: {str(e)}")
+                stats.parse_failures += 1
+                logger.warning("Error processing flashcard response: %s", e)
                 raise ValueError(f"Error processing Claude response: {str(e)}")
-                
+            finally:
+                elapsed = time.perf_counter() - started
+                stats.record(elapsed)
+                observe("json_repair", elapsed)
+
+            if retry_as_text:
+                logger.warning("Unusable %s tool input; retrying in text mode", FLASHCARD_TOOL["name"])
+                return self.generate_flashcards(text, count=count, subject=subject, mode="text", max_chars=max_chars)
+            return {"flashcards": cards}
+
+        except HTTPException:
+            raise
+        except LLMUnavailable as e:
+            logger.warning("Flashcard generation turned away: %s", e)
+            raise service_unavailable(e)
         except Exception as e:
-            print(f"Error in generate_flashcards: {str(e)}")
+            logger.warning("Error in generate_flashcards: %s", e)
             raise HTTPException(status_code=500, detail=f"Error generating flashcards: {str(e)}")
 
     def generate(self, pdf_file: UploadFile, subject: Optional[str] = None, count: int = 10) -> Dict[str, Any]:
         """Main function to generate flashcards from a PDF file."""
+        return self.generate_from_content(pdf_file.file.read(), subject=subject, count=count)
+
+    def generate_from_content(self, pdf_content: bytes, subject: Optional[str] = None, count: int = 10, user_id: Optional[str] = None, filename: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Generate flashcards from PDF bytes that have already been read.
+        With a user_id the document is also added to that user's library index.
+        """
         try:
-            # Read and process the PDF
-            pdf_content = pdf_file.file.read()
-            text = self.extract_text_from_pdf(pdf_content)
-            processed_text = self.preprocess_text(text)
+            if is_large_document(pdf_content):
+                with span("extraction", mode="large"):
+                    processed_text = self.read_large_document(pdf_content, user_id=user_id, filename=filename)
+            else:
+                # Process the PDF
+                with span("extraction"):
+                    text = self.extract_text_from_pdf(pdf_content)
+                with span("preprocess"):
+                    processed_text = self.preprocess_text(text)
+                if user_id:
+                    self.index_document(user_id, pdf_content, processed_text, filename)
             
-            # Print debug info
-            print(f"Generating flashcards with count: {count}")
+            logger.debug("Generating flashcards with count: %s", count)
             
             # Generate flashcards with explicit count parameter
             return self.generate_flashcards(processed_text, count=count, subject=subject)
             
+        except HTTPException:
+            raise
+        except DocumentTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
+    def index_document(self, user_id: str, pdf_content: bytes, processed_text: str, filename: Optional[str] = None) -> int:
+        """Add a processed document to the user's library index (no-op if already indexed)"""
+        with span("library_index"):
+            doc_hash = hashlib.sha256(pdf_content).hexdigest()
+            return get_document_index().index_document(user_id, doc_hash, processed_text, filename)
+
+    def index_upload(self, user_id: str, pdf_content: bytes, filename: Optional[str] = None) -> int:
+        """Extract and index an upload, skipping extraction when it is already in the library"""
+        doc_hash = hashlib.sha256(pdf_content).hexdigest()
+        if get_document_index().has_document(user_id, doc_hash):
+            return 0
+        if is_large_document(pdf_content):
+            budget = MemoryBudget()
+            try:
+                budget.charge(len(pdf_content), "the upload")
+                with span("extraction", mode="large"):
+                    pieces = normalise_pages(iter_page_texts(pdf_content, budget=budget, document_hash=doc_hash))
+                    try:
+                        return get_document_index().index_chunks(user_id, doc_hash, chunk_word_stream(iter_words(pieces)), filename)
+                    finally:
+                        pieces.close()
+            except DocumentTooLarge as e:
+                raise HTTPException(status_code=413, detail=str(e))
+        with span("extraction"):
+            text = self.extract_text_from_pdf(pdf_content)
+        with span("preprocess"):
+            processed_text = self.preprocess_text(text)
+        return self.index_document(user_id, pdf_content, processed_text, filename)
+
+    def generate_from_library(self, user_id: str, subject: str, count: int = 10) -> Dict[str, Any]:
+        """Generate flashcards from the chunks most relevant to subject across the user's whole library."""
+        with span("library_search"):
+            chunks = get_document_index().search(user_id, subject, limit=LIBRARY_TOP_CHUNKS)
+        if not chunks:
+            raise HTTPException(status_code=404, detail=f"No documents in your library match '{subject}'")
+
+        # Keep the best chunks that fit the context budget
+        context, used = [], 0
+        for chunk in chunks:
+            if used + len(chunk["text"]) > LIBRARY_CONTEXT_CHARS and context:
+                break
+            context.append(chunk["text"])
+            used += len(chunk["text"]) + 2
+        return self.generate_flashcards("\n\n".join(context), count=count, subject=subject, max_chars=LIBRARY_CONTEXT_CHARS)
+
     def _parse_flashcards_from_response(self, response_text: str) -> List[Flashcard]:
         """Parse the LLM response to extract flashcards."""
         flashcards = []
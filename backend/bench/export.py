@@ -0,0 +1,93 @@
+"""
+Compare deck export formats: output size, write time and read time.
+Round trips are checked in tests/test_deck_export.py.
+
+Run from the backend directory:
+    python -m bench.export --cards 20000
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from bench.run import RESULTS_DIR
+from services.deck_export import parquet_available, read_apkg, read_binary, read_csv, write_apkg, write_binary, write_csv, write_parquet
+
+WORDS = ("cell", "membrane", "protein", "energy", "enzyme", "gradient", "theorem", "integral", "vector", "matrix",
+         "market", "supply", "demand", "entropy", "reaction", "molecule", "function", "limit", "series", "proof")
+
+
+def synthetic_deck(size: int, seed: int = 0) -> List[Dict]:
+    """Deck of cards with question/answer lengths similar to generated ones"""
+    rng = random.Random(seed)
+    def sentence(words: int) -> str:
+        return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+    return [
+        {
+            "id": str(i + 1),
+            "question": sentence(rng.randint(6, 16)) + "?",
+            "answer": sentence(rng.randint(10, 40)) + ".",
+            "source_file": f"lecture_{i % 24 + 1:02d}.pdf",
+        }
+        for i in range(size)
+    ]
+
+
+def measure(name: str, deck: List[Dict], write, read) -> Dict:
+    started = time.perf_counter()
+    data = b"".join(write(iter(deck)))
+    write_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    restored = list(read(data))
+    read_seconds = time.perf_counter() - started
+    assert len(restored) == len(deck)
+    return {
+        "format": name,
+        "bytes": len(data),
+        "bytes_per_card": round(len(data) / len(deck), 1),
+        "write_ms": round(1000 * write_seconds, 1),
+        "read_ms": round(1000 * read_seconds, 1),
+    }
+
+
+def read_parquet(data: bytes) -> List[Dict]:
+    import pyarrow.parquet as pq  # type: ignore
+    return pq.read_table(io.BytesIO(data)).to_pylist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare deck export formats")
+    parser.add_argument("--cards", type=int, default=10000)
+    parser.add_argument("--output", default=None, help="Result file (default: bench/results/export_<timestamp>.json)")
+    args = parser.parse_args()
+
+    deck = synthetic_deck(args.cards)
+    formats = [
+        ("json", lambda cards: [json.dumps(list(cards)).encode()], lambda data: json.loads(data)),
+        ("csv", write_csv, lambda data: read_csv(io.StringIO(data.decode(), newline=""))),
+        ("binary", write_binary, lambda data: read_binary(io.BytesIO(data))),
+        ("apkg", write_apkg, lambda data: read_apkg(io.BytesIO(data))),
+    ]
+    if parquet_available():
+        formats.append(("parquet", write_parquet, read_parquet))
+
+    results = []
+    for name, write, read in formats:
+        result = measure(name, deck, write, read)
+        results.append(result)
+        print(json.dumps(result))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"cards": args.cards, "results": results}, f, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
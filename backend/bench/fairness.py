@@ -0,0 +1,157 @@
+"""
+Mixed-load fairness benchmark: one heavy user keeps several paper
+generations in flight while light users make flashcard and calendar
+requests one at a time. Reports latency percentiles per class of user, with
+and without the fair-share scheduler (FAIR_SHARE_ENABLED).
+
+Run from the backend directory:
+    python -m bench.fairness --duration 30 --heavy-concurrency 8 --light-users 3
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from bench.run import BACKEND_DIR, DEFAULT_PDF, RESULTS_DIR, free_port, percentile, start_app
+from bench.stubs import StubConfig, install_portia_stub, start_anthropic_stub
+
+
+def summarise(latencies: List[float], statuses: Dict[str, int]) -> Dict:
+    return {
+        "requests": len(latencies),
+        "status_counts": statuses,
+        "p50_ms": round(1000 * percentile(latencies, 50), 1),
+        "p95_ms": round(1000 * percentile(latencies, 95), 1),
+        "p99_ms": round(1000 * percentile(latencies, 99), 1),
+        "max_ms": round(1000 * max(latencies, default=0.0), 1),
+    }
+
+
+async def drive(args) -> Dict:
+    import httpx
+
+    with open(args.pdf, "rb") as f:
+        pdf_bytes = f.read()
+    port = free_port()
+    server, thread = start_app(port)
+    results = {"heavy": ([], {}), "light": ([], {})}
+    deadline = time.monotonic() + args.duration
+
+    async def call(client, kind: str, **request):
+        started = time.perf_counter()
+        try:
+            status = str((await client.request(**request)).status_code)
+        except Exception as e:
+            status = type(e).__name__
+        latencies, statuses = results[kind]
+        latencies.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+        if status == "429":
+            await asyncio.sleep(0.5)
+
+    async def heavy_loop(client, worker: int):
+        index = 0
+        while time.monotonic() < deadline:
+            # Distinct bytes so uploads are neither coalesced nor served from cache
+            pdf = pdf_bytes + f"\n%bench {worker}-{index}\n".encode()
+            index += 1
+            await call(
+                client, "heavy", method="POST", url="/papers/generate", headers={"X-User-Id": "heavy"},
+                files={"pdf_file": ("heavy.pdf", pdf, "application/pdf")}, params={"difficulty": "harder"},
+            )
+
+    async def light_loop(client, user: int):
+        index = 0
+        headers = {"X-User-Id": f"light-{user}"}
+        while time.monotonic() < deadline:
+            index += 1
+            await call(
+                client, "light", method="POST", url="/flashcards", headers=headers,
+                files={"pdf_file": ("light.pdf", pdf_bytes, "application/pdf")},
+                data={"subject": f"Light {user}-{index}", "count": "4"},
+            )
+            body = {"date": "2025-01-01", "start_time": "09:00", "end_time": "17:00", "constraints": []}
+            await call(client, "light", method="POST", url="/calendar/free", headers=headers, json=body)
+            await asyncio.sleep(args.think_time)
+
+    limits = httpx.Limits(max_connections=args.heavy_concurrency + args.light_users + 4)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout, limits=limits) as client:
+        await asyncio.gather(
+            *(heavy_loop(client, i) for i in range(args.heavy_concurrency)),
+            *(light_loop(client, i) for i in range(args.light_users)),
+        )
+        stats = (await client.get("/stats")).json()
+    server.should_exit = True
+    thread.join(timeout=5)
+    report = {kind: summarise(*values) for kind, values in results.items()}
+    report["fair_share"] = {key: value for key, value in stats["fair_share"].items() if key != "top_users"}
+    return report
+
+
+def run_one(args) -> Dict:
+    os.environ["FAIR_SHARE_ENABLED"] = "1" if args.fair_share == "on" else "0"
+    os.environ["FAIR_SHARE_CONCURRENCY"] = str(args.concurrency)
+    os.environ["LLM_OUTPUT_TOKENS_PER_MINUTE"] = str(args.output_tokens_per_minute)
+    os.environ["LLM_INPUT_TOKENS_PER_MINUTE"] = str(args.input_tokens_per_minute)
+    config = StubConfig(latency=args.llm_latency, output_tokens_per_second=args.tokens_per_second, portia_latency=args.portia_latency)
+    stub = start_anthropic_stub(config)
+    install_portia_stub(config)
+    os.environ["ANTHROPIC_BASE_URL"] = f"http://127.0.0.1:{stub.server_address[1]}"
+    os.environ["ANTHROPIC_API_KEY"] = "stub-key"
+    os.environ["PORTIA_API_KEY"] = "stub-key"
+    state_dir = tempfile.mkdtemp(prefix="bench_state_")
+    os.environ["STATE_BACKEND_URL"] = f"sqlite:///{state_dir}/state.db"
+    os.environ["CALENDAR_MIRROR_PATH"] = os.path.join(state_dir, "calendar_mirror.db")
+    report = asyncio.run(drive(args))
+    stub.shutdown()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency for light users under a heavy user's load")
+    parser.add_argument("--fair-share", choices=("on", "off", "both"), default="both")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--concurrency", type=int, default=4, help="FAIR_SHARE_CONCURRENCY for the worker")
+    parser.add_argument("--heavy-concurrency", type=int, default=8, help="Paper requests the heavy user keeps in flight")
+    parser.add_argument("--light-users", type=int, default=3)
+    parser.add_argument("--think-time", type=float, default=0.5, help="Pause between a light user's rounds")
+    parser.add_argument("--pdf", default=DEFAULT_PDF)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--portia-latency", type=float, default=1.0)
+    parser.add_argument("--output-tokens-per-minute", type=int, default=80000, help="LLM output token rate limit")
+    parser.add_argument("--input-tokens-per-minute", type=int, default=400000, help="LLM input token rate limit")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", default=None, help="Result file (default: bench/results/fairness_<timestamp>.json)")
+    args = parser.parse_args()
+
+    if args.fair_share != "both":
+        report = run_one(args)
+    else:
+        # Each mode in a fresh process, since the scheduler is configured at import
+        report = {}
+        for mode in ("off", "on"):
+            with tempfile.NamedTemporaryFile(suffix=".json") as f:
+                subprocess.run(
+                    [sys.executable, "-m", "bench.fairness", *sys.argv[1:], "--fair-share", mode, "--output", f.name],
+                    cwd=BACKEND_DIR, check=True, stdout=subprocess.DEVNULL,
+                )
+                report[mode] = json.load(f)["results"]
+
+    print(json.dumps(report, indent=2))
+    output = args.output or os.path.join(RESULTS_DIR, f"fairness_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"config": {key: value for key, value in vars(args).items() if key != "output"}, "results": report}, f, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
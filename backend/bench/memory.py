@@ -0,0 +1,171 @@
+"""
+Memory profile of flashcard generation for large documents. Each request
+runs in a fresh process so its peak RSS can be measured against a baseline
+taken after startup, comparing the whole-document path with large-document
+mode (LARGE_DOCUMENT_BYTES). Exits non-zero if large-document mode goes over
+--cap-mb for any scenario.
+
+Run from the backend directory:
+    python -m bench.memory --pages 500 --cap-mb 16
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime
+from typing import Dict, List
+
+from bench.run import BACKEND_DIR, RESULTS_DIR
+from bench.stubs import StubConfig, install_portia_stub, start_anthropic_stub
+
+SCENARIOS = ("flashcards", "library")
+MODES = ("whole", "large")
+
+WORDS = (
+    "energy cell membrane protein enzyme reaction glucose oxygen carbon light chloroplast "
+    "mitochondria respiration diffusion osmosis gradient substrate catalyst molecule structure"
+).split()
+
+
+def synthetic_pdf(pages: int, lines_per_page: int = 45, image_kb: int = 6, seed: int = 0) -> bytes:
+    """
+    A textbook-like PDF: every page has lines_per_page lines of text and an
+    incompressible image of image_kb KB, so 500 pages come to a few MB.
+    """
+    rng = random.Random(seed)
+    objects: List[bytes] = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add(b"")
+    kids = []
+    for page in range(pages):
+        lines = []
+        for line in range(lines_per_page):
+            words = " ".join(rng.choice(WORDS) for _ in range(12))
+            lines.append(f"BT /F1 9 Tf 36 {770 - 16 * line} Td (Page {page + 1}: {words}) Tj ET")
+        lines.append("q 64 0 0 64 500 20 cm /Im1 Do Q")
+        content = zlib.compress("\n".join(lines).encode())
+        contents = add(b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(content), content))
+        pixels = rng.getrandbits(8 * image_kb * 1024).to_bytes(image_kb * 1024, "little")
+        image = add(
+            b"<< /Type /XObject /Subtype /Image /Width %d /Height 32 /ColorSpace /DeviceGray "
+            b"/BitsPerComponent 8 /Length %d >>\nstream\n%s\nendstream" % (len(pixels) // 32, len(pixels), pixels)
+        )
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> /XObject << /Im1 %d 0 R >> >> >>" % (pages_id, contents, font, image)
+        ))
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), pages)
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(args) -> Dict:
+    """Run one request in this (fresh) process and report its peak RSS above the baseline"""
+    stub = start_anthropic_stub(StubConfig(latency=0.0, output_tokens_per_second=1e9))
+    install_portia_stub(StubConfig())
+    state_dir = tempfile.mkdtemp(prefix="bench_state_")
+    os.environ.update({
+        "ANTHROPIC_BASE_URL": f"http://127.0.0.1:{stub.server_address[1]}",
+        "ANTHROPIC_API_KEY": "stub-key",
+        "STATE_BACKEND_URL": f"sqlite:///{state_dir}/state.db",
+        "DOC_INDEX_PATH": os.path.join(state_dir, "doc_index.db"),
+        # Whole-document path for every upload, or large-document mode for every upload
+        "LARGE_DOCUMENT_BYTES": str(2 ** 62 if args.mode == "whole" else 0),
+    })
+    from FlashCardTools import FlashcardGenerator
+
+    with open(args.pdf, "rb") as f:
+        pdf_content = f.read()
+    generator = FlashcardGenerator()
+    # Warm up imports, the client and the index on a small document first
+    generator.generate_from_content(synthetic_pdf(2, seed=1), count=4, user_id="warmup")
+    baseline = peak_rss_mb()
+
+    user_id = "bench" if args.scenario == "library" else None
+    started = time.perf_counter()
+    result = generator.generate_from_content(pdf_content, count=8, user_id=user_id)
+    elapsed = time.perf_counter() - started
+    stub.shutdown()
+    return {
+        "peak_mb_above_baseline": round(peak_rss_mb() - baseline, 1),
+        "baseline_mb": round(baseline, 1),
+        "seconds": round(elapsed, 2),
+        "cards": len(result["flashcards"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS per flashcard request for large documents")
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--image-kb", type=int, default=6, help="Incompressible image bytes per page (KB)")
+    parser.add_argument("--cap-mb", type=float, default=16.0, help="Largest allowed peak RSS above baseline in large-document mode")
+    parser.add_argument("--output", default=None, help="Result file (default: bench/results/memory_<timestamp>.json)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--scenario", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--pdf", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args)))
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(synthetic_pdf(args.pages, image_kb=args.image_kb))
+        pdf_path = f.name
+    print(f"{args.pages}-page input: {os.path.getsize(pdf_path) / 1024 / 1024:.1f} MB")
+
+    results: Dict[str, Dict] = {}
+    failed = []
+    try:
+        for scenario in SCENARIOS:
+            for mode in MODES:
+                completed = subprocess.run(
+                    [sys.executable, "-m", "bench.memory", "--child", "--mode", mode, "--scenario", scenario, "--pdf", pdf_path],
+                    cwd=BACKEND_DIR, check=True, capture_output=True, text=True,
+                )
+                result = json.loads(completed.stdout.strip().splitlines()[-1])
+                results[f"{scenario}_{mode}"] = result
+                print(f"{scenario} ({mode}): {json.dumps(result)}")
+                if mode == "large" and result["peak_mb_above_baseline"] > args.cap_mb:
+                    failed.append(f"{scenario}: {result['peak_mb_above_baseline']} MB > {args.cap_mb} MB")
+    finally:
+        os.remove(pdf_path)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"memory_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"pages": args.pages, "cap_mb": args.cap_mb, "results": results}, f, indent=2)
+    print(f"Saved results to {output}")
+    if failed:
+        sys.exit("Peak RSS over the cap in large-document mode: " + "; ".join(failed))
+
+
+if __name__ == "__main__":
+    main()
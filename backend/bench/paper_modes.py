@@ -0,0 +1,95 @@
+"""
+Compare paper generation modes against the local Anthropic stub: one call to
+the strong model for the whole paper ("single") versus a fast-model draft
+reviewed by the strong model, which returns only edited questions ("draft_refine").
+Reports wall time and output tokens per model for each mode.
+
+Run from the backend directory:
+    python -m bench.paper_modes --questions 12 --runs 3
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import string
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict
+
+from bench.run import RESULTS_DIR
+from bench.stubs import StubConfig, install_portia_stub, start_anthropic_stub
+
+
+def source_paper(questions: int, seed: int) -> str:
+    """A source paper whose wording does not match any stub output, so the question bank never covers it"""
+    rng = random.Random(seed)
+    word = lambda: "".join(rng.choice(string.ascii_lowercase) for _ in range(8))
+    parts = [f"# Source Paper {seed}", f"## Section {word()}", ""]
+    for i in range(1, questions + 1):
+        parts += [f"### Question {i} (10 marks)", f"Describe how {word()} affects {word()} in {word()} systems.", ""]
+    return "\n".join(parts)
+
+
+async def run_mode(service, mode: str, args, handler) -> Dict:
+    timings = []
+    before = dict(handler.output_tokens_by_model)
+    for run in range(args.runs):
+        text = source_paper(args.questions, seed=hash((mode, run)) & 0xFFFF)
+        started = time.perf_counter()
+        content = await service.compose_paper_content(text, "harder", mode)
+        timings.append(time.perf_counter() - started)
+    tokens = {
+        model: (count - before.get(model, 0)) // args.runs
+        for model, count in handler.output_tokens_by_model.items()
+        if count != before.get(model, 0)
+    }
+    return {
+        "mean_seconds": round(sum(timings) / len(timings), 3),
+        "min_seconds": round(min(timings), 3),
+        "output_tokens_per_paper": tokens,
+        "paper_chars": len(content),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single-call and draft-then-refine paper generation")
+    parser.add_argument("--questions", type=int, default=12)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Strong model output rate")
+    parser.add_argument("--fast-model-speedup", type=float, default=4.0)
+    parser.add_argument("--output", default=None, help="Result file (default: bench/results/paper_modes_<timestamp>.json)")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=args.llm_latency,
+        output_tokens_per_second=args.tokens_per_second,
+        fast_model_speedup=args.fast_model_speedup,
+    )
+    stub = start_anthropic_stub(config)
+    install_portia_stub(config)
+    state_dir = tempfile.mkdtemp(prefix="bench_state_")
+    os.environ["ANTHROPIC_BASE_URL"] = f"http://127.0.0.1:{stub.server_address[1]}"
+    os.environ["ANTHROPIC_API_KEY"] = "stub-key"
+    os.environ["PORTIA_API_KEY"] = "stub-key"
+    os.environ["STATE_BACKEND_URL"] = f"sqlite:///{state_dir}/state.db"
+    os.environ["QUESTION_BANK_PATH"] = os.path.join(state_dir, "question_bank.db")
+
+    from services.paper_generator import PAPER_MODES, PaperGeneratorService
+    service = PaperGeneratorService()
+    results = {mode: asyncio.run(run_mode(service, mode, args, stub.RequestHandlerClass)) for mode in PAPER_MODES}
+
+    for mode, result in results.items():
+        print(f"{mode}: {json.dumps(result)}")
+    output = args.output or os.path.join(RESULTS_DIR, f"paper_modes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"config": {key: value for key, value in vars(args).items() if key != "output"}, "results": results}, f, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Measure response payloads: serialization time and bytes on the wire for
+flashcard decks and free-time results, before and after structured responses.
+
+Run from the backend directory:
+    python -m bench.payloads --cards 5000
+"""
+
+import argparse
+import gzip
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict
+
+from bench.export import synthetic_deck
+from bench.run import RESULTS_DIR
+
+
+def timed(render: Callable[[], bytes], repeat: int) -> Dict:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = render()
+    elapsed = (time.perf_counter() - started) / repeat
+    sizes = {"bytes": len(body), "gzip_bytes": len(gzip.compress(body, 6))}
+    try:
+        import brotli  # type: ignore
+        sizes["brotli_bytes"] = len(brotli.compress(body, quality=5))
+    except ImportError:
+        pass
+    return {"serialize_ms": round(1000 * elapsed, 3), **sizes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare response payload encodings")
+    parser.add_argument("--cards", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", default=None, help="Result file (default: bench/results/payloads_<timestamp>.json)")
+    args = parser.parse_args()
+    os.environ.setdefault("STATE_BACKEND_URL", f"sqlite:///{tempfile.mkdtemp(prefix='bench_state_')}/state.db")
+
+    from fastapi.responses import JSONResponse
+    from services.http_responses import DefaultResponse
+
+    cards = [{key: card[key] for key in ("id", "question", "answer")} for card in synthetic_deck(args.cards)]
+    slots = [{"start": f"2025-01-01T{h:02d}:00:00", "end": f"2025-01-01T{h:02d}:30:00"} for h in range(8, 22)]
+    free_time = {"success": True, "date": "2025-01-01", "free_slots": slots, "full_response": {}}
+
+    results = {
+        "flashcards_before": timed(lambda: JSONResponse({"flashcards": json.dumps(cards)}).body, args.repeat),
+        "flashcards_after": timed(lambda: DefaultResponse({"flashcards": cards}).body, args.repeat),
+        "free_time_before": timed(lambda: JSONResponse(json.dumps(free_time, indent=2)).body, args.repeat),
+        "free_time_after": timed(lambda: DefaultResponse(free_time).body, args.repeat),
+    }
+
+    # End to end through the app: compressed transfer and conditional GET of a stored deck
+    from fastapi.testclient import TestClient
+    from main import app
+    from services.state_backend import get_state_backend
+
+    get_state_backend().set_json("deck:bench", cards, 600)
+    client = TestClient(app)
+    plain = client.get("/flashcards/decks/bench", headers={"Accept-Encoding": "identity"})
+    compressed = client.get("/flashcards/decks/bench", headers={"Accept-Encoding": "br, gzip"})
+    revalidated = client.get("/flashcards/decks/bench", headers={"If-None-Match": compressed.headers["etag"]})
+    results["deck_endpoint"] = {
+        "identity_wire_bytes": plain.num_bytes_downloaded,
+        "compressed_wire_bytes": compressed.num_bytes_downloaded,
+        "content_encoding": compressed.headers.get("content-encoding"),
+        "revalidated_status": revalidated.status_code,
+        "revalidated_wire_bytes": revalidated.num_bytes_downloaded,
+    }
+
+    for name, result in results.items():
+        print(f"{name}: {json.dumps(result)}")
+    output = args.output or os.path.join(RESULTS_DIR, f"payloads_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"cards": args.cards, "results": results}, f, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
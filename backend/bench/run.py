@@ -0,0 +1,212 @@
+"""
+Benchmark the API end to end against local stubs for Anthropic and Portia.
+
+Run from the backend directory:
+    python -m bench.run --requests 50 --concurrency 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+from bench.stubs import StubConfig, install_portia_stub, start_anthropic_stub
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PDF = os.path.join(os.path.dirname(BACKEND_DIR), "testpdf.pdf")
+RESULTS_DIR = os.path.join(BACKEND_DIR, "bench", "results")
+ENDPOINTS = ("flashcards", "papers", "calendar_free", "calendar_event")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    """Peak resident set size in MB of this process, or of the largest child process"""
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def build_request(endpoint: str, index: int, pdf_bytes: bytes, distinct: bool) -> Dict[str, Any]:
+    """Keyword arguments for httpx.AsyncClient.request for one benchmark call"""
+    pdf = {"pdf_file": ("testpdf.pdf", pdf_bytes, "application/pdf")}
+    if endpoint == "flashcards":
+        subject = f"Benchmark {index}" if distinct else "Benchmark"
+        return {"method": "POST", "url": "/flashcards", "files": pdf, "data": {"subject": subject, "count": "8"}}
+    if endpoint == "papers":
+        return {"method": "POST", "url": "/papers/generate", "files": pdf, "params": {"difficulty": "same"}}
+    if endpoint == "calendar_free":
+        body = {"date": "2025-01-01", "start_time": "09:00", "end_time": "17:00", "constraints": []}
+        return {"method": "POST", "url": "/calendar/free", "json": body}
+    if endpoint == "calendar_event":
+        body = {"start": "2025-01-01T10:00:00", "end": "2025-01-01T11:00:00", "summary": f"Benchmark {index}"}
+        return {"method": "POST", "url": "/calendar/event", "json": body}
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+async def run_endpoint(client, endpoint: str, args, pdf_bytes: bytes) -> Dict[str, Any]:
+    """Drive one endpoint with a fixed number of requests at a fixed concurrency"""
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: List[float] = []
+    status_counts: Dict[str, int] = {}
+
+    async def one(index: int):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.request(**build_request(endpoint, index, pdf_bytes, args.distinct))
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            status_counts[status] = status_counts.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    wall = time.perf_counter() - started
+
+    return {
+        "requests": args.requests,
+        "errors": sum(count for status, count in status_counts.items() if status != "200"),
+        "status_counts": status_counts,
+        "p50_ms": round(1000 * percentile(latencies, 50), 2),
+        "p95_ms": round(1000 * percentile(latencies, 95), 2),
+        "p99_ms": round(1000 * percentile(latencies, 99), 2),
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        "throughput_rps": round(args.requests / wall, 2) if wall else 0.0,
+        "wall_seconds": round(wall, 3),
+    }
+
+
+def start_app(port: int):
+    """Import the app (after the stubs are in place) and serve it on a background thread"""
+    import uvicorn
+    from main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, thread
+
+
+def start_workers(port: int, workers: int, timeout: float = 60.0) -> subprocess.Popen:
+    """Start serve.py with several worker processes and wait until it answers"""
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), PORT=str(port), HOST="127.0.0.1", LOG_LEVEL="warning")
+    process = subprocess.Popen([sys.executable, "serve.py"], cwd=BACKEND_DIR, env=env)
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise TimeoutError("serve.py did not start within the timeout")
+
+
+async def main_async(args) -> Dict[str, Any]:
+    import httpx
+
+    with open(args.pdf, "rb") as f:
+        pdf_bytes = f.read()
+
+    port = free_port()
+    boot_started = time.perf_counter()
+    if args.workers > 1:
+        process = start_workers(port, args.workers)
+    else:
+        server, thread = start_app(port)
+    boot_seconds = time.perf_counter() - boot_started
+
+    results: Dict[str, Any] = {}
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=timeout) as client:
+        for endpoint in args.endpoints:
+            results[endpoint] = await run_endpoint(client, endpoint, args, pdf_bytes)
+            print(f"{endpoint}: {json.dumps(results[endpoint])}")
+
+    if args.workers > 1:
+        process.terminate()
+        process.wait()
+    else:
+        server.should_exit = True
+        thread.join(timeout=5)
+    return {"boot_seconds": round(boot_seconds, 3), "endpoints": results}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the StudentTools API against local stubs")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=20, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1, help="Run serve.py with this many worker processes")
+    parser.add_argument("--pdf", default=DEFAULT_PDF)
+    parser.add_argument("--distinct", action="store_true", help="Vary parameters so requests cannot be coalesced")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Stub time to first token in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Stub output token rate")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub LLM calls that return 529")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Stub LLM requests per second before 429")
+    parser.add_argument("--portia-latency", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", default=None, help="Result file (default: bench/results/<timestamp>.json)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = StubConfig(
+        latency=args.llm_latency,
+        output_tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        max_requests_per_second=args.rate_limit,
+        portia_latency=args.portia_latency,
+    )
+    stub = start_anthropic_stub(config)
+    install_portia_stub(config)
+    os.environ["ANTHROPIC_BASE_URL"] = f"http://127.0.0.1:{stub.server_address[1]}"
+    os.environ["ANTHROPIC_API_KEY"] = "stub-key"
+    os.environ["PORTIA_API_KEY"] = "stub-key"
+    # Fresh shared state per run so results cached by earlier runs are not reused
+    os.environ["STATE_BACKEND_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='bench_state_')}/state.db"
+
+    report = asyncio.run(main_async(args))
+    report.update({
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "peak_worker_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        "llm_calls": stub.RequestHandlerClass.calls,
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+    })
+    stub.shutdown()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Compare search tool strategies against the local stub search API: one fresh
+request per query (the old behaviour), the pooled client one query at a time,
+a concurrent batch, and a repeated batch served from the cache.
+
+Run from the backend directory:
+    python -m bench.search --queries 6 --latency 0.3
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench.run import BACKEND_DIR
+from bench.stubs import StubConfig, install_portia_stub, start_search_stub
+
+
+def load_search_tool():
+    """search-tool.py is not importable by name because of the hyphen"""
+    spec = importlib.util.spec_from_file_location("search_tool", os.path.join(BACKEND_DIR, "search-tool.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["search_tool"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return round(time.perf_counter() - started, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the search tool against a stub search API")
+    parser.add_argument("--queries", type=int, default=6)
+    parser.add_argument("--latency", type=float, default=0.3, help="Stub search latency in seconds")
+    args = parser.parse_args()
+
+    stub = start_search_stub(args.latency)
+    install_portia_stub(StubConfig())
+    os.environ["SEARCH_API_URL"] = f"http://127.0.0.1:{stub.server_address[1]}/search"
+    os.environ["TAVILY_API_KEY"] = "stub-key"
+    os.environ["STATE_BACKEND_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='bench_state_')}/state.db"
+
+    import httpx
+    search_tool = load_search_tool()
+    tool = search_tool.SearchTool()
+
+    def fresh_requests():
+        for i in range(args.queries):
+            payload = {"query": f"fresh query {i}", "include_answer": True, "api_key": "stub-key"}
+            httpx.post(os.environ["SEARCH_API_URL"], json=payload).raise_for_status()
+
+    def pooled_serial():
+        for i in range(args.queries):
+            tool.run(None, f"serial query {i}")
+
+    queries = [f"batch query {i}" for i in range(args.queries)]
+    results = {
+        "fresh_request_per_query_s": timed(fresh_requests),
+        "pooled_one_at_a_time_s": timed(pooled_serial),
+        "batch_s": timed(lambda: tool.run(None, queries[0], queries[1:])),
+        "batch_cached_s": timed(lambda: tool.run(None, queries[0].upper(), queries[1:])),
+        "merged_results": len(tool.run(None, queries[0], queries[1:])),
+        "stub_calls": stub.RequestHandlerClass.calls,
+    }
+    print(json.dumps(results, indent=2))
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Measure cold start: import time, time to first request and baseline RSS.
+Then, against the local Anthropic stub, compare the latency of the first
+flashcard request after a worker reports ready with the steady-state
+latency of the requests that follow, with startup warm-up (WARMUP_ENABLED)
+on and off.
+
+Run from the backend directory:
+    python -m bench.startup --runs 5
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict
+
+from bench.run import BACKEND_DIR, DEFAULT_PDF, RESULTS_DIR, free_port, percentile
+from bench.stubs import StubConfig, install_portia_stub, start_anthropic_stub
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import main; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def rss_mb(pid: int) -> float:
+    """Current resident set size of a process in MB (Linux only)"""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def measure_import() -> float:
+    """Seconds taken by `import main` in a fresh interpreter"""
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR)
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def measure_first_request(timeout: float) -> Dict[str, float]:
+    """Start uvicorn in a fresh process and time until GET / first succeeds"""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+    )
+    try:
+        request = "GET / HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n".encode()
+        while time.perf_counter() - started < timeout:
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=1) as sock:
+                    sock.sendall(request)
+                    if sock.recv(64).startswith(b"HTTP/1.1 200"):
+                        first_request = time.perf_counter() - started
+                        return {"first_request_seconds": first_request, "baseline_rss_mb": rss_mb(process.pid)}
+            except OSError:
+                time.sleep(0.02)
+        raise TimeoutError("Server did not answer within the timeout")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def measure_first_vs_steady(warmup: bool, pdf_bytes: bytes, steady_requests: int, timeout: float) -> Dict[str, float]:
+    """
+    Start uvicorn with warm-up on or off, wait until it reports ready (GET /ready,
+    or GET / without warm-up), then time one flashcard request followed by steady_requests more
+    """
+    import httpx
+
+    state_dir = tempfile.mkdtemp(prefix="bench_state_")
+    env = dict(
+        os.environ,
+        WARMUP_ENABLED="1" if warmup else "0",
+        STATE_BACKEND_URL=f"sqlite:///{state_dir}/state.db",
+        DOC_INDEX_PATH=os.path.join(state_dir, "doc_index.db"),
+        QUESTION_BANK_PATH=os.path.join(state_dir, "question_bank.db"),
+        CALENDAR_MIRROR_PATH=os.path.join(state_dir, "calendar_mirror.db"),
+    )
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=timeout) as client:
+            while True:
+                if time.perf_counter() - started > timeout:
+                    raise TimeoutError("Server did not report ready within the timeout")
+                try:
+                    if client.get("/ready" if warmup else "/").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.02)
+            ready = time.perf_counter() - started
+
+            latencies = []
+            for index in range(steady_requests + 1):
+                # A new subject every time, so no request is served from the result cache
+                request_started = time.perf_counter()
+                response = client.post(
+                    "/flashcards",
+                    files={"pdf_file": ("startup.pdf", pdf_bytes, "application/pdf")},
+                    data={"subject": f"Startup {index}", "count": "4"},
+                )
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - request_started)
+        return {"ready_seconds": ready, "first_seconds": latencies[0], "steady_seconds": percentile(latencies[1:], 50)}
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def first_vs_steady(args) -> Dict[str, Any]:
+    """First-request and steady-state flashcard latency, with warm-up off and on"""
+    stub = start_anthropic_stub(StubConfig(latency=args.llm_latency, output_tokens_per_second=1e9))
+    install_portia_stub(StubConfig())
+    os.environ["ANTHROPIC_BASE_URL"] = f"http://127.0.0.1:{stub.server_address[1]}"
+    os.environ["ANTHROPIC_API_KEY"] = "stub-key"
+    os.environ["PORTIA_API_KEY"] = "stub-key"
+    with open(args.pdf, "rb") as f:
+        pdf_bytes = f.read()
+
+    report: Dict[str, Any] = {}
+    try:
+        for warmup in (False, True):
+            runs = [measure_first_vs_steady(warmup, pdf_bytes, args.steady_requests, args.timeout) for _ in range(args.runs)]
+            first = percentile([run["first_seconds"] for run in runs], 50)
+            steady = percentile([run["steady_seconds"] for run in runs], 50)
+            report["warmup_on" if warmup else "warmup_off"] = {
+                "ready_ms_p50": round(1000 * percentile([run["ready_seconds"] for run in runs], 50), 1),
+                "first_request_ms_p50": round(1000 * first, 1),
+                "steady_request_ms_p50": round(1000 * steady, 1),
+                "first_over_steady": round(first / steady, 2),
+            }
+    finally:
+        stub.shutdown()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure StudentTools API cold start")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--steady-requests", type=int, default=5, help="Flashcard requests timed after the first one")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Stub LLM latency per call (seconds)")
+    parser.add_argument("--pdf", default=DEFAULT_PDF)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    imports, first_requests, rss = [], [], []
+    for _ in range(args.runs):
+        imports.append(measure_import())
+        result = measure_first_request(args.timeout)
+        first_requests.append(result["first_request_seconds"])
+        rss.append(result["baseline_rss_mb"])
+
+    report: Dict[str, Any] = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "runs": args.runs,
+        "import_ms_p50": round(1000 * percentile(imports, 50), 1),
+        "first_request_ms_p50": round(1000 * percentile(first_requests, 50), 1),
+        "first_request_ms_max": round(1000 * max(first_requests), 1),
+        "baseline_rss_mb_p50": round(percentile(rss, 50), 1),
+        "first_vs_steady": first_vs_steady(args),
+    }
+    print(json.dumps(report, indent=2))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"startup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Fake portia package used by the benchmarks. It is put on the import path
+(including for worker subprocesses via PYTHONPATH) instead of the real SDK,
+and answers calendar plans after BENCH_PORTIA_LATENCY seconds.
+"""
+
+import json
+import os
+import time
+from types import SimpleNamespace
+
+LLMProvider = SimpleNamespace(ANTHROPIC="anthropic")
+LLMModel = SimpleNamespace(CLAUDE_3_5_SONNET="claude-3-5-sonnet")
+
+
+class Config:
+    @classmethod
+    def from_default(cls, **kwargs):
+        return cls()
+
+
+class _RunResult:
+    def __init__(self, data):
+        self.data = data
+
+    def model_dump(self):
+        return self.data
+
+
+class Portia:
+    def __init__(self, config=None, **kwargs):
+        self.config = config
+
+    def plan(self, prompt: str):
+        return prompt
+
+    def run_plan(self, plan):
+        time.sleep(float(os.getenv("BENCH_PORTIA_LATENCY", "1.0")))
+        if "Create a new Google Calendar event" in plan:
+            return _RunResult({"final_output": {"value": "Event created"}})
+        if "List the events" in plan:
+            events = [
+                {"id": "stub-1", "summary": "Lecture", "start": "2025-01-01T09:00:00", "end": "2025-01-01T10:00:00"},
+                {"id": "stub-2", "summary": "Lab", "start": "2025-01-01T11:00:00", "end": "2025-01-01T14:00:00"},
+            ]
+            return _RunResult({"outputs": {"step_outputs": {"$events": {"value": json.dumps(events)}}}})
+        slots = [
+            {"start": "2025-01-01T10:00:00", "end": "2025-01-01T11:00:00"},
+            {"start": "2025-01-01T14:00:00", "end": "2025-01-01T15:30:00"},
+        ]
+        return _RunResult({"outputs": {"step_outputs": {"$availability": {"value": json.dumps(slots)}}}})
@@ -0,0 +1,9 @@
+"""Fake portia.errors for the benchmarks."""
+
+
+class ToolHardError(Exception):
+    pass
+
+
+class ToolSoftError(Exception):
+    pass
@@ -0,0 +1,20 @@
+"""Fake portia.tool for the benchmarks: just enough to define and call tools."""
+
+from typing import Generic, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+
+class ToolRunContext(BaseModel):
+    pass
+
+
+class Tool(BaseModel, Generic[T]):
+    id: str
+    name: str
+    description: str
+    args_schema: type[BaseModel]
+    output_schema: tuple[str, str]
+    should_summarize: bool = False
@@ -0,0 +1,277 @@
+"""Local stand-ins for the Anthropic messages API and Portia used by the benchmarks."""
+
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+
+class StubConfig:
+    """Latency, throughput and error-injection settings shared by the stubs."""
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        output_tokens_per_second: float = 200.0,
+        error_rate: float = 0.0,
+        max_requests_per_second: Optional[float] = None,
+        portia_latency: float = 1.0,
+        fast_model_speedup: float = 4.0,
+    ):
+        self.latency = latency
+        self.output_tokens_per_second = output_tokens_per_second
+        self.error_rate = error_rate
+        self.max_requests_per_second = max_requests_per_second
+        self.portia_latency = portia_latency
+        # Haiku-class models stream output this many times faster
+        self.fast_model_speedup = fast_model_speedup
+
+
+def _flashcards(count: int):
+    return [
+        {"id": str(i), "question": f"Stub question {i}?", "answer": f"Stub answer {i}."}
+        for i in range(1, count + 1)
+    ]
+
+
+def _paper(questions: int = 8) -> str:
+    parts = ["# Stub Examination Paper", "## General Instructions", "- Time allowed: 2 hours", ""]
+    for i in range(1, questions + 1):
+        parts += [f"### Question {i} (10 marks)", f"Explain stub concept number {i}.", "", "a) Define it", "b) Give an example", ""]
+    return "\n".join(parts)
+
+
+def _paper_edits(questions: int):
+    """Replacements for every fourth question, as a reviewing model would return"""
+    return [
+        {"question": i, "marks": 10, "body": f"Explain refined stub concept number {i}.\n\na) Define it precisely\nb) Give an example"}
+        for i in range(1, questions + 1, 4)
+    ]
+
+
+class StubAnthropicHandler(BaseHTTPRequestHandler):
+    """Serves POST /v1/messages with canned flashcards, exam papers or paper edits, and GET /v1/models."""
+
+    config: StubConfig = StubConfig()
+    lock = threading.Lock()
+    window_start = 0.0
+    window_count = 0
+    calls = 0
+    output_tokens_by_model: Dict[str, int] = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _rate_limited(self) -> bool:
+        limit = self.config.max_requests_per_second
+        if not limit:
+            return False
+        cls = type(self)
+        with cls.lock:
+            now = time.monotonic()
+            if now - cls.window_start >= 1.0:
+                cls.window_start = now
+                cls.window_count = 0
+            cls.window_count += 1
+            return cls.window_count > limit
+
+    def _send(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        # Startup warm-up lists models to open connections
+        self._send(200, {"data": [], "has_more": False, "first_id": None, "last_id": None})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        with type(self).lock:
+            type(self).calls += 1
+
+        if self._rate_limited():
+            error = {"type": "error", "error": {"type": "rate_limit_error", "message": "Stub rate limit"}}
+            return self._send(429, error, {"retry-after": "1"})
+        if random.random() < self.config.error_rate:
+            error = {"type": "error", "error": {"type": "overloaded_error", "message": "Stub overload"}}
+            return self._send(529, error)
+
+        prompt = json.dumps(request.get("messages", []))
+        match = re.search(r"EXACTLY (\d+)", prompt)
+        count = int(match.group(1)) if match else 8
+        # Papers are as long as the source paper in the prompt
+        questions = len(set(re.findall(r"Question (\d+) \(", prompt))) or 8
+
+        if request.get("tools") and request["tools"][0]["name"] == "record_paper_edits":
+            edits = _paper_edits(questions)
+            content = [{"type": "tool_use", "id": "toolu_stub", "name": "record_paper_edits", "input": {"edits": edits}}]
+            output_text = json.dumps(edits)
+        elif request.get("tools"):
+            tool = request["tools"][0]
+            cards = _flashcards(count)
+            content = [{"type": "tool_use", "id": "toolu_stub", "name": tool["name"], "input": {"flashcards": cards}}]
+            output_text = json.dumps(cards)
+        elif "flashcard" in json.dumps(request.get("system", "")).lower():
+            output_text = json.dumps({"flashcards": _flashcards(count)})
+            content = [{"type": "text", "text": output_text}]
+        else:
+            output_text = _paper(questions)
+            content = [{"type": "text", "text": output_text}]
+
+        model = request.get("model", "stub")
+        output_tokens = max(1, len(output_text) // 4)
+        tokens_per_second = self.config.output_tokens_per_second
+        if "haiku" in model:
+            tokens_per_second *= self.config.fast_model_speedup
+        with type(self).lock:
+            type(self).output_tokens_by_model[model] = type(self).output_tokens_by_model.get(model, 0) + output_tokens
+        time.sleep(self.config.latency + output_tokens / tokens_per_second)
+
+        self._send(200, {
+            "id": "msg_stub",
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": content,
+            "stop_reason": "tool_use" if request.get("tools") else "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": max(1, len(prompt) // 4), "output_tokens": output_tokens},
+        })
+
+
+def start_anthropic_stub(config: StubConfig, port: int = 0) -> ThreadingHTTPServer:
+    """Start the stub messages API on a background thread and return the server"""
+    handler = type("ConfiguredStubAnthropicHandler", (StubAnthropicHandler,), {"config": config})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+STUB_PACKAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_packages")
+
+
+def install_portia_stub(config: StubConfig) -> None:
+    """
+    Put the fake portia package ahead of the real SDK on the import path, for
+    this process and for worker subprocesses. Must run before the app modules are imported.
+    """
+    os.environ["BENCH_PORTIA_LATENCY"] = str(config.portia_latency)
+    os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [STUB_PACKAGES_DIR, os.getenv("PYTHONPATH")]))
+    sys.path.insert(0, STUB_PACKAGES_DIR)
+    sys.modules.pop("portia", None)
+
+
+class FakeCalendarProvider:
+    """
+    In-memory calendar with Google-style incremental sync tokens, for exercising
+    the calendar mirror (CALENDAR_PROVIDER=bench.stubs:FakeCalendarProvider).
+    Every change is appended to a log and a sync token is a position in it;
+    tokens from before the last compaction are rejected like expired Google tokens.
+    """
+    supports_sync_tokens = True
+
+    def __init__(self):
+        from services.calendar_mirror import CalendarChanges, SyncTokenExpired
+        self._changes_type = CalendarChanges
+        self._expired_type = SyncTokenExpired
+        self.lock = threading.Lock()
+        self.events: Dict[str, Dict[str, Dict]] = {}
+        self.log: Dict[str, list] = {}
+        self.compacted: Dict[str, int] = {}
+        self.sync_calls = 0
+
+    def put_event(self, user_id: str, event: Dict) -> None:
+        with self.lock:
+            self.events.setdefault(user_id, {})[event["id"]] = event
+            self.log.setdefault(user_id, []).append(("put", event))
+
+    def delete_event(self, user_id: str, event_id: str) -> None:
+        with self.lock:
+            self.events.get(user_id, {}).pop(event_id, None)
+            self.log.setdefault(user_id, []).append(("delete", event_id))
+
+    def compact(self, user_id: str) -> None:
+        """Invalidate every sync token issued so far"""
+        with self.lock:
+            self.compacted[user_id] = len(self.log.get(user_id, []))
+
+    def sync(self, user_id: str, sync_token: Optional[str]):
+        with self.lock:
+            self.sync_calls += 1
+            log = self.log.get(user_id, [])
+            if sync_token is None:
+                events = list(self.events.get(user_id, {}).values())
+                return self._changes_type(events, sync_token=str(len(log)), full=True)
+            position = int(sync_token)
+            if position < self.compacted.get(user_id, 0):
+                raise self._expired_type(sync_token)
+            changed: Dict[str, Dict] = {}
+            deleted = set()
+            for action, value in log[position:]:
+                if action == "put":
+                    changed[value["id"]] = value
+                    deleted.discard(value["id"])
+                else:
+                    changed.pop(value, None)
+                    deleted.add(value)
+            return self._changes_type(list(changed.values()), deleted, sync_token=str(len(log)))
+
+
+class StubSearchHandler(BaseHTTPRequestHandler):
+    """
+    Tavily-style search endpoint: a fixed answer and a few results per query.
+    Queries containing one of failing_terms get a 500.
+    """
+
+    # Keep-alive, so connection reuse by the client shows up in the numbers
+    protocol_version = "HTTP/1.1"
+    latency = 0.3
+    calls = 0
+    failing_terms: tuple = ()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        type(self).calls += 1
+        time.sleep(self.latency)
+        query = request.get("query", "")
+        if any(term in query for term in self.failing_terms):
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        slug = re.sub(r"\W+", "-", query.lower()).strip("-")
+        results = [
+            {"title": f"{query} ({i})", "url": f"https://example.com/{slug}/{i}", "content": f"Stub result {i} for {query}."}
+            for i in range(1, 6)
+        ]
+        body = json.dumps({"query": query, "answer": f"Stub answer for {query}.", "results": results}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_search_stub(latency: float = 0.3, port: int = 0, failing_terms: tuple = ()) -> ThreadingHTTPServer:
+    """Start the stub search API on a background thread; set SEARCH_API_URL to its address"""
+    attributes = {"latency": latency, "calls": 0, "failing_terms": tuple(failing_terms)}
+    handler = type("ConfiguredStubSearchHandler", (StubSearchHandler,), attributes)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,36 +1,112 @@
 from dotenv import load_dotenv
-from portia import Config, Portia
 import json
 from datetime import datetime
 import os
+from concurrent.futures import ThreadPoolExecutor
+from services.calendar_mirror import CALENDAR_FETCH_CONCURRENCY, CALENDAR_TIME_ZONE, DEFAULT_CALENDAR_USER, CalendarProvider, get_calendar_mirror, get_calendar_provider, local_time, time_zone
+from services.tracing import log_payload, logger, span
 
-def find_free_time_in_calendar(date: str, start_time: str, end_time: str, constraints: list[str] = []):
-	"""Use Portia AI to find free time slots in user's Google Calendar."""
+def _parse_portia_list(run_data: dict, name: str):
+	"""Find a JSON list called name in Portia's step outputs or final output, or None"""
+	outputs = run_data.get("outputs", {})
+	candidates = [step.get("value") for key, step in outputs.get("step_outputs", {}).items() if name in key]
+	candidates.append(outputs.get("final_output", {}).get("value"))
+	for value in candidates:
+		try:
+			parsed = json.loads(value) if isinstance(value, str) else value
+		except json.JSONDecodeError:
+			continue
+		if isinstance(parsed, dict):
+			parsed = parsed.get(name)
+		if isinstance(parsed, list):
+			return parsed
+	return None
+
+def _has_offset(value: str) -> bool:
+	"""Whether an ISO time names its zone (Z or an offset after the time)"""
+	time_part = value.strip().partition("T")[2]
+	return time_part.endswith("Z") or "+" in time_part or "-" in time_part
+
+class PortiaCalendarProvider(CalendarProvider):
+	"""
+	Lists a day of Google Calendar events through Portia (no sync token support).
+	Opt-in with CALENDAR_PROVIDER=google_calendar:PortiaCalendarProvider; free
+	slots are then computed from the events instead of by Portia.
+	"""
+
+	def list_events(self, user_id: str, date: str) -> list:
+		if not os.getenv("PORTIA_API_KEY") and not os.getenv("PORTIA_TOKEN"):
+			raise RuntimeError("Missing Portia credentials")
+
+		prompt = f"""
+		List the events in my Google Calendar on {date}.
+		Return results as JSON with a list called events; each event has id, summary, and start and end times in ISO format.
+		"""
+		with span("portia_run", operation="list_events"):
+			from portia import Config, Portia
+			portia = Portia(Config.from_default())
+			run_data = portia.run_plan(portia.plan(prompt)).model_dump()
+		log_payload("Portia events response", run_data)
+
+		events = _parse_portia_list(run_data, "events")
+		if events is None:
+			raise ValueError("Portia did not return a list of events")
+		return [event for event in events if isinstance(event, dict) and "start" in event and "end" in event]
+
+def find_free_time_in_calendar(date: str, start_time: str, end_time: str, constraints: list[str] = [], user_id: str = None, zone: str = None):
+	"""
+	Find free time slots in user's Google Calendar, from the local mirror when possible.
+	Times are wall-clock times in zone (CALENDAR_TIME_ZONE by default), both
+	in the request and in the slots returned. Returns a dict with success, date and free_slots.
+	"""
 	load_dotenv(override=True)
+	zone = zone or CALENDAR_TIME_ZONE
+	local = time_zone(zone)
+
+	# Free-form constraints need Portia's reasoning, so only plain queries use the mirror,
+	# and only when a provider is configured for it
+	provider = get_calendar_provider()
+	if provider is not None and not constraints:
+		try:
+			with span("calendar_mirror"):
+				free_slots = get_calendar_mirror().free_slots(
+					user_id or DEFAULT_CALENDAR_USER, provider, date, start_time, end_time, zone
+				)
+			return {
+				"success": True,
+				"date": date,
+				"free_slots": free_slots,
+				"full_response": {}
+			}
+		except Exception as e:
+			logger.warning("Calendar mirror unavailable, asking Portia directly: %s", e)
 
 	if not os.getenv("PORTIA_API_KEY") and not os.getenv("PORTIA_TOKEN"):
-		return json.dumps({
+		return {
 			"success": False,
 			"error": "Missing Portia credentials",
 			"free_slots": []
-		}, indent=2)
+		}
 
 	# Compose natural language prompt
 	prompt = f"""
 	Check my Google Calendar availability.
 	Date: {date}
-	Between: {start_time} and {end_time}.
+	Between: {start_time} and {end_time} ({zone} time).
 	Return results as JSON with start and end times in ISO format.
 	{'Constraints: ' + ', '.join(constraints) if constraints else ''}
 	"""
 
 	try:
-		portia = Portia(Config.from_default())
-		plan = portia.plan(prompt)
-		run_result = portia.run_plan(plan)
-		run_data = run_result.model_dump()
+		with span("portia_run", operation="find_free_time"):
+			# Portia is heavy to import, so only load it when the calendar is used
+			from portia import Config, Portia
+			portia = Portia(Config.from_default())
+			plan = portia.plan(prompt)
+			run_result = portia.run_plan(plan)
+			run_data = run_result.model_dump()
 		
-		print("Full Portia response:", json.dumps(run_data, indent=2))  # Debug print
+		log_payload("Full Portia response", run_data)
 		
 		# Extract availability from step outputs
 		availability = []
@@ -41,9 +117,9 @@ def find_free_time_in_calendar(date: str, start_time: str, end_time: str, constr
 			availability_json = step_outputs["$availability"].get("value", "[]")
 			try:
 				availability = json.loads(availability_json)
-				print("Parsed availability from $availability:", availability)
+				logger.debug("Parsed %d slots from $availability", len(availability))
 			except json.JSONDecodeError as e:
-				print("Failed to parse $availability:", e)
+				logger.debug("Failed to parse $availability: %s", e)
 		
 		# If not found, try $formatted_availability
 		if not availability and "$formatted_availability" in step_outputs:
@@ -51,9 +127,9 @@ def find_free_time_in_calendar(date: str, start_time: str, end_time: str, constr
 			try:
 				parsed_json = json.loads(formatted_json)
 				availability = parsed_json.get("availability", [])
-				print("Parsed availability from $formatted_availability:", availability)
+				logger.debug("Parsed %d slots from $formatted_availability", len(availability))
 			except json.JSONDecodeError as e:
-				print("Failed to parse $formatted_availability:", e)
+				logger.debug("Failed to parse $formatted_availability: %s", e)
 		
 		# If still not found, try final output
 		if not availability:
@@ -61,43 +137,74 @@ def find_free_time_in_calendar(date: str, start_time: str, end_time: str, constr
 			try:
 				parsed_final = json.loads(final_output)
 				availability = parsed_final.get("availability", [])
-				print("Parsed availability from final_output:", availability)
+				logger.debug("Parsed %d slots from final_output", len(availability))
 			except json.JSONDecodeError as e:
-				print("Failed to parse final_output:", e)
+				logger.debug("Failed to parse final_output: %s", e)
 		
-		print("Extracted raw availability:", availability)  # Debug print
 		
 		# Format the slots
 		formatted_slots = []
 		for slot in availability:
 			if isinstance(slot, dict) and "start" in slot and "end" in slot:
-				# Remove timezone info if present (frontend expects simple time)
-				start = slot["start"].split("+")[0] if "+" in slot["start"] else slot["start"]
-				end = slot["end"].split("+")[0] if "+" in slot["end"] else slot["end"]
-				
-				formatted_slots.append({
-					"start": start,
-					"end": end
-				})
+				# Wall-clock time in the user's zone, like the mirror (frontend expects simple time)
+				try:
+					formatted_slots.append({
+						"start": local_time(slot["start"], local) if _has_offset(slot["start"]) else slot["start"],
+						"end": local_time(slot["end"], local) if _has_offset(slot["end"]) else slot["end"]
+					})
+				except ValueError:
+					logger.debug("Skipping slot with unreadable times: %s", slot)
 		
-		print("Formatted slots:", formatted_slots)  # Debug print
+		log_payload("Formatted slots", formatted_slots)
 		
-		return json.dumps({
+		return {
 			"success": True,
 			"date": date,
 			"free_slots": formatted_slots,
 			"full_response": {}  # Simplified to avoid large response
-		}, indent=2)
+		}
 
 	except Exception as e:
-		print("Error in find_free_time_in_calendar:", str(e))  # Debug print
-		return json.dumps({
+		logger.warning("Error in find_free_time_in_calendar: %s", e)
+		return {
 			"success": False,
 			"error": str(e),
 			"free_slots": []
-		}, indent=2)
+		}
+
+def find_free_time_in_range(dates: list[str], start_time: str, end_time: str, user_id: str = None, zone: str = None):
+	"""
+	Free time between start_time and end_time (wall-clock times in zone) on each of several dates. The
+	mirror is brought up to date once for the whole range; without one, the
+	days are asked of Portia CALENDAR_FETCH_CONCURRENCY at a time. Returns a
+	dict with success and free_slots, or the first failed date and its error.
+	"""
+	load_dotenv(override=True)
+
+	provider = get_calendar_provider()
+	if provider is not None:
+		try:
+			with span("calendar_mirror", days=len(dates)):
+				free_slots = get_calendar_mirror().free_slots_range(
+					user_id or DEFAULT_CALENDAR_USER, provider, dates, start_time, end_time, zone
+				)
+			return {"success": True, "free_slots": free_slots}
+		except Exception as e:
+			logger.warning("Calendar mirror unavailable, asking Portia directly: %s", e)
+
+	def one_day(date):
+		return find_free_time_in_calendar(date=date, start_time=start_time, end_time=end_time, user_id=user_id, zone=zone)
 
-def create_event_in_calendar(start: str, end: str, summary: str = "Revision Event", description: str = ""):
+	with ThreadPoolExecutor(max_workers=max(1, CALENDAR_FETCH_CONCURRENCY)) as pool:
+		results = list(pool.map(one_day, dates))
+	free_slots = []
+	for date, result in zip(dates, results):
+		if not result["success"]:
+			return {"success": False, "date": date, "error": result["error"], "free_slots": []}
+		free_slots.extend(result["free_slots"])
+	return {"success": True, "free_slots": free_slots}
+
+def create_event_in_calendar(start: str, end: str, summary: str = "Revision Event", description: str = "", user_id: str = None):
 	"""Use Portia AI to create an event in user's Google Calendar."""
 	load_dotenv(override=True)
 
@@ -131,22 +238,13 @@ def create_event_in_calendar(start: str, end: str, summary: str = "Revision Even
 	"""
 
 	try:
-		portia = Portia(Config.from_default())
-		plan = portia.plan(prompt)
-		run_result = portia.run_plan(plan)
-		run_data = run_result.model_dump()
+		with span("portia_run", operation="create_event"):
+			from portia import Config, Portia
+			portia = Portia(Config.from_default())
+			plan = portia.plan(prompt)
+			run_result = portia.run_plan(plan)
+			run_data = run_result.model_dump()
 		final_output = run_data.get("final_output", {})
-
-		return {
-			"success": True,
-			"start": full_start,
-			"end": full_end,
-			"summary": summary,
-			"description": description,
-			"status": "Created successfully",
-			"result": final_output
-		}
-
 	except Exception as e:
 		return {
 			"success": False,
@@ -156,3 +254,20 @@ def create_event_in_calendar(start: str, end: str, summary: str = "Revision Even
 			"summary": summary,
 			"status": "Failed"
 		}
+
+	# The mirror no longer matches the calendar for this day; the event exists
+	# either way, so a failure here is logged rather than reported
+	try:
+		get_calendar_mirror().invalidate(user_id or DEFAULT_CALENDAR_USER, date)
+	except Exception as e:
+		logger.error("Could not invalidate the calendar mirror for %s on %s: %s", user_id or DEFAULT_CALENDAR_USER, date, e)
+
+	return {
+		"success": True,
+		"start": full_start,
+		"end": full_end,
+		"summary": summary,
+		"description": description,
+		"status": "Created successfully",
+		"result": final_output
+	}
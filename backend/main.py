@@ -1,19 +1,39 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Body
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Body, Header
 from enum import Enum
 from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 from google_calendar import create_event_in_calendar, find_free_time_in_calendar
 from pydantic import BaseModel
 from routers import paper_router, calendar_router
-from FlashCardTools import FlashcardGenerator
+from FlashCardTools import FlashcardGenerator, parse_stats
+from services.single_flight import flashcard_flight, paper_flight, request_key
+from services.llm_limiter import llm_limiter
+from services.state_backend import RESULT_CACHE_TTL, get_state_backend
+from services.question_bank import bank_stats
+from services.calendar_mirror import calendar_stats
+from services.bulk_flashcards import bulk_generate, expand_uploads
+from services.deck_export import EXPORT_FORMATS, export_deck
+from services.http_responses import DefaultResponse, add_compression, dumps, etag_for, etag_matches
+from services.fair_share import add_fair_share, fair_scheduler, scheduled
+from services.tracing import add_request_spans, configure_logging, format_gauges, render_metrics, span
+from services.warmup import lifespan, warmup
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 import json
+import os
 
 class DifficultyLevel(str, Enum):
     SAME = "same"
     EASIER = "easier"
     HARDER = "harder"
 
-app = FastAPI()
+configure_logging()
+
+app = FastAPI(default_response_class=DefaultResponse, lifespan=lifespan)
+
+# Innermost, so 429s still get CORS headers and compression
+add_fair_share(app)
 
 # Add CORS middleware
 app.add_middleware(
@@ -23,6 +43,9 @@ app.add_middleware(
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
 )
+add_compression(app)
+# Outermost, so the request span covers queueing and compression too
+add_request_spans(app)
 
 # Add routers
 app.include_router(paper_router.router)
@@ -32,12 +55,55 @@ app.include_router(calendar_router.router)
 def read_root():
     return {"message": "Welcome to StudentTools API"}
 
+@app.get("/ready")
+def read_ready():
+    """Readiness probe: 503 until this worker has finished its startup warm-up"""
+    return DefaultResponse(warmup.status(), status_code=200 if warmup.ready else 503)
+
+@app.get("/stats")
+def read_stats():
+    """Counters for request coalescing, LLM admission control, fair-share scheduling, flashcard parsing, the question bank and the calendar mirror"""
+    return {
+        "single_flight": {
+            "flashcards": flashcard_flight.stats(),
+            "papers": paper_flight.stats(),
+        },
+        "llm_limiter": llm_limiter.stats(),
+        "fair_share": fair_scheduler.stats(),
+        "flashcard_parsing": {mode: stats.to_dict() for mode, stats in parse_stats.items()},
+        "question_bank": bank_stats,
+        "calendar_mirror": calendar_stats,
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    """Prometheus metrics: per-stage latency histograms plus the /stats counters"""
+    limiter = llm_limiter.stats()
+    extra = format_gauges(
+        "studentools_single_flight_coalesced",
+        "Requests that joined an identical in-flight generation",
+        {"flashcards": flashcard_flight.coalesced, "papers": paper_flight.coalesced},
+        "endpoint",
+    ) + format_gauges(
+        "studentools_llm_limiter",
+        "LLM admission controller state and counters",
+        {name: value for name, value in limiter.items()},
+        "field",
+    ) + format_gauges(
+        "studentools_fair_share",
+        "Fair-share scheduler state and counters",
+        {name: value for name, value in fair_scheduler.stats().items() if isinstance(value, (int, float)) and not isinstance(value, bool)},
+        "field",
+    )
+    return render_metrics(extra)
+
 # Calendar Integration Endpoints
 class FreeTimeRequest(BaseModel):
 	date: str
 	start_time: str
 	end_time: str
 	constraints: Optional[List[str]] = []
+	time_zone: calendar_router.TimeZoneName = None
 
 class CreateEventRequest(BaseModel):
 	start: str
@@ -46,24 +112,27 @@ class CreateEventRequest(BaseModel):
 	description: Optional[str] = ""
 
 @app.post("/calendar/free")
-async def calendar_free(request: FreeTimeRequest):
+async def calendar_free(request: FreeTimeRequest, x_user_id: Optional[str] = Header(None)):
 	"""Endpoint to find free time slots in Google Calendar."""
 	response_json = find_free_time_in_calendar(
 		date=request.date,
 		start_time=request.start_time,
 		end_time=request.end_time,
-		constraints=request.constraints
+		constraints=request.constraints,
+		user_id=x_user_id,
+		zone=request.time_zone
 	)
 	return response_json
 
 @app.post("/calendar/create-event")
-async def calendar_create_event(request: CreateEventRequest):
+async def calendar_create_event(request: CreateEventRequest, x_user_id: Optional[str] = Header(None)):
 	"""Endpoint to create a Google Calendar event."""
 	response = create_event_in_calendar(
 		start=request.start,
 		end=request.end,
 		summary=request.summary,
-		description=request.description
+		description=request.description,
+		user_id=x_user_id
 	)
 	return response
 
@@ -72,24 +141,127 @@ async def calendar_create_event(request: CreateEventRequest):
 async def get_flashcards():
     return {"message": "Get flashcards will be implemented"}
 
+class FlashcardSource(str, Enum):
+    DOCUMENT = "document"
+    LIBRARY = "library"
+
 @app.post("/flashcards")
 async def create_flashcard(
-    pdf_file: UploadFile = File(...),
+    pdf_file: Optional[UploadFile] = File(None),
     subject: Optional[str] = Form(None),
-    count: Optional[int] = Form(8)
+    count: Optional[int] = Form(8),
+    source: FlashcardSource = Form(FlashcardSource.DOCUMENT),
+    x_user_id: Optional[str] = Header(None)
 ):
+    """
+    Generate flashcards from the uploaded PDF ("document"), or from the chunks
+    most relevant to subject across the user's whole library ("library").
+    Uploads from a user identified by X-User-Id are added to their library.
+    """
+    if source == FlashcardSource.LIBRARY and not (x_user_id and subject):
+        raise HTTPException(status_code=400, detail="Library flashcards need an X-User-Id header and a subject")
+    if source == FlashcardSource.DOCUMENT and pdf_file is None:
+        raise HTTPException(status_code=400, detail="A PDF file is required")
+
     try:
-        # Initialize the flashcard generator
-        generator = FlashcardGenerator()
-        
-        # Generate flashcards
-        flashcards_data = generator.generate(pdf_file, subject=subject, count=count)
+        pdf_content = b""
+        if pdf_file is not None:
+            with span("upload_read"):
+                pdf_content = await pdf_file.read()
+        filename = pdf_file.filename if pdf_file is not None else None
+
+        if source == FlashcardSource.LIBRARY:
+            async def run_library():
+                generator = FlashcardGenerator()
+                if pdf_content:
+                    await run_in_threadpool(generator.index_upload, x_user_id, pdf_content, filename)
+                return await llm_limiter.run_in_thread(generator.generate_from_library, x_user_id, subject, count=count)
+
+            # The library changes with every upload, so results are coalesced but not cached
+            key = request_key(pdf_content, source=source.value, user_id=x_user_id, subject=subject, count=count)
+            return await flashcard_flight.do(key, scheduled(run_library))
+
+        # Identical uploads reuse a recent result from the shared state backend;
+        # v2 entries hold cards as a list rather than a JSON string
+        key = request_key(pdf_content, subject=subject, count=count)
+        backend = get_state_backend()
+
+        async def run():
+            # Initialize the flashcard generator
+            generator = FlashcardGenerator()
+            # Generate flashcards off the event loop so identical requests can coalesce
+            result = await llm_limiter.run_in_thread(
+                generator.generate_from_content, pdf_content, subject=subject, count=count,
+                user_id=x_user_id, filename=filename
+            )
+            await run_in_threadpool(backend.set_json, f"flashcards:v2:{key}", result, RESULT_CACHE_TTL)
+            return result
+
+        flashcards_data = await run_in_threadpool(backend.get_json, f"flashcards:v2:{key}")
+        if flashcards_data is None:
+            # Identical concurrent uploads share a single generation
+            flashcards_data = await flashcard_flight.do(key, scheduled(run))
+        if x_user_id:
+            # No-op when this generation already indexed the upload for this user
+            await run_in_threadpool(FlashcardGenerator().index_upload, x_user_id, pdf_content, filename)
         
         return flashcards_data
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/flashcards/bulk")
+async def create_flashcards_bulk(
+    pdf_files: List[UploadFile] = File(...),
+    subject: Optional[str] = Form(None),
+    count: Optional[int] = Form(8),
+    x_user_id: Optional[str] = Header(None)
+):
+    """
+    Generate one combined deck from many PDFs (or ZIP archives of PDFs).
+    Streams newline-delimited JSON progress events per file; the last event
+    holds the combined deck with per-card provenance and its deck_id.
+    """
+    with span("upload_read"):
+        uploads = [(f.filename or f"file{i}.pdf", await f.read()) for i, f in enumerate(pdf_files)]
+    files = expand_uploads(uploads)
+
+    async def stream():
+        async for event in bulk_generate(files, subject=subject, count=count, user_id=x_user_id):
+            yield dumps(event) + b"\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.get("/flashcards/decks/{deck_id}")
+async def get_deck(deck_id: str, if_none_match: Optional[str] = Header(None)):
+    """Retrieve a combined deck produced by the bulk endpoint (supports If-None-Match)"""
+    deck = await run_in_threadpool(get_state_backend().get_json, f"deck:{deck_id}")
+    if deck is None:
+        raise HTTPException(status_code=404, detail="Deck not found")
+    body = dumps({"deck_id": deck_id, "flashcards": deck})
+    etag = etag_for(body)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+@app.get("/flashcards/decks/{deck_id}/export")
+async def export_flashcard_deck(deck_id: str, format: str = "csv"):
+    """Download a stored deck as CSV, an Anki package or a compact columnar file"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    deck = await run_in_threadpool(get_state_backend().get_json, f"deck:{deck_id}")
+    if deck is None:
+        raise HTTPException(status_code=404, detail="Deck not found")
+    with span("export", format=format):
+        chunks, media_type, extension, path = await run_in_threadpool(export_deck, iter(deck), format, f"StudentTools {deck_id[:8]}")
+    headers = {"Content-Disposition": f'attachment; filename="deck_{deck_id}.{extension}"'}
+    if path is not None:
+        # The temp file is deleted once sent, or once the client has gone away
+        return FileResponse(path, media_type=media_type, headers=headers, background=BackgroundTask(os.remove, path))
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
 # Past Paper Generator Endpoints
 @app.post("/papers/generate")
 async def generate_paper(
@@ -108,11 +280,3 @@ async def generate_paper(
         "difficulty_requested": difficulty,
         "status": "endpoint_created_processing_to_be_implemented"
     }
-
-@app.get("/papers/{paper_id}")
-async def get_generated_paper(paper_id: str):
-    # This will be used to retrieve previously generated papers
-    return {
-        "message": "Get generated paper endpoint",
-        "paper_id": paper_id
-    }
\ No newline at end of file
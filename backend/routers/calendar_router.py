@@ -1,16 +1,29 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime
-from google_calendar import find_free_time_in_calendar, create_event_in_calendar
+from fastapi import APIRouter, Header, HTTPException
+from pydantic import AfterValidator, BaseModel
+from typing import Annotated, List, Optional
+from datetime import datetime, timedelta
+from google_calendar import find_free_time_in_calendar, find_free_time_in_range, create_event_in_calendar
+from services.calendar_mirror import time_zone
+from services.revision_planner import StudyGoal, plan_revision
+from starlette.concurrency import run_in_threadpool
+import asyncio
 
 router = APIRouter(prefix="/calendar", tags=["calendar"])
 
+def _known_time_zone(name: Optional[str]) -> Optional[str]:
+    if name is not None:
+        time_zone(name)
+    return name
+
+# IANA zone of a request's dates and times, e.g. "Europe/London"; CALENDAR_TIME_ZONE when omitted
+TimeZoneName = Annotated[Optional[str], AfterValidator(_known_time_zone)]
+
 class FreeTimeRequest(BaseModel):
     date: str
     start_time: str
     end_time: str
     constraints: Optional[List[str]] = []
+    time_zone: TimeZoneName = None
 
 class EventCreateRequest(BaseModel):
     start: str
@@ -19,29 +32,110 @@ class EventCreateRequest(BaseModel):
     description: str = ""
 
 @router.post("/free")
-async def get_free_time(request: FreeTimeRequest):
+async def get_free_time(request: FreeTimeRequest, x_user_id: Optional[str] = Header(None)):
     try:
         result = find_free_time_in_calendar(
             date=request.date,
             start_time=request.start_time,
             end_time=request.end_time,
-            constraints=request.constraints
+            constraints=request.constraints,
+            user_id=x_user_id,
+            zone=request.time_zone
         )
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/event")
-async def create_event(request: EventCreateRequest):
+async def create_event(request: EventCreateRequest, x_user_id: Optional[str] = Header(None)):
     try:
         result = create_event_in_calendar(
             start=request.start,
             end=request.end,
             summary=request.summary,
-            description=request.description
+            description=request.description,
+            user_id=x_user_id
         )
         if not result["success"]:
             raise HTTPException(status_code=400, detail=result["error"])
         return result
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e)) 
+
+class StudySubject(BaseModel):
+    name: str
+    target_hours: float
+    exam_date: str
+    priority: float = 1.0
+
+class TimeSlot(BaseModel):
+    start: str
+    end: str
+
+class RevisionPlanRequest(BaseModel):
+    subjects: List[StudySubject]
+    # Free slots to plan into; when omitted they are looked up in the calendar
+    # for every day from start_date up to the last exam
+    free_slots: Optional[List[TimeSlot]] = None
+    start_date: Optional[str] = None
+    day_start: str = "09:00"
+    day_end: str = "21:00"
+    time_zone: TimeZoneName = None
+    session_minutes: int = 60
+    min_session_minutes: int = 30
+    break_minutes: int = 10
+    max_daily_hours: Optional[float] = None
+    create_events: bool = False
+
+# Calendar writes go through Portia one event at a time; a few run at once
+PLAN_EVENT_CONCURRENCY = 4
+
+def _calendar_free_slots(request: RevisionPlanRequest, goals: List[StudyGoal], user_id: Optional[str]) -> List[dict]:
+    first = datetime.fromisoformat(request.start_date).date() if request.start_date else datetime.now().date()
+    last = max(goal.deadline for goal in goals).date()
+    dates = [(first + timedelta(days=offset)).isoformat() for offset in range((last - first).days + 1)]
+    result = find_free_time_in_range(dates, request.day_start, request.day_end, user_id=user_id, zone=request.time_zone)
+    if not result["success"]:
+        raise HTTPException(status_code=502, detail=f"Could not read the calendar for {result['date']}: {result['error']}")
+    return result["free_slots"]
+
+@router.post("/plan")
+async def create_revision_plan(request: RevisionPlanRequest, x_user_id: Optional[str] = Header(None)):
+    """Plan revision sessions for several subjects into free calendar time, optionally adding them to the calendar"""
+    try:
+        goals = [StudyGoal(s.name, s.target_hours, s.exam_date, s.priority) for s in request.subjects]
+        if request.free_slots is not None:
+            free_slots = [slot.model_dump() for slot in request.free_slots]
+        else:
+            free_slots = await run_in_threadpool(_calendar_free_slots, request, goals, x_user_id)
+        plan = plan_revision(
+            goals,
+            free_slots,
+            session_minutes=request.session_minutes,
+            min_session_minutes=request.min_session_minutes,
+            break_minutes=request.break_minutes,
+            max_daily_hours=request.max_daily_hours
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if request.create_events:
+        semaphore = asyncio.Semaphore(PLAN_EVENT_CONCURRENCY)
+
+        async def create(session: dict) -> dict:
+            async with semaphore:
+                return await run_in_threadpool(
+                    create_event_in_calendar,
+                    start=session["start"],
+                    end=session["end"],
+                    summary=session["summary"],
+                    description=session["description"],
+                    user_id=x_user_id
+                )
+
+        results = await asyncio.gather(*(create(session) for session in plan["sessions"]))
+        for session, result in zip(plan["sessions"], results):
+            session["created"] = result["success"]
+            if not result["success"]:
+                session["error"] = result["error"]
+    return plan
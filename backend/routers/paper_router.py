@@ -1,28 +1,53 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, File, UploadFile, HTTPException, Header
+from typing import Optional
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from enum import Enum
 import uuid
 from datetime import datetime
 from io import BytesIO
 
-from services.paper_generator import PaperGeneratorService
+from services.fair_share import scheduled
+from services.paper_generator import PAPER_GENERATION_MODE, PaperGeneratorService
+from services.single_flight import paper_flight, request_key
+from services.state_backend import PAPER_TTL, RESULT_CACHE_TTL, get_state_backend
+from services.http_responses import etag_for, etag_matches
+from services.tracing import span
 
 router = APIRouter(prefix="/papers", tags=["papers"])
-paper_service = PaperGeneratorService()
+_paper_service = None
+
+def get_paper_service() -> PaperGeneratorService:
+    """Create the paper service on first use instead of at import time"""
+    global _paper_service
+    if _paper_service is None:
+        _paper_service = PaperGeneratorService()
+    return _paper_service
 
 class DifficultyLevel(str, Enum):
     EASIER = "easier"
     SAME = "same"
     HARDER = "harder"
 
+class PaperMode(str, Enum):
+    SINGLE = "single"
+    DRAFT_REFINE = "draft_refine"
+
 @router.post("/generate")
 async def generate_paper(
     pdf_file: UploadFile = File(...),
-    difficulty: DifficultyLevel = "same"
+    difficulty: DifficultyLevel = "same",
+    mode: Optional[PaperMode] = None
 ):
     try:
-        # Generate PDF bytes
-        pdf_bytes = await paper_service.generate(pdf_file, difficulty)
+        with span("upload_read"):
+            pdf_content = await pdf_file.read()
+
+        # Identical concurrent uploads share a single generation, and recent
+        # results are reused from the shared state backend by any worker
+        mode = PaperMode(mode or PAPER_GENERATION_MODE).value
+        key = request_key(pdf_content, difficulty=DifficultyLevel(difficulty).value, mode=mode)
+        paper_id, pdf_bytes = await paper_flight.do(key, scheduled(lambda: _generate_or_reuse(key, pdf_content, difficulty, mode)))
         
         # Create a filename with timestamp
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -36,9 +61,47 @@ async def generate_paper(
             pdf_stream,
             media_type="application/pdf",
             headers={
-                "Content-Disposition": f"attachment; filename={filename}"
+                "Content-Disposition": f"attachment; filename={filename}",
+                "X-Paper-Id": paper_id
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _generate_or_reuse(key: str, pdf_content: bytes, difficulty: str, mode: str):
+    """Return (paper_id, pdf_bytes), reusing a cached paper for the same upload and difficulty"""
+    backend = get_state_backend()
+    cached_id = await run_in_threadpool(backend.get, f"paper_cache:{key}")
+    if cached_id is not None:
+        paper_id = cached_id.decode()
+        pdf_bytes = await run_in_threadpool(backend.get, f"paper:{paper_id}")
+        if pdf_bytes is not None:
+            return paper_id, pdf_bytes
+
+    pdf_bytes = await get_paper_service().generate_from_content(pdf_content, difficulty, mode)
+    paper_id = uuid.uuid4().hex
+    await run_in_threadpool(backend.set, f"paper:{paper_id}", pdf_bytes, PAPER_TTL)
+    await run_in_threadpool(backend.set, f"paper_cache:{key}", paper_id.encode(), RESULT_CACHE_TTL)
+    return paper_id, pdf_bytes
+
+@router.get("/{paper_id}")
+async def get_generated_paper(paper_id: str, if_none_match: Optional[str] = Header(None)):
+    """Retrieve a previously generated paper from the shared state backend (supports If-None-Match)"""
+    pdf_bytes = await run_in_threadpool(get_state_backend().get, f"paper:{paper_id}")
+    if pdf_bytes is None:
+        raise HTTPException(status_code=404, detail="Paper not found")
+    etag = etag_for(pdf_bytes)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(
+        pdf_bytes,
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": f"attachment; filename=generated_paper_{paper_id}.pdf",
+            "ETag": etag,
+            "Cache-Control": "private, no-cache"
+        }
+    ) 
\ No newline at end of file
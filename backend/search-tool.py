@@ -2,7 +2,11 @@
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
 import httpx
 from pydantic import BaseModel, Field
@@ -10,7 +14,153 @@ from pydantic import BaseModel, Field
 from portia.errors import ToolHardError, ToolSoftError
 from portia.tool import Tool, ToolRunContext
 
-MAX_RESULTS = 3
+from services.state_backend import get_state_backend
+from services.tracing import logger, span
+
+# Results returned per query
+MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "3"))
+# Tavily by default; point at a local stub for benchmarks
+SEARCH_API_URL = os.getenv("SEARCH_API_URL", "https://api.tavily.com/search")
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "15"))
+SEARCH_MAX_CONNECTIONS = int(os.getenv("SEARCH_MAX_CONNECTIONS", "10"))
+# How long results for a query are reused (seconds)
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "3600"))
+
+
+def normalise_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _cache_key(query: str) -> str:
+    return "search:" + hashlib.sha256(normalise_query(query).encode()).hexdigest()
+
+
+class _SearchClient:
+    """
+    One pooled httpx.AsyncClient shared by every search, running on its own
+    event loop thread so synchronous tool calls and async callers reuse the
+    same keep-alive connections.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.client: Optional[httpx.AsyncClient] = None
+
+    def _ensure_started(self) -> None:
+        with self.lock:
+            if self.loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="search-client", daemon=True).start()
+
+            async def create() -> httpx.AsyncClient:
+                return httpx.AsyncClient(
+                    timeout=SEARCH_TIMEOUT,
+                    limits=httpx.Limits(max_connections=SEARCH_MAX_CONNECTIONS, max_keepalive_connections=SEARCH_MAX_CONNECTIONS),
+                )
+
+            self.client = asyncio.run_coroutine_threadsafe(create(), loop).result()
+            self.loop = loop
+
+    def submit(self, fn: Callable[[httpx.AsyncClient], Awaitable[Any]]):
+        """Schedule fn(client) on the client's loop and return a concurrent future"""
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(fn(self.client), self.loop)
+
+
+_client = _SearchClient()
+
+
+async def _fetch(client: httpx.AsyncClient, api_key: str, query: str) -> List[Dict]:
+    payload = {
+        "query": query,
+        "include_answer": True,
+        "api_key": api_key,
+    }
+    response = await client.post(SEARCH_API_URL, json=payload)
+    response.raise_for_status()
+    json_response = response.json()
+    if "answer" in json_response:
+        return json_response["results"][:MAX_RESULTS]
+    raise ToolSoftError(f"Failed to get answer to search: {json_response}")
+
+
+def _merge(result_lists: List[List[Dict]]) -> List[Dict]:
+    """Interleave results by rank across queries, dropping repeated URLs"""
+    merged, seen = [], set()
+    for rank in range(max((len(results) for results in result_lists), default=0)):
+        for results in result_lists:
+            if rank < len(results):
+                result = results[rank]
+                key = result.get("url") or result.get("content")
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(result)
+    return merged
+
+
+def _start_search(queries: List[str]):
+    """
+    Look up cached results and start fetching the rest concurrently. Returns
+    (normalised queries, cached results by query, future or None, queries being fetched);
+    each query is sent as first written, only the cache key is normalised.
+    """
+    api_key = os.getenv("TAVILY_API_KEY")
+    if not api_key or api_key == "":
+        raise ToolHardError("TAVILY_API_KEY is required to use search")
+
+    backend = get_state_backend()
+    originals: Dict[str, str] = {}
+    for query in queries:
+        if query.strip():
+            originals.setdefault(normalise_query(query), query.strip())
+    unique = list(originals)
+    cached: Dict[str, List[Dict]] = {}
+    missing = []
+    for query in unique:
+        results = backend.get_json(_cache_key(query))
+        if results is not None:
+            cached[query] = results
+        else:
+            missing.append(query)
+
+    async def fetch_all(client: httpx.AsyncClient):
+        return await asyncio.gather(*(_fetch(client, api_key, originals[query]) for query in missing), return_exceptions=True)
+
+    future = _client.submit(fetch_all) if missing else None
+    return unique, cached, future, missing
+
+
+def _finish_search(unique: List[str], cached: Dict[str, List[Dict]], fetched: List[Any], missing: List[str]) -> List[Dict]:
+    backend = get_state_backend()
+    errors = []
+    for query, result in zip(missing, fetched):
+        if isinstance(result, BaseException):
+            logger.warning("Search failed for %r: %s", query, result)
+            errors.append(result)
+        else:
+            cached[query] = result
+            backend.set_json(_cache_key(query), result, SEARCH_CACHE_TTL)
+    if errors and not cached:
+        raise errors[0]
+    return _merge([cached[query] for query in unique if query in cached])
+
+
+def search_many(queries: List[str]) -> List[Dict]:
+    """Run several queries concurrently over the pooled client and merge their results"""
+    with span("search", queries=len(queries)):
+        unique, cached, future, missing = _start_search(queries)
+        fetched = future.result() if future is not None else []
+        return _finish_search(unique, cached, fetched, missing)
+
+
+async def asearch_many(queries: List[str]) -> List[Dict]:
+    """search_many for callers already running an event loop"""
+    with span("search", queries=len(queries)):
+        unique, cached, future, missing = _start_search(queries)
+        fetched = await asyncio.wrap_future(future) if future is not None else []
+        return _finish_search(unique, cached, fetched, missing)
 
 
 class SearchToolSchema(BaseModel):
@@ -23,6 +173,13 @@ class SearchToolSchema(BaseModel):
             "'who won the US election in 2020?'"
         ),
     )
+    related_queries: List[str] = Field(
+        default_factory=list,
+        description=(
+            "Optional further queries to search at the same time, for example other phrasings "
+            "or sub-questions. Their results are merged with those for search_query."
+        ),
+    )
 
 
 class SearchTool(Tool[str]):
@@ -33,6 +190,7 @@ class SearchTool(Tool[str]):
     description: str = (
         "Searches the internet (using Tavily) to find answers to the search query provided and "
         "returns those answers, including images, links and a natural language answer. "
+        "Several related queries can be searched in one call. "
         "The search tool has access to general information but can not return specific "
         "information on users or information not available on the internet"
     )
@@ -40,25 +198,6 @@ class SearchTool(Tool[str]):
     output_schema: tuple[str, str] = ("str", "str: output of the search results")
     should_summarize: bool = True
 
-    def run(self, _: ToolRunContext, search_query: str) -> str:
+    def run(self, _: ToolRunContext, search_query: str, related_queries: Optional[List[str]] = None) -> str:
         """Run the Search Tool."""
-        api_key = os.getenv("TAVILY_API_KEY")
-        if not api_key or api_key == "":
-            raise ToolHardError("TAVILY_API_KEY is required to use search")
-
-        url = "https://api.tavily.com/search"
-
-        payload = {
-            "query": search_query,
-            "include_answer": True,
-            "api_key": api_key,
-        }
-        headers = {"Content-Type": "application/json"}
-
-        response = httpx.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        json_response = response.json()
-        if "answer" in json_response:
-            results = json_response["results"]
-            return results[:MAX_RESULTS]
-        raise ToolSoftError(f"Failed to get answer to search: {json_response}")
\ No newline at end of file
+        return search_many([search_query] + list(related_queries or []))
@@ -0,0 +1,28 @@
+"""
+Production entry point: serves the API with several worker processes.
+
+Workers share caches, jobs and generated papers through the state backend
+configured by STATE_BACKEND_URL (a local SQLite file by default, or redis://
+for multi-node deployments).
+"""
+
+import os
+
+import uvicorn
+
+
+def main():
+    workers = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+    # Workers inherit it and split the host-wide LLM and per-user budgets between them (services/workers.py)
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+        log_level=os.getenv("LOG_LEVEL", "info").lower(),
+    )
+
+
+if __name__ == "__main__":
+    main()
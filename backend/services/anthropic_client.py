@@ -0,0 +1,18 @@
+import os
+import threading
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_anthropic_client():
+    """Return the process-wide Anthropic client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # Imported here so the SDK is only loaded when Claude is first needed
+                from anthropic import Anthropic
+                # Retries on 429/529 are handled by the shared admission controller
+                _client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+    return _client
@@ -0,0 +1,155 @@
+import asyncio
+import io
+import os
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from FlashCardTools import FlashcardGenerator
+from services.llm_limiter import llm_limiter
+from services.pdf_text import extract_text
+from services.single_flight import request_key
+from services.state_backend import PAPER_TTL, RESULT_CACHE_TTL, get_state_backend
+from services.tracing import logger, span
+from services.workers import CPUS_PER_WORKER, process_pool
+
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "60"))
+# Limit on the total uncompressed size of a bulk upload, including ZIP contents
+BULK_MAX_BYTES = int(os.getenv("BULK_MAX_BYTES", str(300 * 1024 * 1024)))
+# Extraction processes per web worker (default: this worker's share of the cores)
+BULK_EXTRACT_WORKERS = int(os.getenv("BULK_EXTRACT_WORKERS", str(CPUS_PER_WORKER)))
+# Files of one bulk request whose indexing and generation hold a thread at once
+BULK_FILE_CONCURRENCY = int(os.getenv("BULK_FILE_CONCURRENCY", "4"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = process_pool(BULK_EXTRACT_WORKERS)
+    return _pool
+
+
+def expand_uploads(uploads: List[Tuple[str, bytes]]) -> List[Tuple[str, bytes]]:
+    """
+    Flatten uploaded PDFs and ZIP archives of PDFs into (filename, bytes) pairs.
+    The file count and total uncompressed size are checked before each ZIP
+    entry is decompressed, so an archive is never expanded past the limits.
+    """
+    files: List[Tuple[str, bytes]] = []
+    total = 0
+
+    def admit(size: int) -> None:
+        nonlocal total
+        if len(files) >= BULK_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_FILES} files per bulk request")
+        total += size
+        if total > BULK_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Bulk upload is too large")
+
+    for name, content in uploads:
+        if name.lower().endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(io.BytesIO(content))
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"{name} is not a valid ZIP file")
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(".pdf"):
+                    continue
+                # file_size also caps what read() will decompress for the entry
+                admit(info.file_size)
+                files.append((f"{name}/{info.filename}", archive.read(info)))
+        else:
+            admit(len(content))
+            files.append((name, content))
+    if not files:
+        raise HTTPException(status_code=400, detail="No PDF files found in the upload")
+    return files
+
+
+async def bulk_generate(
+    files: List[Tuple[str, bytes]],
+    subject: Optional[str] = None,
+    count: int = 8,
+    user_id: Optional[str] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Generate flashcards for many files, yielding progress events as they happen.
+    Extraction runs in a process pool; LLM calls all go through the shared
+    admission controller, so total time is bounded by its concurrency limit
+    rather than the number of files. At most BULK_FILE_CONCURRENCY files hold
+    a thread for indexing and generation; the others wait on the event loop.
+    The last event is the combined deck.
+    """
+    generator = FlashcardGenerator()
+    backend = get_state_backend()
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    threads = asyncio.Semaphore(BULK_FILE_CONCURRENCY)
+
+    async def process(index: int, name: str, content: bytes) -> List[Dict[str, Any]]:
+        try:
+            key = request_key(content, subject=subject, count=count)
+            result = await run_in_threadpool(backend.get_json, f"flashcards:v2:{key}")
+            if result is None:
+                with span("extraction"):
+                    text = await loop.run_in_executor(_get_pool(), extract_text, content)
+                processed_text = generator.preprocess_text(text)
+                await events.put({"event": "extracted", "index": index, "file": name})
+                async with threads:
+                    if user_id:
+                        await run_in_threadpool(generator.index_document, user_id, content, processed_text, name)
+                    result = await llm_limiter.run_in_thread(generator.generate_flashcards, processed_text, count=count, subject=subject)
+                await run_in_threadpool(backend.set_json, f"flashcards:v2:{key}", result, RESULT_CACHE_TTL)
+            cards = result["flashcards"]
+            await events.put({"event": "file_done", "index": index, "file": name, "cards": len(cards)})
+            return cards
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.warning("Bulk flashcards failed for %s: %s", name, detail)
+            await events.put({"event": "file_error", "index": index, "file": name, "error": detail})
+            return []
+
+    async def run_all():
+        try:
+            return await asyncio.gather(*(process(i, name, content) for i, (name, content) in enumerate(files)))
+        finally:
+            await events.put(None)
+
+    yield {"event": "started", "files": [name for name, _ in files]}
+    task = asyncio.create_task(run_all())
+    while True:
+        event = await events.get()
+        if event is None:
+            break
+        yield event
+    per_file = await task
+
+    # Combined deck with sequential ids and per-card provenance
+    deck = []
+    for (name, _), cards in zip(files, per_file):
+        for card in cards:
+            deck.append({
+                "id": str(len(deck) + 1),
+                "question": card["question"],
+                "answer": card["answer"],
+                "source_file": name,
+                "source_id": card["id"],
+            })
+    deck_id = uuid.uuid4().hex
+    await run_in_threadpool(backend.set_json, f"deck:{deck_id}", deck, PAPER_TTL)
+    yield {
+        "event": "deck",
+        "deck_id": deck_id,
+        "flashcards": deck,
+        "files": [{"file": name, "cards": len(cards)} for (name, _), cards in zip(files, per_file)],
+    }
@@ -0,0 +1,306 @@
+import hashlib
+import importlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from services.tracing import logger, span
+
+# Per-user local copy of calendar events, so repeated availability queries
+# are answered from SQLite instead of a fresh Portia/Google round trip
+CALENDAR_MIRROR_PATH = os.getenv("CALENDAR_MIRROR_PATH", "state/calendar_mirror.db")
+# "module:Class" of the CalendarProvider that feeds the mirror. Unset, there is
+# no mirror and /calendar/free asks Portia for availability on every query
+CALENDAR_PROVIDER = os.getenv("CALENDAR_PROVIDER", "")
+# Providers with sync tokens are asked for changes at most this often (seconds)
+CALENDAR_SYNC_INTERVAL = float(os.getenv("CALENDAR_SYNC_INTERVAL", "60"))
+# Providers without sync tokens refetch a mirrored day after this long (seconds)
+CALENDAR_DAY_TTL = float(os.getenv("CALENDAR_DAY_TTL", "300"))
+# Days fetched at once when a range of days is read from a provider without
+# sync tokens, or from Portia when there is no mirror
+CALENDAR_FETCH_CONCURRENCY = int(os.getenv("CALENDAR_FETCH_CONCURRENCY", "4"))
+# Zone (IANA name) of the dates and times in requests that do not give one;
+# free slots are returned as wall-clock times in the request's zone
+CALENDAR_TIME_ZONE = os.getenv("CALENDAR_TIME_ZONE", "UTC")
+# Used when a request does not identify the user
+DEFAULT_CALENDAR_USER = "default"
+
+# Counters reported under /stats
+calendar_stats = {"mirror_hits": 0, "day_fetches": 0, "incremental_syncs": 0, "full_syncs": 0, "invalidations": 0}
+
+
+class SyncTokenExpired(Exception):
+    """The provider no longer accepts the stored sync token; a full sync is needed."""
+
+
+class CalendarChanges:
+    """Result of a sync: changed events, deleted event ids and the next sync token."""
+    def __init__(self, events: List[Dict], deleted: Iterable[str] = (), sync_token: Optional[str] = None, full: bool = False):
+        self.events = events
+        self.deleted = list(deleted)
+        self.sync_token = sync_token
+        self.full = full
+
+
+class CalendarProvider:
+    """
+    Source of calendar events for the mirror. Providers either support
+    incremental sync tokens (sync) or can only list one day at a time (list_events).
+    Events are dicts with id, start, end and an optional summary.
+    """
+    supports_sync_tokens = False
+
+    def list_events(self, user_id: str, date: str) -> List[Dict]:
+        raise NotImplementedError
+
+    def sync(self, user_id: str, sync_token: Optional[str]) -> CalendarChanges:
+        """Changes since sync_token, or every event (full=True) when it is None"""
+        raise NotImplementedError
+
+
+def time_zone(name: Optional[str] = None) -> tzinfo:
+    """The named zone, or CALENDAR_TIME_ZONE; raises ValueError for an unknown name"""
+    name = name or CALENDAR_TIME_ZONE
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone: {name}")
+
+
+def normalise_time(value: str, zone: tzinfo = timezone.utc) -> str:
+    """
+    ISO timestamp in UTC without a timezone, to the second, so events from
+    calendars in different zones compare correctly. Times without a zone
+    are wall-clock times in zone (UTC unless given).
+    """
+    parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=zone)
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None).isoformat(timespec="seconds")
+
+
+def local_time(value: str, zone: tzinfo) -> str:
+    """Wall-clock time in zone, without a timezone, of a time with an offset or a normalised UTC time"""
+    parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(zone).replace(tzinfo=None).isoformat(timespec="seconds")
+
+
+def event_id(event: Dict) -> str:
+    if event.get("id"):
+        return str(event["id"])
+    return hashlib.sha256(f"{event['start']}\0{event['end']}\0{event.get('summary', '')}".encode()).hexdigest()[:16]
+
+
+def compute_free_slots(busy: List[Dict], window_start: str, window_end: str) -> List[Dict]:
+    """Gaps between busy intervals inside a window (all times normalised ISO strings)"""
+    slots = []
+    cursor = window_start
+    for event in sorted(busy, key=lambda event: event["start"]):
+        if event["start"] > cursor:
+            slots.append({"start": cursor, "end": min(event["start"], window_end)})
+        cursor = max(cursor, event["end"])
+        if cursor >= window_end:
+            break
+    if cursor < window_end:
+        slots.append({"start": cursor, "end": window_end})
+    return slots
+
+
+class CalendarMirror:
+    """SQLite mirror of each user's events, indexed by start and end time."""
+
+    def __init__(self, path: str = CALENDAR_MIRROR_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                user_id TEXT NOT NULL,
+                event_id TEXT NOT NULL,
+                start TEXT NOT NULL,
+                end TEXT NOT NULL,
+                summary TEXT,
+                PRIMARY KEY (user_id, event_id)
+            );
+            CREATE INDEX IF NOT EXISTS events_time ON events (user_id, start, end);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                user_id TEXT PRIMARY KEY,
+                sync_token TEXT,
+                synced_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS synced_days (
+                user_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                synced_at REAL NOT NULL,
+                PRIMARY KEY (user_id, date)
+            );
+        """)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self.local.conn = conn
+        return conn
+
+    def busy(self, user_id: str, window_start: str, window_end: str) -> List[Dict]:
+        """Mirrored events overlapping a window"""
+        rows = self._conn().execute(
+            "SELECT event_id, start, end, summary FROM events "
+            "WHERE user_id = ? AND start < ? AND end > ? ORDER BY start",
+            (user_id, window_end, window_start),
+        ).fetchall()
+        return [{"id": row[0], "start": row[1], "end": row[2], "summary": row[3]} for row in rows]
+
+    def _upsert(self, conn: sqlite3.Connection, user_id: str, events: List[Dict], zone: tzinfo) -> None:
+        conn.executemany(
+            "INSERT OR REPLACE INTO events (user_id, event_id, start, end, summary) VALUES (?, ?, ?, ?, ?)",
+            [
+                (user_id, event_id(event), normalise_time(event["start"], zone), normalise_time(event["end"], zone), event.get("summary"))
+                for event in events
+            ],
+        )
+
+    def apply_changes(self, user_id: str, changes: CalendarChanges, zone: tzinfo = timezone.utc) -> None:
+        """Store a sync's changes; event times without a zone are taken to be in zone"""
+        conn = self._conn()
+        with conn:
+            if changes.full:
+                conn.execute("DELETE FROM events WHERE user_id = ?", (user_id,))
+            conn.executemany(
+                "DELETE FROM events WHERE user_id = ? AND event_id = ?",
+                [(user_id, deleted) for deleted in changes.deleted],
+            )
+            self._upsert(conn, user_id, changes.events, zone)
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state (user_id, sync_token, synced_at) VALUES (?, ?, ?)",
+                (user_id, changes.sync_token, time.time()),
+            )
+
+    def replace_day(self, user_id: str, date: str, events: List[Dict], zone: tzinfo = timezone.utc) -> None:
+        """Replace the mirrored events of date, a day in zone"""
+        next_day = (datetime.fromisoformat(date) + timedelta(days=1)).date().isoformat()
+        day_start = normalise_time(f"{date}T00:00:00", zone)
+        day_end = normalise_time(f"{next_day}T00:00:00", zone)
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM events WHERE user_id = ? AND start < ? AND end > ?", (user_id, day_end, day_start))
+            self._upsert(conn, user_id, events, zone)
+            conn.execute(
+                "INSERT OR REPLACE INTO synced_days (user_id, date, synced_at) VALUES (?, ?, ?)",
+                (user_id, date, time.time()),
+            )
+
+    def invalidate(self, user_id: str, date: Optional[str] = None) -> None:
+        """Force the next query to go back to the provider (after a write, for example)"""
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE sync_state SET synced_at = 0 WHERE user_id = ?", (user_id,))
+            if date is None:
+                conn.execute("DELETE FROM synced_days WHERE user_id = ?", (user_id,))
+            else:
+                conn.execute("DELETE FROM synced_days WHERE user_id = ? AND date = ?", (user_id, date))
+        calendar_stats["invalidations"] += 1
+
+    def refresh(self, user_id: str, provider: CalendarProvider, date: str, zone: tzinfo = timezone.utc) -> bool:
+        """Bring the mirror up to date for a day in zone if it is stale; returns whether the provider was asked"""
+        conn = self._conn()
+        now = time.time()
+        if provider.supports_sync_tokens:
+            row = conn.execute("SELECT sync_token, synced_at FROM sync_state WHERE user_id = ?", (user_id,)).fetchone()
+            if row is not None and now - row[1] < CALENDAR_SYNC_INTERVAL:
+                return False
+            sync_token = row[0] if row is not None else None
+            with span("calendar_sync", full=sync_token is None):
+                try:
+                    changes = provider.sync(user_id, sync_token)
+                except SyncTokenExpired:
+                    logger.info("Calendar sync token expired for %s, running a full sync", user_id)
+                    changes = provider.sync(user_id, None)
+            calendar_stats["full_syncs" if changes.full else "incremental_syncs"] += 1
+            self.apply_changes(user_id, changes, zone)
+            return True
+
+        row = conn.execute("SELECT synced_at FROM synced_days WHERE user_id = ? AND date = ?", (user_id, date)).fetchone()
+        if row is not None and now - row[0] < CALENDAR_DAY_TTL:
+            return False
+        with span("calendar_sync", full=True):
+            events = provider.list_events(user_id, date)
+        calendar_stats["day_fetches"] += 1
+        self.replace_day(user_id, date, events, zone)
+        return True
+
+    def _local_slots(self, user_id: str, windows: List[Tuple[str, str]], zone: tzinfo) -> List[Dict]:
+        """Free slots in each (start, end) window of UTC times, as wall-clock times in zone"""
+        busy = self.busy(user_id, windows[0][0], windows[-1][1])
+        slots = []
+        for window_start, window_end in windows:
+            overlapping = [event for event in busy if event["start"] < window_end and event["end"] > window_start]
+            slots.extend(compute_free_slots(overlapping, window_start, window_end))
+        return [{"start": local_time(slot["start"], zone), "end": local_time(slot["end"], zone)} for slot in slots]
+
+    def free_slots(self, user_id: str, provider: CalendarProvider, date: str, start_time: str, end_time: str, zone: Optional[str] = None) -> List[Dict]:
+        """Free slots between start_time and end_time on a date, all wall-clock times in zone, from the mirror"""
+        return self.free_slots_range(user_id, provider, [date], start_time, end_time, zone)
+
+    def free_slots_range(self, user_id: str, provider: CalendarProvider, dates: List[str], start_time: str, end_time: str, zone: Optional[str] = None) -> List[Dict]:
+        """
+        Free slots between start_time and end_time on each of several dates
+        (in order), all wall-clock times in zone (CALENDAR_TIME_ZONE by
+        default). A provider with sync tokens is synced once for the whole
+        range; otherwise stale days are fetched CALENDAR_FETCH_CONCURRENCY at a time.
+        """
+        if not dates:
+            return []
+        local = time_zone(zone)
+        if provider.supports_sync_tokens:
+            refreshed = self.refresh(user_id, provider, dates[0], local)
+        else:
+            with ThreadPoolExecutor(max_workers=CALENDAR_FETCH_CONCURRENCY) as pool:
+                refreshed = any(list(pool.map(lambda date: self.refresh(user_id, provider, date, local), dates)))
+        if not refreshed:
+            calendar_stats["mirror_hits"] += 1
+        windows = [
+            (normalise_time(f"{date}T{start_time}", local), normalise_time(f"{date}T{end_time}", local))
+            for date in dates
+        ]
+        return self._local_slots(user_id, windows, local)
+
+
+_mirror: Optional[CalendarMirror] = None
+_provider: Optional[CalendarProvider] = None
+_provider_loaded = False
+_lock = threading.Lock()
+
+
+def get_calendar_mirror() -> CalendarMirror:
+    """Return the shared calendar mirror, created on first use"""
+    global _mirror
+    if _mirror is None:
+        with _lock:
+            if _mirror is None:
+                _mirror = CalendarMirror()
+    return _mirror
+
+
+def get_calendar_provider() -> Optional[CalendarProvider]:
+    """Return the provider named by CALENDAR_PROVIDER, created on first use, or None when it is unset"""
+    global _provider, _provider_loaded
+    if not _provider_loaded:
+        with _lock:
+            if not _provider_loaded:
+                if CALENDAR_PROVIDER:
+                    module_name, class_name = CALENDAR_PROVIDER.split(":")
+                    _provider = getattr(importlib.import_module(module_name), class_name)()
+                _provider_loaded = True
+    return _provider
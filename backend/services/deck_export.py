@@ -0,0 +1,310 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional
+
+from services.pdf_text import unique_temp_path
+
+# Export formats for flashcard decks. Every writer consumes cards lazily and
+# yields encoded chunks, so a large deck never exists twice in memory.
+EXPORT_FORMATS = ("csv", "apkg", "columnar")
+EXPORT_FIELDS = ("id", "question", "answer", "source_file")
+# Cards per CSV chunk, binary block or Parquet row group
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# Length-prefixed columnar fallback used when pyarrow is not installed:
+#   magic, then blocks of <uint32 card count><uint32 payload size><zlib payload>,
+#   where the payload holds, for each field, <uint32 length> * count followed
+#   by the concatenated UTF-8 values; a zero count ends the stream
+BINARY_MAGIC = b"SFCD\x01"
+BINARY_COMPRESSION_LEVEL = 6
+_UINT32 = struct.Struct("<I")
+
+
+def _field(card: Dict, name: str) -> str:
+    value = card.get(name)
+    return "" if value is None else str(value)
+
+
+def _batches(cards: Iterable[Dict], size: Optional[int] = None) -> Iterator[List[Dict]]:
+    """Lists of size cards (EXPORT_BATCH_SIZE, read at call time, by default)"""
+    size = size or EXPORT_BATCH_SIZE
+    batch: List[Dict] = []
+    for card in cards:
+        batch.append(card)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _stream_file(path: str) -> Iterator[bytes]:
+    """Yield a file in chunks and delete it afterwards"""
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(STREAM_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def write_csv(cards: Iterable[Dict]) -> Iterator[bytes]:
+    """Stream a deck as UTF-8 CSV with a header row"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for batch in _batches(cards):
+        writer.writerows([_field(card, name) for name in EXPORT_FIELDS] for card in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def read_csv(stream: Iterable[str]) -> Iterator[Dict]:
+    """Read cards back from write_csv output (an iterable of text lines)"""
+    for row in csv.DictReader(stream):
+        yield row
+
+
+def write_binary(cards: Iterable[Dict]) -> Iterator[bytes]:
+    """Stream a deck in the length-prefixed columnar block format"""
+    yield BINARY_MAGIC
+    for batch in _batches(cards):
+        parts = []
+        for name in EXPORT_FIELDS:
+            values = [_field(card, name).encode() for card in batch]
+            parts.append(struct.pack(f"<{len(values)}I", *map(len, values)))
+            parts.extend(values)
+        # Values of one field sit together, so each block compresses well
+        payload = zlib.compress(b"".join(parts), BINARY_COMPRESSION_LEVEL)
+        yield _UINT32.pack(len(batch)) + _UINT32.pack(len(payload)) + payload
+    yield _UINT32.pack(0)
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated deck export")
+    return data
+
+
+def read_binary(stream: BinaryIO) -> Iterator[Dict]:
+    """Read cards back from write_binary output, one block at a time"""
+    if _read_exact(stream, len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise ValueError("Not a binary deck export")
+    while True:
+        (count,) = _UINT32.unpack(_read_exact(stream, _UINT32.size))
+        if not count:
+            return
+        (size,) = _UINT32.unpack(_read_exact(stream, _UINT32.size))
+        block = zlib.decompress(_read_exact(stream, size))
+        columns, offset = [], 0
+        for _ in EXPORT_FIELDS:
+            lengths = struct.unpack_from(f"<{count}I", block, offset)
+            offset += 4 * count
+            values = []
+            for length in lengths:
+                values.append(block[offset:offset + length].decode())
+                offset += length
+            columns.append(values)
+        for values in zip(*columns):
+            yield dict(zip(EXPORT_FIELDS, values))
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # type: ignore # noqa: F401
+        import pyarrow.parquet  # type: ignore # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def write_parquet_file(cards: Iterable[Dict], directory: Optional[str] = None) -> str:
+    """Write a deck to a Parquet temp file, one row group per batch (needs pyarrow); returns its path"""
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+
+    schema = pa.schema([(name, pa.string()) for name in EXPORT_FIELDS])
+    path = unique_temp_path(directory or tempfile.gettempdir(), ".parquet")
+    # Parquet's footer is written last, so the file is built on disk and streamed after
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for batch in _batches(cards):
+            columns = {name: [_field(card, name) for card in batch] for name in EXPORT_FIELDS}
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+    return path
+
+
+def write_parquet(cards: Iterable[Dict], directory: Optional[str] = None) -> Iterator[bytes]:
+    """Stream a deck as Parquet (needs pyarrow)"""
+    return _stream_file(write_parquet_file(cards, directory))
+
+
+# Minimal Anki 2.1 collection (schema 11): one basic note type and one deck
+ANKI_SCHEMA = """
+    CREATE TABLE col (
+        id integer primary key, crt integer not null, mod integer not null, scm integer not null,
+        ver integer not null, dty integer not null, usn integer not null, ls integer not null,
+        conf text not null, models text not null, decks text not null, dconf text not null, tags text not null
+    );
+    CREATE TABLE notes (
+        id integer primary key, guid text not null, mid integer not null, mod integer not null,
+        usn integer not null, tags text not null, flds text not null, sfld integer not null,
+        csum integer not null, flags integer not null, data text not null
+    );
+    CREATE TABLE cards (
+        id integer primary key, nid integer not null, did integer not null, ord integer not null,
+        mod integer not null, usn integer not null, type integer not null, queue integer not null,
+        due integer not null, ivl integer not null, factor integer not null, reps integer not null,
+        lapses integer not null, left integer not null, odue integer not null, odid integer not null,
+        flags integer not null, data text not null
+    );
+    CREATE TABLE revlog (
+        id integer primary key, cid integer not null, usn integer not null, ease integer not null,
+        ivl integer not null, lastIvl integer not null, factor integer not null, time integer not null,
+        type integer not null
+    );
+    CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+    CREATE INDEX ix_notes_usn ON notes (usn);
+    CREATE INDEX ix_cards_usn ON cards (usn);
+    CREATE INDEX ix_revlog_usn ON revlog (usn);
+    CREATE INDEX ix_cards_nid ON cards (nid);
+    CREATE INDEX ix_cards_sched ON cards (did, queue, due);
+    CREATE INDEX ix_revlog_cid ON revlog (cid);
+    CREATE INDEX ix_notes_csum ON notes (csum);
+"""
+ANKI_MODEL_ID = 1607392319
+ANKI_DECK_CONF = {
+    "1": {
+        "id": 1, "name": "Default", "mod": 0, "usn": 0, "maxTaken": 60, "autoplay": True, "timer": 0,
+        "replayq": True, "dyn": False,
+        "new": {"delays": [1, 10], "ints": [1, 4, 7], "initialFactor": 2500, "order": 1, "perDay": 20, "bury": True},
+        "rev": {"perDay": 200, "ease4": 1.3, "fuzz": 0.05, "ivlFct": 1, "maxIvl": 36500, "bury": True},
+        "lapse": {"delays": [10], "mult": 0, "minInt": 1, "leechFails": 8, "leechAction": 0},
+    }
+}
+
+
+def _anki_checksum(text: str) -> int:
+    return int(hashlib.sha1(text.encode()).hexdigest()[:8], 16)
+
+
+def _anki_collection(deck_name: str, deck_id: int, now: int) -> tuple:
+    deck = {
+        "id": deck_id, "name": deck_name, "mod": now, "usn": -1, "desc": "", "dyn": 0, "conf": 1,
+        "collapsed": False, "extendNew": 10, "extendRev": 50,
+        "newToday": [0, 0], "revToday": [0, 0], "lrnToday": [0, 0], "timeToday": [0, 0],
+    }
+    default_deck = dict(deck, id=1, name="Default")
+    model = {
+        "id": ANKI_MODEL_ID, "name": "StudentTools Basic", "type": 0, "mod": now, "usn": -1,
+        "sortf": 0, "did": deck_id, "tags": [], "vers": [], "req": [[0, "all", [0]]],
+        "flds": [
+            {"name": name, "ord": i, "sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []}
+            for i, name in enumerate(("Question", "Answer", "Source"))
+        ],
+        "tmpls": [{
+            "name": "Card 1", "ord": 0, "did": None, "bqfmt": "", "bafmt": "",
+            "qfmt": "{{Question}}",
+            "afmt": "{{FrontSide}}<hr id=answer>{{Answer}}<div class=source>{{Source}}</div>",
+        }],
+        "css": ".card { font-family: arial; font-size: 20px; text-align: center; }\n.source { font-size: 12px; color: #888; }",
+        "latexPre": "\\documentclass[12pt]{article}\n\\begin{document}\n", "latexPost": "\\end{document}",
+    }
+    conf = {"activeDecks": [deck_id], "curDeck": deck_id, "nextPos": 1, "sortType": "noteFld", "sortBackwards": False}
+    return (
+        1, now, now * 1000, now * 1000, 11, 0, 0, 0, json.dumps(conf), json.dumps({str(ANKI_MODEL_ID): model}),
+        json.dumps({"1": default_deck, str(deck_id): deck}), json.dumps(ANKI_DECK_CONF), "{}",
+    )
+
+
+def write_apkg_file(cards: Iterable[Dict], deck_name: str = "StudentTools", directory: Optional[str] = None) -> str:
+    """
+    Write a deck to an Anki package temp file and return its path. Notes are
+    inserted into an on-disk collection batch by batch, which is then zipped.
+    """
+    directory = directory or tempfile.gettempdir()
+    collection_path, package_path = unique_temp_path(directory, ".anki2"), unique_temp_path(directory, ".apkg")
+    now = int(time.time())
+    deck_id = int(hashlib.sha1(deck_name.encode()).hexdigest()[:8], 16)
+    conn = sqlite3.connect(collection_path)
+    try:
+        conn.executescript(ANKI_SCHEMA)
+        conn.execute("INSERT INTO col VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", _anki_collection(deck_name, deck_id, now))
+        position = 0
+        for batch in _batches(cards):
+            notes, anki_cards = [], []
+            for card in batch:
+                position += 1
+                note_id = now * 1000 + position
+                question = _field(card, "question")
+                fields = "\x1f".join((question, _field(card, "answer"), _field(card, "source_file")))
+                guid = hashlib.sha1(f"{deck_name}\0{question}\0{position}".encode()).hexdigest()[:10]
+                notes.append((note_id, guid, ANKI_MODEL_ID, now, -1, "", fields, question, _anki_checksum(question), 0, ""))
+                anki_cards.append((note_id, note_id, deck_id, 0, now, -1, 0, 0, position, 0, 0, 0, 0, 0, 0, 0, 0, ""))
+            conn.executemany("INSERT INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", notes)
+            conn.executemany("INSERT INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", anki_cards)
+        conn.commit()
+    finally:
+        conn.close()
+    try:
+        with zipfile.ZipFile(package_path, "w", zipfile.ZIP_DEFLATED) as package:
+            package.write(collection_path, "collection.anki2")
+            package.writestr("media", "{}")
+    finally:
+        os.remove(collection_path)
+    return package_path
+
+
+def write_apkg(cards: Iterable[Dict], deck_name: str = "StudentTools", directory: Optional[str] = None) -> Iterator[bytes]:
+    """Stream a deck as an Anki package"""
+    return _stream_file(write_apkg_file(cards, deck_name, directory))
+
+
+def read_apkg(package: BinaryIO) -> Iterator[Dict]:
+    """Read cards back from an Anki package written by write_apkg"""
+    with zipfile.ZipFile(package) as archive, tempfile.TemporaryDirectory() as directory:
+        path = archive.extract("collection.anki2", directory)
+        conn = sqlite3.connect(path)
+        try:
+            rows = conn.execute("SELECT n.flds FROM notes n JOIN cards c ON c.nid = n.id ORDER BY c.due").fetchall()
+        finally:
+            conn.close()
+    for position, (fields,) in enumerate(rows, 1):
+        question, answer, source_file = fields.split("\x1f")
+        yield {"id": str(position), "question": question, "answer": answer, "source_file": source_file}
+
+
+def export_deck(cards: Iterable[Dict], export_format: str, deck_name: str = "StudentTools") -> tuple:
+    """
+    Pick the writer for an export format.
+    Returns (chunk iterator, media type, file extension, temp file path).
+    Formats built on disk (Anki, Parquet) return the path of the finished
+    file and no chunks; the caller sends the file and deletes it. "columnar"
+    is Parquet when pyarrow is installed and the length-prefixed binary
+    format otherwise.
+    """
+    if export_format == "csv":
+        return write_csv(cards), "text/csv; charset=utf-8", "csv", None
+    if export_format == "apkg":
+        return None, "application/octet-stream", "apkg", write_apkg_file(cards, deck_name)
+    if export_format == "columnar":
+        if parquet_available():
+            return None, "application/vnd.apache.parquet", "parquet", write_parquet_file(cards)
+        return write_binary(cards), "application/octet-stream", "sfcd", None
+    raise ValueError(f"Unknown export format: {export_format}")
@@ -0,0 +1,261 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from services.tracing import logger
+
+# Per-user library of uploaded documents, chunked and indexed with SQLite FTS5 (BM25)
+DOC_INDEX_PATH = os.getenv("DOC_INDEX_PATH", "state/doc_index.db")
+CHUNK_WORDS = int(os.getenv("DOC_INDEX_CHUNK_WORDS", "180"))
+CHUNK_OVERLAP = int(os.getenv("DOC_INDEX_CHUNK_OVERLAP", "30"))
+# Chunks written per transaction, so indexing a long stream does not hold the write lock
+INDEX_BATCH_CHUNKS = int(os.getenv("DOC_INDEX_BATCH_CHUNKS", "256"))
+# A document still being indexed with no batch written for this long (seconds)
+# was left by a process that died; the next upload of it indexes it again
+DOC_INDEX_STALE_SECONDS = float(os.getenv("DOC_INDEX_STALE_SECONDS", "300"))
+# Set to a sentence-transformers model name to rerank BM25 hits with local embeddings
+EMBEDDING_MODEL = os.getenv("DOC_INDEX_EMBEDDING_MODEL", "")
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def chunk_text(text: str, chunk_words: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    """Split text into overlapping chunks of roughly chunk_words words"""
+    return chunk_word_stream(text.split(), chunk_words, overlap)
+
+
+def iter_words(pieces: Iterable[str]) -> Iterator[str]:
+    """The words of the text formed by joining pieces, without joining them"""
+    carry = ""
+    for piece in pieces:
+        words = (carry + piece).split(" ")
+        # The last word may continue in the next piece
+        carry = words.pop()
+        yield from filter(None, words)
+    if carry:
+        yield carry
+
+
+def chunk_word_stream(words: Iterable[str], chunk_words: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    """The chunks chunk_text would produce, holding only one chunk of words at a time"""
+    step = max(1, chunk_words - overlap)
+    buffer: List[str] = []
+    fresh = 0
+    for word in words:
+        buffer.append(word)
+        fresh += 1
+        if len(buffer) == chunk_words:
+            yield " ".join(buffer)
+            del buffer[:step]
+            fresh = 0
+    if fresh:
+        yield " ".join(buffer)
+
+
+def _fts_query(text: str) -> str:
+    """Turn free text into an FTS5 OR query of quoted terms"""
+    terms = {term.lower() for term in WORD_PATTERN.findall(text) if len(term) > 1}
+    return " OR ".join(f'"{term}"' for term in sorted(terms))
+
+
+class DocumentIndex:
+    """Incremental BM25 index over the chunks of every document a user uploads."""
+
+    def __init__(self, path: str = DOC_INDEX_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.local = threading.local()
+        self._encoder = None
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                doc_hash TEXT NOT NULL,
+                filename TEXT,
+                indexed_at REAL NOT NULL,
+                complete INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (user_id, doc_hash)
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                document_id INTEGER NOT NULL REFERENCES documents (id),
+                user_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                text TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_document ON chunks (document_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                text, user_id UNINDEXED, content='chunks', content_rowid='id'
+            );
+        """)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+        if "complete" not in columns:
+            # Libraries from before the flag only held documents that finished indexing
+            conn.execute("ALTER TABLE documents ADD COLUMN complete INTEGER NOT NULL DEFAULT 1")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self.local.conn = conn
+        return conn
+
+    def has_document(self, user_id: str, doc_hash: str) -> bool:
+        row = self._conn().execute(
+            "SELECT 1 FROM documents WHERE user_id = ? AND doc_hash = ? AND complete = 1", (user_id, doc_hash)
+        ).fetchone()
+        return row is not None
+
+    def index_document(self, user_id: str, doc_hash: str, text: str, filename: Optional[str] = None) -> int:
+        """
+        Add one document to the user's library. Only the new document's chunks
+        are written, and a document already in the library is skipped.
+        Returns the number of chunks added.
+        """
+        return self.index_chunks(user_id, doc_hash, chunk_text(text), filename)
+
+    def index_chunks(self, user_id: str, doc_hash: str, chunks: Iterable[str], filename: Optional[str] = None) -> int:
+        """
+        index_document for chunks that are still being produced (e.g. while a
+        large PDF is read page by page). Chunks are committed in batches and
+        the document is only searchable once the last one is in; if the
+        stream fails part way, the partial document is removed. Returns 0 when
+        the document is indexed already or another call is indexing it.
+        """
+        document_id = self._claim(user_id, doc_hash, filename)
+        if document_id is None:
+            return 0
+        added = 0
+        batch: List[str] = []
+        try:
+            for chunk in chunks:
+                batch.append(chunk)
+                if len(batch) >= INDEX_BATCH_CHUNKS:
+                    added += self._insert_chunks(document_id, user_id, added, batch)
+                    batch = []
+            added += self._insert_chunks(document_id, user_id, added, batch)
+            conn = self._conn()
+            with conn:
+                conn.execute("UPDATE documents SET complete = 1, indexed_at = ? WHERE id = ?", (time.time(), document_id))
+        except BaseException:
+            self._remove_document(document_id)
+            raise
+        return added
+
+    def _claim(self, user_id: str, doc_hash: str, filename: Optional[str]) -> Optional[int]:
+        """
+        Add an incomplete document row for this call to fill, or take over
+        one left stale by a process that died; None when the document is
+        indexed already or being indexed
+        """
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO documents (user_id, doc_hash, filename, indexed_at, complete) VALUES (?, ?, ?, ?, 0)",
+                (user_id, doc_hash, filename, now),
+            )
+            if cursor.rowcount:
+                return cursor.lastrowid
+            document_id, complete, indexed_at = conn.execute(
+                "SELECT id, complete, indexed_at FROM documents WHERE user_id = ? AND doc_hash = ?", (user_id, doc_hash)
+            ).fetchone()
+            if complete or now - indexed_at < DOC_INDEX_STALE_SECONDS:
+                return None
+            # Only one caller wins the takeover
+            cursor = conn.execute(
+                "UPDATE documents SET indexed_at = ?, filename = ? WHERE id = ? AND complete = 0 AND indexed_at = ?",
+                (now, filename, document_id, indexed_at),
+            )
+            if not cursor.rowcount:
+                return None
+            logger.info("Re-indexing document %s for %s, left incomplete", doc_hash[:12], user_id)
+            self._delete_chunks(conn, document_id)
+        return document_id
+
+    def _insert_chunks(self, document_id: int, user_id: str, position: int, chunks: List[str]) -> int:
+        conn = self._conn()
+        with conn:
+            for offset, chunk in enumerate(chunks):
+                row = conn.execute(
+                    "INSERT INTO chunks (document_id, user_id, position, text) VALUES (?, ?, ?, ?)",
+                    (document_id, user_id, position + offset, chunk),
+                )
+                conn.execute(
+                    "INSERT INTO chunks_fts (rowid, text, user_id) VALUES (?, ?, ?)",
+                    (row.lastrowid, chunk, user_id),
+                )
+            # Shows the document is still being worked on (see DOC_INDEX_STALE_SECONDS)
+            conn.execute("UPDATE documents SET indexed_at = ? WHERE id = ?", (time.time(), document_id))
+        return len(chunks)
+
+    @staticmethod
+    def _delete_chunks(conn: sqlite3.Connection, document_id: int) -> None:
+        # External-content FTS rows are deleted by replaying their values
+        conn.execute(
+            "INSERT INTO chunks_fts (chunks_fts, rowid, text, user_id) "
+            "SELECT 'delete', id, text, user_id FROM chunks WHERE document_id = ?",
+            (document_id,),
+        )
+        conn.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+
+    def _remove_document(self, document_id: int) -> None:
+        conn = self._conn()
+        with conn:
+            self._delete_chunks(conn, document_id)
+            conn.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+
+    def search(self, user_id: str, query: str, limit: int = 8) -> List[Dict]:
+        """Top chunks across the user's library for a query, best match first"""
+        fts_query = _fts_query(query)
+        if not fts_query:
+            return []
+        # With embeddings enabled, BM25 picks a wider candidate set for reranking
+        candidates = limit * 4 if EMBEDDING_MODEL else limit
+        rows = self._conn().execute(
+            "SELECT c.id, c.document_id, d.filename, c.position, c.text, bm25(chunks_fts) AS score "
+            "FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.rowid "
+            "JOIN documents d ON d.id = c.document_id "
+            "WHERE chunks_fts MATCH ? AND c.user_id = ? AND d.complete = 1 "
+            "ORDER BY score LIMIT ?",
+            (fts_query, user_id, candidates),
+        ).fetchall()
+        columns = ("id", "document_id", "filename", "position", "text", "score")
+        hits = [dict(zip(columns, row)) for row in rows]
+        if EMBEDDING_MODEL and len(hits) > limit:
+            hits = self._rerank(query, hits)
+        return hits[:limit]
+
+    def _rerank(self, query: str, hits: List[Dict]) -> List[Dict]:
+        """Reorder BM25 hits by cosine similarity of local embeddings"""
+        try:
+            if self._encoder is None:
+                from sentence_transformers import SentenceTransformer  # type: ignore
+                self._encoder = SentenceTransformer(EMBEDDING_MODEL)
+        except ImportError:
+            logger.warning("DOC_INDEX_EMBEDDING_MODEL is set but sentence-transformers is not installed")
+            return hits
+        vectors = self._encoder.encode([query] + [hit["text"] for hit in hits], normalize_embeddings=True)
+        scores = vectors[1:] @ vectors[0]
+        order = sorted(range(len(hits)), key=lambda i: -float(scores[i]))
+        return [hits[i] for i in order]
+
+
+_index: Optional[DocumentIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_document_index() -> DocumentIndex:
+    """Return the shared document index, created on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DocumentIndex()
+    return _index
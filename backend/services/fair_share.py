@@ -0,0 +1,447 @@
+import asyncio
+import ipaddress
+import math
+import os
+import re
+import socket
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException
+
+from services.http_responses import DefaultResponse
+from services.tracing import logger, observe
+from services.workers import per_worker
+
+# Set to 0 to run expensive requests without per-user scheduling
+FAIR_SHARE_ENABLED = os.getenv("FAIR_SHARE_ENABLED", "1") != "0"
+# Expensive requests (LLM calls, PDF parsing, calendar queries) running at once in this worker
+FAIR_SHARE_CONCURRENCY = int(os.getenv("FAIR_SHARE_CONCURRENCY", "16"))
+# Most of those one user may hold at once (default: half)
+USER_MAX_RUNNING = int(os.getenv("USER_MAX_RUNNING", str(max(1, FAIR_SHARE_CONCURRENCY // 2))))
+# Requests one user may have queued or running on this host before getting 429
+USER_MAX_PENDING = per_worker(int(os.getenv("USER_MAX_PENDING", "32")))
+# Longest a request waits for its turn before getting 429 (seconds)
+FAIR_SHARE_QUEUE_TIMEOUT = float(os.getenv("FAIR_SHARE_QUEUE_TIMEOUT", "60"))
+# Per-user budgets on this host over a rolling window (seconds); 0 disables a quota
+USER_QUOTA_WINDOW = float(os.getenv("USER_QUOTA_WINDOW", "3600"))
+USER_TOKEN_QUOTA = per_worker(int(os.getenv("USER_TOKEN_QUOTA", "0")))
+USER_CPU_QUOTA = per_worker(float(os.getenv("USER_CPU_QUOTA", "0")))
+# Relative shares, e.g. "teacher=4,demo=0.5"; unlisted users weigh 1
+USER_WEIGHTS = os.getenv("USER_WEIGHTS", "")
+# Share of requests without a trusted X-User-Id, scheduled as one user per client address
+ANONYMOUS_WEIGHT = float(os.getenv("ANONYMOUS_WEIGHT", "0.5"))
+# Addresses, networks or host names of proxies whose X-User-Id and X-Forwarded-For
+# are believed, e.g. "127.0.0.1,10.0.0.0/8,studytoolsai-next"; others are keyed by address
+TRUSTED_PROXIES = os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1")
+# Prefix of the accounts anonymous requests are scheduled under
+ANONYMOUS_PREFIX = "anonymous:"
+# POST requests to these paths are scheduled
+FAIR_SHARE_PATHS = re.compile(r"^/(flashcards(/bulk)?|papers/generate|calendar/.+)$")
+# Of those, paths whose generation is shared between identical requests; only
+# the caller that runs the shared call takes a slot (see scheduled)
+COALESCED_PATHS = re.compile(r"^/(flashcards|papers/generate)$")
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        user_id, _, weight = item.partition("=")
+        weights[user_id.strip()] = float(weight)
+    return weights
+
+
+class QuotaExceeded(Exception):
+    """Raised when a user has to wait before sending another request; becomes a 429"""
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UserAccount:
+    """Scheduling state and rolling usage for one user."""
+    def __init__(self, user_id: str, weight: float):
+        self.user_id = user_id
+        self.weight = weight
+        # Virtual time at which the user's dispatched requests are paid for
+        self.finish = 0.0
+        # Smoothed slot-seconds per request, charged up front and corrected on release
+        self.estimate = 1.0
+        self.running = 0
+        self.waiting: Deque[asyncio.Future] = deque()
+        # (monotonic time, tokens, CPU seconds)
+        self.usage: Deque[Tuple[float, int, float]] = deque()
+
+    def used(self, now: float) -> Tuple[int, float]:
+        """Tokens and CPU seconds used within the quota window"""
+        while self.usage and self.usage[0][0] < now - USER_QUOTA_WINDOW:
+            self.usage.popleft()
+        return sum(entry[1] for entry in self.usage), sum(entry[2] for entry in self.usage)
+
+    def seconds_until_below(self, now: float, field: int, quota: float) -> float:
+        """How long until usage in field drops back under quota as old entries expire"""
+        total = sum(entry[field] for entry in self.usage)
+        for entry in self.usage:
+            total -= entry[field]
+            if total < quota:
+                return entry[0] + USER_QUOTA_WINDOW - now
+        return USER_QUOTA_WINDOW
+
+
+class Job:
+    """A request holding one of the scheduler's slots."""
+    def __init__(self, account: UserAccount, cpu_mark: float):
+        self.account = account
+        self.estimate = account.estimate
+        self.cpu_mark = cpu_mark
+        self.started = time.monotonic()
+        self.tokens = 0
+
+
+# The job of the request being served, so LLM calls can be charged to its user
+_current_job: ContextVar[Optional[Job]] = ContextVar("fair_share_job", default=None)
+# The user of a coalesced request, whose slot is only taken if it runs the shared call
+_current_user: ContextVar[Optional[str]] = ContextVar("fair_share_user", default=None)
+
+
+class FairScheduler:
+    """
+    Weighted fair queueing of expensive requests between users.
+
+    Each user has a virtual finish time that advances by the slot time of
+    their requests divided by their weight. When a slot frees up it goes to
+    the waiting user with the earliest max(virtual time, finish time), so a
+    user who has been idle is served next instead of queueing behind a heavy
+    user's backlog (start-time fair queueing). Token and CPU usage are
+    tracked per user over a rolling window and enforced as quotas. CPU time
+    is the process's CPU split evenly between the requests running at the
+    time; work in the extraction process pool is not included.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = FAIR_SHARE_CONCURRENCY,
+        max_running: int = USER_MAX_RUNNING,
+        max_pending: int = USER_MAX_PENDING,
+        queue_timeout: float = FAIR_SHARE_QUEUE_TIMEOUT,
+        token_quota: int = USER_TOKEN_QUOTA,
+        cpu_quota: float = USER_CPU_QUOTA,
+        weights: Optional[Dict[str, float]] = None,
+        anonymous_weight: float = ANONYMOUS_WEIGHT,
+    ):
+        self.concurrency = concurrency
+        self.max_running = max_running
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.token_quota = token_quota
+        self.cpu_quota = cpu_quota
+        self.weights = weights if weights is not None else parse_weights(USER_WEIGHTS)
+        self.anonymous_weight = anonymous_weight
+        self.lock = threading.Lock()
+        self.accounts: Dict[str, UserAccount] = {}
+        self.running = 0
+        self.virtual_time = 0.0
+        # CPU seconds each running job has been charged since the scheduler started
+        self.cpu_share = 0.0
+        self.cpu_clock = time.process_time()
+
+        # Counters
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_pending = 0
+        self.rejected_quota = 0
+        self.timeouts = 0
+        self.total_queue_wait = 0.0
+
+    def _account(self, user_id: str) -> UserAccount:
+        account = self.accounts.get(user_id)
+        if account is None:
+            default = self.anonymous_weight if user_id.startswith(ANONYMOUS_PREFIX) else 1.0
+            account = self.accounts[user_id] = UserAccount(user_id, self.weights.get(user_id, default))
+        return account
+
+    def _advance_cpu(self) -> None:
+        now = time.process_time()
+        if self.running:
+            self.cpu_share += (now - self.cpu_clock) / self.running
+        self.cpu_clock = now
+
+    def _check_quota(self, account: UserAccount, now: float) -> None:
+        tokens, cpu = account.used(now)
+        if self.token_quota and tokens >= self.token_quota:
+            self.rejected_quota += 1
+            raise QuotaExceeded(
+                f"Token quota of {self.token_quota} per {USER_QUOTA_WINDOW:g}s used",
+                account.seconds_until_below(now, 1, self.token_quota),
+            )
+        if self.cpu_quota and cpu >= self.cpu_quota:
+            self.rejected_quota += 1
+            raise QuotaExceeded(
+                f"CPU quota of {self.cpu_quota:g}s per {USER_QUOTA_WINDOW:g}s used",
+                account.seconds_until_below(now, 2, self.cpu_quota),
+            )
+        if account.running + len(account.waiting) >= self.max_pending:
+            self.rejected_pending += 1
+            raise QuotaExceeded(f"Too many requests in progress (limit {self.max_pending})", account.estimate)
+
+    def _start(self, account: UserAccount) -> Job:
+        self._advance_cpu()
+        start = max(self.virtual_time, account.finish)
+        self.virtual_time = start
+        account.finish = start + account.estimate / account.weight
+        account.running += 1
+        self.running += 1
+        self.admitted += 1
+        return Job(account, self.cpu_share)
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiting users in virtual finish order"""
+        while self.running < self.concurrency:
+            eligible = [
+                account for account in self.accounts.values()
+                if account.waiting and account.running < self.max_running
+            ]
+            if not eligible:
+                return
+            account = min(eligible, key=lambda a: max(self.virtual_time, a.finish))
+            future = account.waiting.popleft()
+            if not future.done():
+                future.set_result(self._start(account))
+
+    async def acquire(self, user_id: str) -> Job:
+        """Wait for a slot for user_id; raises QuotaExceeded instead of waiting past a limit"""
+        queued_at = time.monotonic()
+        with self.lock:
+            account = self._account(user_id)
+            self._check_quota(account, queued_at)
+            if self.running < self.concurrency and account.running < self.max_running:
+                return self._start(account)
+            future = asyncio.get_running_loop().create_future()
+            account.waiting.append(future)
+            self.queued += 1
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            with self.lock:
+                if not future.done():
+                    account.waiting.remove(future)
+                    future.cancel()
+                    self.timeouts += 1
+                    raise QuotaExceeded("Timed out waiting for a turn; the server is busy", account.estimate)
+        except BaseException:
+            # The client went away while queued
+            with self.lock:
+                if not future.done():
+                    account.waiting.remove(future)
+                    future.cancel()
+                    raise
+            self.release(future.result())
+            raise
+        wait = time.monotonic() - queued_at
+        self.total_queue_wait += wait
+        observe("fair_share_wait", wait)
+        return future.result()
+
+    def release(self, job: Job) -> None:
+        """Free the job's slot, record its usage and pass the slot on"""
+        now = time.monotonic()
+        with self.lock:
+            self._advance_cpu()
+            account = job.account
+            elapsed = now - job.started
+            account.running -= 1
+            self.running -= 1
+            # Replace the estimate charged at dispatch with the time actually used
+            account.finish += (elapsed - job.estimate) / account.weight
+            account.estimate = 0.8 * account.estimate + 0.2 * elapsed
+            account.usage.append((now, 0, self.cpu_share - job.cpu_mark))
+            if not account.running and not account.waiting and account.finish <= self.virtual_time:
+                # Nothing to remember once the window passes; drop idle users
+                account.used(now)
+                if not account.usage:
+                    del self.accounts[account.user_id]
+            self._dispatch()
+
+    def charge_tokens(self, job: Job, tokens: int) -> None:
+        with self.lock:
+            job.tokens += tokens
+            job.account.usage.append((time.monotonic(), tokens, 0.0))
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        """Return counters and the heaviest users in the quota window"""
+        now = time.monotonic()
+        with self.lock:
+            users = []
+            for account in self.accounts.values():
+                tokens, cpu = account.used(now)
+                users.append({
+                    "user_id": account.user_id,
+                    "weight": account.weight,
+                    "running": account.running,
+                    "waiting": len(account.waiting),
+                    "tokens": tokens,
+                    "cpu_seconds": round(cpu, 3),
+                })
+            users.sort(key=lambda user: (-user["tokens"], -user["cpu_seconds"]))
+            return {
+                "enabled": FAIR_SHARE_ENABLED,
+                "concurrency": self.concurrency,
+                "running": self.running,
+                "waiting": sum(len(account.waiting) for account in self.accounts.values()),
+                "users": len(self.accounts),
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected_pending": self.rejected_pending,
+                "rejected_quota": self.rejected_quota,
+                "timeouts": self.timeouts,
+                "total_queue_wait_seconds": round(self.total_queue_wait, 3),
+                "top_users": users[:top],
+            }
+
+
+# Shared scheduler in front of expensive endpoints in this process
+fair_scheduler = FairScheduler()
+
+
+def charge_tokens(tokens: int) -> None:
+    """Charge LLM tokens to the user whose request is being served, if any"""
+    job = _current_job.get()
+    if job is not None:
+        fair_scheduler.charge_tokens(job, tokens)
+
+
+def current_priority() -> float:
+    """
+    The virtual finish time of the current request's user, which runs ahead
+    for users with a backlog (lower is served first by the LLM token
+    buckets); 0 outside scheduled requests.
+    """
+    job = _current_job.get()
+    return job.account.finish if job is not None else 0.0
+
+
+def _resolve(host: str) -> List[str]:
+    try:
+        return [info[4][0] for info in socket.getaddrinfo(host, None)]
+    except OSError:
+        # Not up yet (e.g. a container starting after this one); try again next time
+        return []
+
+
+_trusted_networks = []
+_trusted_names = []
+for entry in filter(None, (part.strip() for part in TRUSTED_PROXIES.split(","))):
+    try:
+        _trusted_networks.append(ipaddress.ip_network(entry, strict=False))
+    except ValueError:
+        _trusted_names.append(entry)
+
+
+def trusted_proxy(address: Optional[str]) -> bool:
+    """Whether address is one of TRUSTED_PROXIES"""
+    if not address:
+        return False
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    if any(ip in network for network in _trusted_networks):
+        return True
+    return any(address in _resolve(name) for name in _trusted_names)
+
+
+def user_key(scope: Dict[str, Any]) -> str:
+    """
+    The user a request is scheduled as: the X-User-Id header when a trusted
+    proxy sent it, otherwise an anonymous account for the client address
+    (the last X-Forwarded-For hop when a trusted proxy forwarded the
+    request). Headers from other clients are ignored, so leaving out or
+    rotating X-User-Id does not get round the scheduler.
+    """
+    client = scope.get("client")
+    address = client[0] if client else None
+    if trusted_proxy(address):
+        forwarded = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-user-id" and value.strip():
+                return value.decode("latin-1").strip()
+            if name == b"x-forwarded-for" and value.strip():
+                forwarded = value.decode("latin-1").split(",")[-1].strip()
+        address = forwarded or address
+    return ANONYMOUS_PREFIX + (address or "unknown")
+
+
+def retry_after(e: QuotaExceeded) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+
+
+def scheduled(fn: Callable[[], Awaitable[Any]]) -> Callable[[], Awaitable[Any]]:
+    """
+    Wrap the shared call of a coalesced request (see SingleFlight) so it
+    holds a slot for the user of the request that starts it. Requests that
+    join an identical call already in flight take no slot and cannot be
+    rejected. A rejection is raised as a 429 HTTPException.
+    """
+    async def run():
+        user_id = _current_user.get()
+        if user_id is None or _current_job.get() is not None:
+            return await fn()
+        try:
+            job = await fair_scheduler.acquire(user_id)
+        except QuotaExceeded as e:
+            logger.info("Rejected request from %s: %s", user_id, e)
+            raise HTTPException(status_code=429, detail=str(e), headers=retry_after(e))
+        token = _current_job.set(job)
+        try:
+            return await fn()
+        finally:
+            _current_job.reset(token)
+            fair_scheduler.release(job)
+    return run
+
+
+class FairShareMiddleware:
+    """
+    Holds a scheduler slot for the whole of each expensive request, streamed
+    bodies included. Coalesced endpoints only record the user here and take
+    their slot in scheduled().
+    """
+
+    def __init__(self, app, scheduler: FairScheduler = fair_scheduler):
+        self.app = app
+        self.scheduler = scheduler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not FAIR_SHARE_PATHS.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        user_id = user_key(scope)
+        if COALESCED_PATHS.match(scope["path"]):
+            token = _current_user.set(user_id)
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _current_user.reset(token)
+            return
+        try:
+            job = await self.scheduler.acquire(user_id)
+        except QuotaExceeded as e:
+            logger.info("Rejected request from %s: %s", user_id, e)
+            await DefaultResponse({"detail": str(e)}, status_code=429, headers=retry_after(e))(scope, receive, send)
+            return
+        token = _current_job.set(job)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_job.reset(token)
+            self.scheduler.release(job)
+
+
+def add_fair_share(app: FastAPI) -> None:
+    """Schedule expensive endpoints fairly between users (see FairScheduler)"""
+    if FAIR_SHARE_ENABLED:
+        app.add_middleware(FairShareMiddleware)
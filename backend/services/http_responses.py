@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import re
+from typing import Any, Optional
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+try:
+    from starlette.middleware.gzip import DEFAULT_EXCLUDED_CONTENT_TYPES
+except ImportError:  # Older Starlette compresses every content type
+    DEFAULT_EXCLUDED_CONTENT_TYPES = None
+
+# orjson is several times faster than the standard library for large decks
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+# Responses smaller than this are sent uncompressed (bytes)
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))
+# PDFs, Anki packages and Parquet files are already compressed; NDJSON progress
+# would sit in the compressor's buffer instead of reaching the client
+UNCOMPRESSED_CONTENT_TYPES = (
+    "application/pdf", "application/octet-stream", "application/vnd.apache.parquet", "application/x-ndjson",
+)
+# Generated papers, deck exports and the bulk progress stream
+UNCOMPRESSED_PATHS = (r"^/papers/", r"/export$", r"^/flashcards/bulk$")
+
+
+def dumps(value: Any) -> bytes:
+    """Compact JSON encoding, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class DefaultResponse(JSONResponse):
+    """JSON response rendered with dumps; the app's default response class"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class SkipPathsMiddleware:
+    """Sends requests for UNCOMPRESSED_PATHS straight to the app, past the compression middleware"""
+
+    def __init__(self, app: ASGIApp, compression: type, **options: Any):
+        self.app = app
+        self.compressed = compression(app, **options)
+        self.skip = re.compile("|".join(UNCOMPRESSED_PATHS))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and self.skip.search(scope["path"]):
+            await self.app(scope, receive, send)
+        else:
+            await self.compressed(scope, receive, send)
+
+
+def add_compression(app: FastAPI) -> str:
+    """
+    Compress responses above COMPRESSION_MIN_BYTES: brotli (falling back to
+    gzip for clients without it) when brotli-asgi is installed, gzip otherwise.
+    UNCOMPRESSED_PATHS and UNCOMPRESSED_CONTENT_TYPES are sent as they are.
+    Returns the encoding in use.
+    """
+    try:
+        from brotli_asgi import BrotliMiddleware  # type: ignore
+    except ImportError:
+        options = {}
+        if DEFAULT_EXCLUDED_CONTENT_TYPES is not None:
+            options["exclude_content_types"] = DEFAULT_EXCLUDED_CONTENT_TYPES + UNCOMPRESSED_CONTENT_TYPES
+        app.add_middleware(
+            SkipPathsMiddleware, compression=GZipMiddleware,
+            minimum_size=COMPRESSION_MIN_BYTES, compresslevel=COMPRESSION_LEVEL, **options,
+        )
+        return "gzip"
+    app.add_middleware(
+        SkipPathsMiddleware, compression=BrotliMiddleware,
+        minimum_size=COMPRESSION_MIN_BYTES, gzip_fallback=True,
+    )
+    return "br"
+
+
+def etag_for(data: bytes) -> str:
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header covers etag (weak comparison, as RFC 9110 requires)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
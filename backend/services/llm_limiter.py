@@ -0,0 +1,461 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import math
+import os
+import random
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from services.fair_share import charge_tokens, current_priority
+from services.tracing import observe
+from services.workers import per_worker
+
+# Anthropic returns 429 when rate limited and 529 when overloaded
+RETRYABLE_STATUS_CODES = (429, 529)
+# Output tokens are reserved at this share of max_tokens until responses show the real share
+INITIAL_OUTPUT_RATIO = 0.5
+MIN_OUTPUT_RATIO = 0.05
+# How often async callers re-check the buckets and slots (seconds)
+ASYNC_POLL_INTERVAL = 0.05
+# Retry-After suggested to clients turned away when there is no better estimate (seconds)
+UNAVAILABLE_RETRY_AFTER = 5.0
+
+
+class LLMUnavailable(Exception):
+    """
+    Raised when a call cannot be served for now: it was not admitted before
+    its deadline, or the API was still throttling it when the retries ran
+    out. Endpoints answer it with a 503 (see service_unavailable).
+    """
+    def __init__(self, message: str, retry_after: float = UNAVAILABLE_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMQueueTimeout(LLMUnavailable):
+    """Raised when a call could not be admitted before its deadline"""
+
+
+def service_unavailable(e: LLMUnavailable) -> HTTPException:
+    """The 503, with Retry-After, to answer a request whose LLM call was turned away"""
+    return HTTPException(
+        status_code=503,
+        detail=f"The AI service is busy, please try again shortly ({e})",
+        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate used for rate limiting (about 4 characters per token)"""
+    return max(1, len(text) // 4)
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    return getattr(error, "status_code", None)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Read the retry-after header (in seconds) from an API error, if present"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at a per-minute rate.
+    Waiting callers are served strictly in priority order (then arrival
+    order), so a stream of small requests cannot starve a large one and
+    users favoured by the fair-share scheduler are not overtaken. Callers
+    can wait in a thread (acquire) or on the event loop (acquire_async).
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.condition = threading.Condition()
+        self.waiters: list = []
+        self.arrivals = itertools.count()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _try_take(self, ticket, amount: float, deadline: float) -> float:
+        """
+        Take amount tokens if ticket is first in line and they are available
+        (returns 0), else return how long to wait before trying again.
+        Call with the condition held.
+        """
+        self._refill()
+        now = time.monotonic()
+        if self.waiters[0] != ticket:
+            # Woken when the callers ahead are served or give up
+            if now >= deadline:
+                raise LLMQueueTimeout("Timed out waiting behind other calls for the token rate limit")
+            return min(deadline - now, 1.0)
+        if self.tokens >= amount:
+            heapq.heappop(self.waiters)
+            self.tokens -= amount
+            return 0.0
+        wait = (amount - self.tokens) / self.rate
+        if now + wait > deadline:
+            raise LLMQueueTimeout("Token rate limit would not allow this request before its deadline", retry_after=wait)
+        return min(wait, 1.0)
+
+    def _leave(self, ticket) -> None:
+        with self.condition:
+            if ticket in self.waiters:
+                self.waiters.remove(ticket)
+                heapq.heapify(self.waiters)
+            self.condition.notify_all()
+
+    def acquire(self, amount: int, deadline: float, priority: float = 0.0) -> None:
+        """Block until amount tokens are available or raise LLMQueueTimeout at the deadline"""
+        # A single request larger than the bucket can never fit, so cap it
+        amount = min(float(amount), self.capacity)
+        ticket = (priority, next(self.arrivals))
+        with self.condition:
+            heapq.heappush(self.waiters, ticket)
+        try:
+            with self.condition:
+                while True:
+                    wait = self._try_take(ticket, amount, deadline)
+                    if not wait:
+                        return
+                    self.condition.wait(wait)
+        finally:
+            self._leave(ticket)
+
+    async def acquire_async(self, amount: int, deadline: float, priority: float = 0.0) -> None:
+        """acquire() that waits on the event loop instead of blocking a thread"""
+        amount = min(float(amount), self.capacity)
+        ticket = (priority, next(self.arrivals))
+        with self.condition:
+            heapq.heappush(self.waiters, ticket)
+        try:
+            while True:
+                with self.condition:
+                    wait = self._try_take(ticket, amount, deadline)
+                if not wait:
+                    return
+                # Polled, as threads waiting on the condition cannot wake the event loop
+                await asyncio.sleep(min(wait, ASYNC_POLL_INTERVAL))
+        finally:
+            self._leave(ticket)
+
+    def refund(self, amount: int) -> None:
+        """Return unused tokens to the bucket"""
+        with self.condition:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+            self.condition.notify_all()
+
+    def debit(self, amount: int) -> None:
+        """Take tokens used beyond a reservation; the balance may go negative, delaying later callers"""
+        with self.condition:
+            self._refill()
+            self.tokens -= amount
+
+
+class AdmissionController:
+    """
+    Admission control shared by every Claude call.
+
+    Concurrency is limited with AIMD: the limit grows by 1/limit after each
+    successful call and is halved whenever the API returns 429/529. Input and
+    output tokens are limited per minute with token buckets, and throttled
+    calls are retried with jittered backoff that honours retry-after. Callers
+    wait in a queue until admitted or until their deadline passes.
+
+    Output tokens are reserved at the observed average share of max_tokens
+    rather than max_tokens itself, and the difference is settled once the
+    response reports its usage. Async callers (acall) wait for admission on
+    the event loop and only use a thread for the request itself; blocking
+    work that calls the LLM from a thread goes through run_in_thread, which
+    bounds how many threads can be parked waiting for admission.
+    """
+
+    def __init__(
+        self,
+        initial_limit: float = 4,
+        min_limit: float = 1,
+        max_limit: float = 32,
+        input_tokens_per_minute: int = 40000,
+        output_tokens_per_minute: int = 8000,
+        max_retries: int = 5,
+        queue_timeout: float = 120.0,
+        base_backoff: float = 1.0,
+        max_backoff: float = 30.0,
+        worker_threads: int = 16,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.input_bucket = TokenBucket(input_tokens_per_minute)
+        self.output_bucket = TokenBucket(output_tokens_per_minute)
+        self.max_retries = max_retries
+        self.queue_timeout = queue_timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.worker_threads = worker_threads
+        # One gate per event loop, as asyncio primitives belong to a loop
+        self._thread_gates: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        # Smoothed share of max_tokens that responses actually use
+        self.output_ratio = INITIAL_OUTPUT_RATIO
+
+        # Counters, updated with the condition held
+        self.admitted = 0
+        self.throttled = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.total_queue_wait = 0.0
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """Create a controller configured from LLM_* environment variables"""
+        # Concurrency and token budgets are for the whole host, shared by its workers
+        max_limit = max(1.0, per_worker(float(os.getenv("LLM_MAX_CONCURRENCY", "32"))))
+        return cls(
+            initial_limit=min(max_limit, float(os.getenv("LLM_INITIAL_CONCURRENCY", "4"))),
+            max_limit=max_limit,
+            input_tokens_per_minute=per_worker(int(os.getenv("LLM_INPUT_TOKENS_PER_MINUTE", "40000"))),
+            output_tokens_per_minute=per_worker(int(os.getenv("LLM_OUTPUT_TOKENS_PER_MINUTE", "8000"))),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "5")),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "120")),
+            worker_threads=int(os.getenv("LLM_WORKER_THREADS", "16")),
+        )
+
+    def _try_slot(self, deadline: float) -> float:
+        """Take a concurrency slot (returns 0) or return how long to wait; call with the condition held"""
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return 0.0
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMQueueTimeout("Timed out waiting for an LLM concurrency slot")
+        return remaining
+
+    def _acquire_slot(self, deadline: float) -> None:
+        with self.condition:
+            while True:
+                wait = self._try_slot(deadline)
+                if not wait:
+                    return
+                self.condition.wait(wait)
+
+    async def _acquire_slot_async(self, deadline: float) -> None:
+        while True:
+            with self.condition:
+                wait = self._try_slot(deadline)
+            if not wait:
+                return
+            await asyncio.sleep(min(wait, ASYNC_POLL_INTERVAL))
+
+    def _release_slot(self, throttled: bool) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def _reservation(self, max_output_tokens: int) -> int:
+        with self.condition:
+            return max(1, min(max_output_tokens, math.ceil(max_output_tokens * self.output_ratio)))
+
+    def _admitted(self, queued_at: float) -> None:
+        queue_wait = time.monotonic() - queued_at
+        with self.condition:
+            self.total_queue_wait += queue_wait
+            self.admitted += 1
+        observe("llm_queue_wait", queue_wait)
+
+    def _abandon(self, input_tokens: int, reserved: int, stage: int, timed_out: bool) -> None:
+        """Give back the tokens taken before admission stopped at stage (0 input, 1 output, 2 slot)"""
+        if stage > 0:
+            self.input_bucket.refund(input_tokens)
+        if stage > 1:
+            self.output_bucket.refund(reserved)
+        if timed_out:
+            with self.condition:
+                self.timeouts += 1
+
+    def _throttled(self, error: Exception, attempt: int, deadline: float, input_tokens: int, reserved: int) -> float:
+        """Release a throttled call's slot and tokens; return the backoff, or raise LLMUnavailable when out of retries or time"""
+        self._release_slot(throttled=True)
+        # A throttled request was not served, so its tokens are not spent
+        self.input_bucket.refund(input_tokens)
+        self.output_bucket.refund(reserved)
+        delay = self._backoff(error, attempt)
+        with self.condition:
+            self.throttled += 1
+            if attempt >= self.max_retries or time.monotonic() + delay > deadline:
+                raise LLMUnavailable(
+                    f"Claude API still returned {_status_code(error)} after {attempt} retries", retry_after=delay
+                ) from error
+            self.retries += 1
+        return delay
+
+    def _settle(self, result: Any, input_tokens: int, max_output_tokens: int, reserved: int) -> None:
+        """Settle the output reservation against the reported usage and charge the user"""
+        self._release_slot(throttled=False)
+        usage = getattr(result, "usage", None)
+        output_tokens = getattr(usage, "output_tokens", None)
+        used_input = getattr(usage, "input_tokens", None)
+        if isinstance(output_tokens, int):
+            if output_tokens > reserved:
+                self.output_bucket.debit(output_tokens - reserved)
+            elif output_tokens < reserved:
+                self.output_bucket.refund(reserved - output_tokens)
+            with self.condition:
+                share = min(1.0, output_tokens / max(1, max_output_tokens))
+                self.output_ratio = max(MIN_OUTPUT_RATIO, 0.8 * self.output_ratio + 0.2 * share)
+        charge_tokens(
+            (used_input if isinstance(used_input, int) else input_tokens)
+            + (output_tokens if isinstance(output_tokens, int) else reserved)
+        )
+
+    def _backoff(self, error: Exception, attempt: int) -> float:
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            # Spread retries slightly so callers told the same delay do not stampede
+            return retry_after + random.uniform(0, min(1.0, retry_after * 0.1 + 0.1))
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    def call(self, fn: Callable[..., Any], *, input_tokens: int, max_output_tokens: int, **kwargs) -> Any:
+        """
+        Call fn(**kwargs) once admitted, retrying on 429/529.
+        Raises LLMQueueTimeout if the call cannot be admitted before the queue
+        deadline, and LLMUnavailable if it is still throttled after the retries.
+        """
+        deadline = time.monotonic() + self.queue_timeout
+        # Users who have had less than their share wait ahead of heavy users
+        priority = current_priority()
+        attempt = 0
+        while True:
+            queued_at = time.monotonic()
+            reserved = self._reservation(max_output_tokens)
+            stage = 0
+            try:
+                self.input_bucket.acquire(input_tokens, deadline, priority)
+                stage = 1
+                self.output_bucket.acquire(reserved, deadline, priority)
+                stage = 2
+                self._acquire_slot(deadline)
+            except LLMQueueTimeout:
+                self._abandon(input_tokens, reserved, stage, timed_out=True)
+                raise
+            self._admitted(queued_at)
+
+            started = time.perf_counter()
+            try:
+                result = fn(**kwargs)
+            except Exception as e:
+                observe("llm_latency", time.perf_counter() - started)
+                if _status_code(e) not in RETRYABLE_STATUS_CODES:
+                    self._release_slot(throttled=False)
+                    raise
+                time.sleep(self._throttled(e, attempt, deadline, input_tokens, reserved))
+                attempt += 1
+                continue
+
+            observe("llm_latency", time.perf_counter() - started)
+            self._settle(result, input_tokens, max_output_tokens, reserved)
+            return result
+
+    async def acall(self, fn: Callable[..., Any], *, input_tokens: int, max_output_tokens: int, **kwargs) -> Any:
+        """call() for async callers: admission and backoff wait on the event loop, and fn runs in the threadpool"""
+        deadline = time.monotonic() + self.queue_timeout
+        priority = current_priority()
+        attempt = 0
+        while True:
+            queued_at = time.monotonic()
+            reserved = self._reservation(max_output_tokens)
+            stage = 0
+            try:
+                await self.input_bucket.acquire_async(input_tokens, deadline, priority)
+                stage = 1
+                await self.output_bucket.acquire_async(reserved, deadline, priority)
+                stage = 2
+                await self._acquire_slot_async(deadline)
+            except LLMQueueTimeout:
+                self._abandon(input_tokens, reserved, stage, timed_out=True)
+                raise
+            except asyncio.CancelledError:
+                self._abandon(input_tokens, reserved, stage, timed_out=False)
+                raise
+            self._admitted(queued_at)
+
+            started = time.perf_counter()
+            try:
+                result = await run_in_threadpool(functools.partial(fn, **kwargs))
+            except asyncio.CancelledError:
+                # The thread has finished by now; its tokens were spent
+                self._release_slot(throttled=False)
+                raise
+            except Exception as e:
+                observe("llm_latency", time.perf_counter() - started)
+                if _status_code(e) not in RETRYABLE_STATUS_CODES:
+                    self._release_slot(throttled=False)
+                    raise
+                await asyncio.sleep(self._throttled(e, attempt, deadline, input_tokens, reserved))
+                attempt += 1
+                continue
+
+            observe("llm_latency", time.perf_counter() - started)
+            self._settle(result, input_tokens, max_output_tokens, reserved)
+            return result
+
+    async def run_in_thread(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        run_in_threadpool for blocking work that calls the LLM through call().
+        At most worker_threads such jobs hold a thread at once; the rest wait
+        on the event loop, so threads parked waiting for admission cannot
+        take the whole pool from other endpoints.
+        """
+        loop = asyncio.get_running_loop()
+        gate = self._thread_gates.get(loop)
+        if gate is None:
+            gate = self._thread_gates[loop] = asyncio.Semaphore(self.worker_threads)
+        async with gate:
+            return await run_in_threadpool(fn, *args, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the current limit and counters"""
+        with self.condition:
+            return {
+                "concurrency_limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "output_reservation_ratio": round(self.output_ratio, 3),
+                "admitted": self.admitted,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "timeouts": self.timeouts,
+                "total_queue_wait_seconds": round(self.total_queue_wait, 3),
+            }
+
+
+# Shared controller in front of every Claude call in this process
+llm_limiter = AdmissionController.from_env()
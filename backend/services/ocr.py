@@ -0,0 +1,189 @@
+import hashlib
+import math
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from services.state_backend import RESULT_CACHE_TTL, get_state_backend
+from services.tracing import logger, span
+from services.workers import CPUS_PER_WORKER, process_pool
+
+# OCR for scanned pages needs pytesseract (plus the tesseract binary) and a
+# rasteriser: pypdfium2 is preferred, pdf2image (poppler) is the fallback.
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+# OCR processes per web worker (default: this worker's share of the cores)
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(CPUS_PER_WORKER)))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def ocr_available() -> bool:
+    """Whether an OCR engine and a rasteriser are installed"""
+    try:
+        import pytesseract  # type: ignore # noqa: F401
+    except ImportError:
+        return False
+    for rasteriser in ("pypdfium2", "pdf2image"):
+        try:
+            __import__(rasteriser)
+            return True
+        except ImportError:
+            continue
+    return False
+
+
+def _read_shared(name: str, size: int) -> bytes:
+    """Copy a document out of the shared memory block the request process created"""
+    from multiprocessing import shared_memory
+
+    # Pool workers share the request process's resource tracker, so the
+    # block is not unlinked when a worker exits; the session unlinks it
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(block.buf[:size])
+    finally:
+        block.close()
+
+
+def _ocr_page_batch(shared_name: str, size: int, page_indices: List[int], dpi: int, lang: str) -> List[str]:
+    """Rasterise and recognise a batch of pages; runs inside a worker process"""
+    import pytesseract  # type: ignore
+
+    pdf_content = _read_shared(shared_name, size)
+    texts = []
+    try:
+        import pypdfium2 as pdfium  # type: ignore
+        document = pdfium.PdfDocument(pdf_content)
+        for index in page_indices:
+            image = document[index].render(scale=dpi / 72).to_pil()
+            texts.append(pytesseract.image_to_string(image, lang=lang))
+        document.close()
+    except ImportError:
+        from pdf2image import convert_from_bytes  # type: ignore
+        for index in page_indices:
+            images = convert_from_bytes(pdf_content, dpi=dpi, first_page=index + 1, last_page=index + 1)
+            texts.append(pytesseract.image_to_string(images[0], lang=lang) if images else "")
+    return texts
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = process_pool(OCR_WORKERS)
+    return _pool
+
+
+class OcrSession:
+    """
+    OCR for one document. The upload is put in shared memory once, however
+    many batches there are, and batches are queued on the process pool as
+    soon as they are submitted, so pages are recognised while the caller
+    goes on parsing. Each page's text is cached in the state backend, so
+    re-uploads of a scan are not re-OCRed. Close to release the shared copy.
+    """
+
+    def __init__(self, pdf_content: bytes, document_hash: Optional[str] = None, budget=None):
+        self.pdf_content = pdf_content
+        self.document_hash = document_hash
+        self.budget = budget
+        self._shared = None
+        self._futures: List[Future] = []
+        self._warned = False
+
+    def _hash(self) -> str:
+        if self.document_hash is None:
+            self.document_hash = hashlib.sha256(self.pdf_content).hexdigest()
+        return self.document_hash
+
+    def _shared_name(self) -> str:
+        if self._shared is None:
+            from multiprocessing import shared_memory
+
+            if self.budget is not None:
+                self.budget.charge(len(self.pdf_content), "the copy shared with OCR workers")
+            self._shared = shared_memory.SharedMemory(create=True, size=max(1, len(self.pdf_content)))
+            self._shared.buf[:len(self.pdf_content)] = self.pdf_content
+        return self._shared.name
+
+    def submit(self, page_indices: List[int]) -> Dict[int, Any]:
+        """Start OCR of the given pages; returns {page index: cached text or (future, position in its batch)}"""
+        if not page_indices:
+            return {}
+        if not ocr_available():
+            if not self._warned:
+                logger.warning("Pages have no text layer but OCR is not installed (pytesseract + pypdfium2)")
+                self._warned = True
+            return {}
+
+        backend = get_state_backend()
+        document_hash = self._hash()
+        started: Dict[int, Any] = {}
+        pending = []
+        for index in page_indices:
+            cached = backend.get(f"ocr:{document_hash}:{index}")
+            if cached is not None:
+                started[index] = cached.decode()
+            else:
+                pending.append(index)
+        if pending:
+            # Two batches per worker keeps the load balanced; the document is
+            # shared, so small batches cost no extra copies
+            batch_size = max(1, math.ceil(len(pending) / (OCR_WORKERS * 2)))
+            pool = _get_pool()
+            name = self._shared_name()
+            for i in range(0, len(pending), batch_size):
+                batch = pending[i:i + batch_size]
+                future = pool.submit(_ocr_page_batch, name, len(self.pdf_content), batch, OCR_DPI, OCR_LANG)
+                self._futures.append(future)
+                for position, index in enumerate(batch):
+                    started[index] = (future, position)
+        return started
+
+    @staticmethod
+    def done(started: Dict[int, Any]) -> bool:
+        """Whether every page of a submit() result has its text"""
+        return all(not isinstance(value, tuple) or value[0].done() for value in started.values())
+
+    def collect(self, started: Dict[int, Any]) -> Dict[int, str]:
+        """Wait for the pages of a submit() result and return {page index: text}"""
+        backend = get_state_backend()
+        results: Dict[int, str] = {}
+        with span("ocr", pages=sum(isinstance(value, tuple) for value in started.values())):
+            for index, value in started.items():
+                if isinstance(value, tuple):
+                    future, position = value
+                    text = future.result()[position]
+                    backend.set(f"ocr:{self._hash()}:{index}", text.encode(), RESULT_CACHE_TTL)
+                    results[index] = text
+                else:
+                    results[index] = value
+        return results
+
+    def close(self) -> None:
+        for future in self._futures:
+            future.cancel()
+        self._futures = []
+        if self._shared is not None:
+            self._shared.close()
+            self._shared.unlink()
+            self._shared = None
+
+
+def ocr_pages(pdf_content: bytes, page_indices: List[int], document_hash: Optional[str] = None) -> Dict[int, str]:
+    """
+    OCR the given pages of a PDF, returning {page index: text}.
+    Pages are recognised in parallel in a process pool.
+    Returns an empty dict when no OCR engine is installed.
+    """
+    session = OcrSession(pdf_content, document_hash)
+    try:
+        return session.collect(session.submit(page_indices))
+    finally:
+        session.close()
@@ -1,56 +1,63 @@
 from typing import Dict, Any, Optional
 from fastapi import UploadFile, HTTPException
 import os
-from PyPDF2 import PdfReader # type: ignore
-from services.portia_config import get_portia_instance
-from anthropic import Anthropic
+from services.anthropic_client import get_anthropic_client
+from starlette.concurrency import run_in_threadpool
+from services.llm_limiter import LLMUnavailable, estimate_tokens, llm_limiter, service_unavailable
+from services.pdf_text import DocumentTooLarge, extract_text
+from services.question_bank import QUESTION_BANK_MAX_REUSE, ParsedQuestion, apply_question_edits, assemble_paper, bank_stats, get_question_bank, paper_header, paper_subject, parse_questions, parse_title
+from services.tracing import log_payload, logger, span
 
-class PaperGeneratorService:
-    def __init__(self):
-        # We'll store generated PDFs here
-        self.output_dir = "generated_papers"
-        self.upload_dir = "uploads"
-        # Ensure both directories exist
-        os.makedirs(self.output_dir, exist_ok=True)
-        os.makedirs(self.upload_dir, exist_ok=True)
-        # Initialize Anthropic client
-        self.anthropic = Anthropic()
-        # Keep Portia instance for compatibility
-        self.portia = get_portia_instance()
-        
-    async def extract_text_from_pdf(self, pdf_content: bytes) -> str:
-        """Extract text content from PDF"""
-        try:
-            # Create a temporary file to store the PDF content
-            temp_path = os.path.join(self.upload_dir, "temp.pdf")
-            with open(temp_path, "wb") as f:
-                f.write(pdf_content)
-            
-            # Read the PDF
-            reader = PdfReader(temp_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text()
-                
-            # Clean up
-            os.remove(temp_path)
-            return text
-            
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error reading PDF: {str(e)}")
+# You can change the model here. Available options include:
+# - claude-3-opus-20240229 (most powerful)
+# - claude-3-sonnet-20240229 (balanced)
+# - claude-3-haiku-20240229 (fastest)
+PAPER_MODEL = "claude-3-opus-20240229"  # Change this to use a different model
 
-    async def generate_new_paper_content(self, text: str, difficulty: str) -> str:
-        """Generate new paper content using Claude directly"""
-        try:
-            print("Calling Claude API...")
-            
-            # You can change the model here. Available options include:
-            # - claude-3-opus-20240229 (most powerful)
-            # - claude-3-sonnet-20240229 (balanced)
-            # - claude-3-haiku-20240229 (fastest)
-            model = "claude-3-opus-20240229"  # Change this to use a different model
-            
-            system_message = """You are an expert exam paper generator specializing in creating well-structured, professionally formatted exam papers. 
+# "single": PAPER_MODEL writes the whole paper. "draft_refine": a fast model
+# drafts it and PAPER_MODEL only returns replacements for weak questions.
+PAPER_MODES = ("single", "draft_refine")
+PAPER_DRAFT_MODEL = os.getenv("PAPER_DRAFT_MODEL", "claude-3-haiku-20240307")
+
+
+def _configured_mode(value: str) -> str:
+    """PAPER_GENERATION_MODE, or "single" with a warning when it is not a known mode"""
+    if value in PAPER_MODES:
+        return value
+    logger.warning("PAPER_GENERATION_MODE=%r is not one of %s; using single", value, ", ".join(PAPER_MODES))
+    return "single"
+
+
+PAPER_GENERATION_MODE = _configured_mode(os.getenv("PAPER_GENERATION_MODE", "single"))
+
+PAPER_EDIT_TOOL = {
+    "name": "record_paper_edits",
+    "description": "Record replacement text for the draft questions that need to change.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "edits": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "question": {"type": "integer", "description": "Position of the question in the draft, starting at 1"},
+                        "marks": {"type": "integer"},
+                        "body": {"type": "string", "description": "The full replacement question in markdown, without the ### heading"}
+                    },
+                    "required": ["question", "marks", "body"]
+                }
+            }
+        },
+        "required": ["edits"]
+    }
+}
+
+REFINE_SYSTEM_PROMPT = """You are a senior examiner reviewing a draft exam paper written by a junior colleague.
+Compare each draft question with the source paper and the requested difficulty. Replace only questions that are incorrect, ambiguous, off-syllabus or at the wrong difficulty; leave good questions alone.
+Record your replacements with the record_paper_edits tool, using an empty list if the draft needs no changes. Replacement questions must follow the same markdown conventions as the draft."""
+
+PAPER_SYSTEM_PROMPT = """You are an expert exam paper generator specializing in creating well-structured, professionally formatted exam papers. 
 
 CRITICAL: ONLY RETURN THE MARKDOWN FOR THE EXAM PAPER. DO NOT INCLUDE ANY OTHER TEXT, EXPLANATIONS, OR COMMENTS. YOUR ENTIRE RESPONSE SHOULD BE VALID MARKDOWN THAT CAN BE DIRECTLY PROCESSED.
 
@@ -110,43 +117,405 @@ b) Verify your answer
 
 REMEMBER: YOUR RESPONSE MUST BE PURE MARKDOWN ONLY. DO NOT ADD ANY EXPLANATIONS OR COMMENTS OUTSIDE THE MARKDOWN CONTENT."""
 
-            # Call Claude API directly - note: messages.create() is not async
-            message = self.anthropic.messages.create(
+# Loading these is part of the first render's cost, which startup warm-up pays instead
+MARKDOWN_EXTENSIONS = [
+    'markdown.extensions.tables',
+    'markdown.extensions.fenced_code',
+    'markdown.extensions.nl2br',
+    'markdown.extensions.sane_lists'
+]
+
+
+def render_pdf(markdown_text: str) -> bytes:
+    """Convert exam-paper markdown to PDF bytes using markdown and pdfkit"""
+    import markdown
+
+    # Convert markdown to HTML with extensions for better formatting
+    md = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+    with span("markdown"):
+        html_content = md.convert(markdown_text)
+    # Imported after the markdown step so a missing pdfkit still leaves markdown loaded
+    import pdfkit
+
+    # Add HTML wrapper with comprehensive styling
+    html_document = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <style>
+            @page {{
+                size: A4;
+                margin: 2.5cm 2cm;
+            }}
+
+            body {{
+                font-family: 'Arial', sans-serif;
+                line-height: 1.6;
+                color: #333;
+                max-width: 800px;
+                margin: 0 auto;
+                padding: 20px;
+            }}
+
+            /* Headers */
+            h1, h2, h3, h4, h5, h6 {{
+                font-family: 'Arial', sans-serif;
+                margin-top: 1.5em;
+                margin-bottom: 0.5em;
+                line-height: 1.2;
+                color: #2c3e50;
+            }}
+
+            h1 {{
+                font-size: 24px;
+                border-bottom: 2px solid #eee;
+                padding-bottom: 10px;
+            }}
+
+            h2 {{
+                font-size: 20px;
+                border-bottom: 1px solid #eee;
+                padding-bottom: 8px;
+            }}
+
+            /* Paragraphs and Lists */
+            p {{
+                margin: 1em 0;
+                text-align: justify;
+            }}
+
+            ul, ol {{
+                margin: 1em 0;
+                padding-left: 2em;
+            }}
+
+            li {{
+                margin: 0.5em 0;
+            }}
+
+            /* Code Blocks */
+            pre {{
+                background-color: #f5f5f5;
+                padding: 15px;
+                border-radius: 5px;
+                overflow-x: auto;
+                font-family: 'Courier New', monospace;
+                margin: 1em 0;
+            }}
+
+            code {{
+                font-family: 'Courier New', monospace;
+                background-color: #f5f5f5;
+                padding: 2px 5px;
+                border-radius: 3px;
+            }}
+
+            /* Tables */
+            table {{
+                border-collapse: collapse;
+                width: 100%;
+                margin: 1em 0;
+            }}
+
+            th, td {{
+                border: 1px solid #ddd;
+                padding: 12px;
+                text-align: left;
+            }}
+
+            th {{
+                background-color: #f5f5f5;
+                font-weight: bold;
+            }}
+
+            /* Blockquotes */
+            blockquote {{
+                margin: 1em 0;
+                padding-left: 1em;
+                border-left: 4px solid #ddd;
+                color: #666;
+            }}
+
+            /* Math and Equations */
+            .math {{
+                font-family: 'Times New Roman', serif;
+                font-style: italic;
+            }}
+
+            /* Question Formatting */
+            .question {{
+                margin: 1.5em 0;
+                padding: 15px;
+                border: 1px solid #ddd;
+                border-radius: 5px;
+            }}
+
+            .question-number {{
+                font-weight: bold;
+                color: #2c3e50;
+                margin-right: 10px;
+            }}
+
+            /* Page Breaks */
+            .page-break {{
+                page-break-after: always;
+            }}
+        </style>
+    </head>
+    <body>
+        {html_content}
+    </body>
+    </html>
+    """
+
+    # Configure pdfkit options for better rendering
+    options = {
+        'page-size': 'A4',
+        'margin-top': '25mm',
+        'margin-right': '20mm',
+        'margin-bottom': '25mm',
+        'margin-left': '20mm',
+        'encoding': 'UTF-8',
+        'no-outline': None,
+        'enable-local-file-access': None,
+        'print-media-type': None,
+        'javascript-delay': '1000',
+        'enable-smart-shrinking': None,
+        'dpi': '300'
+    }
+
+    # Convert HTML to PDF bytes with improved options
+    with span("pdf_render"):
+        pdf_bytes = pdfkit.from_string(
+            html_document,
+            False,
+            options=options,
+            css=None
+        )
+
+    return pdf_bytes
+
+
+class PaperGeneratorService:
+    def __init__(self):
+        # We'll store generated PDFs here
+        self.output_dir = "generated_papers"
+        self.upload_dir = "uploads"
+        # Ensure both directories exist
+        os.makedirs(self.output_dir, exist_ok=True)
+        os.makedirs(self.upload_dir, exist_ok=True)
+        # Clients are created lazily so importing the router stays cheap
+        self._portia = None
+
+    @property
+    def anthropic(self):
+        """Shared Anthropic client, created on first use"""
+        return get_anthropic_client()
+
+    @property
+    def portia(self):
+        """Portia instance kept for compatibility; the paper path does not use it, so it is only built on first access"""
+        if self._portia is None:
+            from services.portia_config import get_portia_instance
+            self._portia = get_portia_instance()
+        return self._portia
+        
+    async def extract_text_from_pdf(self, pdf_content: bytes) -> str:
+        """Extract text content from PDF"""
+        try:
+            # PDF parsing is CPU bound, so keep it off the event loop
+            return await run_in_threadpool(extract_text, pdf_content)
+        except DocumentTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error reading PDF: {str(e)}")
+
+    async def generate_new_paper_content(self, text: str, difficulty: str, prompt: Optional[str] = None, max_tokens: int = 4096, model: str = PAPER_MODEL) -> str:
+        """
+        Generate new paper content using Claude directly.
+        prompt replaces the default whole-paper instruction (e.g. to generate only some questions).
+        """
+        try:
+            logger.debug("Calling Claude API...")
+            system_message = PAPER_SYSTEM_PROMPT
+            if prompt is None:
+                prompt = f"Generate a {difficulty} difficulty version of this exam paper. Return ONLY the markdown content, no other text. Content to base it on:\n\n{text}"
+
+            # messages.create() is not async; acall waits for admission on the
+            # event loop and only runs the request itself in the threadpool
+            message = await llm_limiter.acall(
+                self.anthropic.messages.create,
+                input_tokens=estimate_tokens(system_message) + estimate_tokens(prompt),
+                max_output_tokens=max_tokens,
                 model=model,
-                max_tokens=4096,
+                max_tokens=max_tokens,
                 temperature=0.7,
                 system=system_message,
                 messages=[
                     {
                         "role": "user",
-                        "content": f"Generate a {difficulty} difficulty version of this exam paper. Return ONLY the markdown content, no other text. Content to base it on:\n\n{text}"
+                        "content": prompt
                     }
                 ]
             )
 
-            print("Claude API Response:")
-            print(message)  # Debug print to see full response
+            log_payload("Claude API response", message)
             
             # Access the content correctly from the message
             if hasattr(message, 'content'):
-                print("Message has content attribute")
                 if isinstance(message.content, list) and len(message.content) > 0:
-                    print("Content is a list with items")
                     return message.content[0].text
                 else:
-                    print(f"Unexpected content format: {message.content}")
+                    logger.warning("Unexpected content format from Claude: %r", message.content)
                     return str(message.content)
             else:
-                print("Message structure:", dir(message))
+                logger.warning("Unexpected message structure from Claude: %s", type(message).__name__)
                 raise HTTPException(
                     status_code=500,
                     detail="Unexpected response format from Claude"
                 )
-            
+
+        except LLMUnavailable as e:
+            logger.warning("Paper generation turned away: %s", e)
+            raise service_unavailable(e)
         except Exception as e:
-            print(f"Error in Claude API call: {str(e)}")
+            logger.warning("Error in Claude API call: %s", e)
             raise HTTPException(status_code=500, detail=f"Error generating paper content: {str(e)}")
 
+    async def draft_and_refine(self, text: str, difficulty: str, prompt: Optional[str] = None, max_tokens: int = 4096) -> str:
+        """
+        Draft the paper with the fast model (prompt as for
+        generate_new_paper_content), then have PAPER_MODEL return
+        replacements for only the questions that need them, which are
+        applied to the draft markdown. The strong model's output is a handful
+        of questions instead of a full paper. If the review fails, the
+        draft is returned as it is.
+        """
+        with span("paper_draft", model=PAPER_DRAFT_MODEL):
+            draft = await self.generate_new_paper_content(text, difficulty, prompt=prompt, max_tokens=max_tokens, model=PAPER_DRAFT_MODEL)
+        draft_questions = parse_questions(draft)
+        if not draft_questions:
+            logger.warning("Draft paper has no questions in the expected format; skipping review")
+            return draft
+
+        numbered = "\n\n".join(question.to_markdown(n) for n, question in enumerate(draft_questions, 1))
+        prompt = (
+            f"Requested difficulty relative to the source: {difficulty}\n\n"
+            f"Source paper:\n\n{text}\n\nDraft questions:\n\n{numbered}"
+        )
+        # Room for rewriting about a third of the questions
+        max_tokens = min(4096, 300 + 150 * len(draft_questions))
+        try:
+            with span("paper_refine", model=PAPER_MODEL):
+                message = await llm_limiter.acall(
+                    self.anthropic.messages.create,
+                    input_tokens=estimate_tokens(REFINE_SYSTEM_PROMPT) + estimate_tokens(prompt),
+                    max_output_tokens=max_tokens,
+                    model=PAPER_MODEL,
+                    max_tokens=max_tokens,
+                    temperature=0.2,
+                    system=REFINE_SYSTEM_PROMPT,
+                    tools=[PAPER_EDIT_TOOL],
+                    tool_choice={"type": "tool", "name": PAPER_EDIT_TOOL["name"]},
+                    messages=[{"role": "user", "content": prompt}]
+                )
+        except Exception as e:
+            logger.warning("Paper review failed, returning the unreviewed draft: %s", e)
+            return draft
+        log_payload("Claude paper edits", message)
+
+        edits = {}
+        for block in message.content:
+            if getattr(block, "type", None) != "tool_use":
+                continue
+            for edit in block.input.get("edits", []):
+                try:
+                    position, marks, body = int(edit["question"]), int(edit["marks"]), str(edit["body"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if 1 <= position <= len(draft_questions) and body.strip():
+                    edits[position] = (marks, body)
+        logger.info("Paper review replaced %d of %d draft questions", len(edits), len(draft_questions))
+        return apply_question_edits(draft, edits)
+
+    async def write_paper(self, text: str, difficulty: str, mode: str = PAPER_GENERATION_MODE, prompt: Optional[str] = None, max_tokens: int = 4096) -> str:
+        """Generate a paper (or the questions prompt asks for) with the given mode"""
+        if mode == "draft_refine":
+            return await self.draft_and_refine(text, difficulty, prompt=prompt, max_tokens=max_tokens)
+        return await self.generate_new_paper_content(text, difficulty, prompt=prompt, max_tokens=max_tokens)
+
+    async def compose_paper_content(self, text: str, difficulty: str, mode: str = PAPER_GENERATION_MODE) -> str:
+        """
+        Build the new paper from the question bank where it already has
+        matching questions of the same subject and requested difficulty, and
+        only ask Claude for the gaps. At most QUESTION_BANK_MAX_REUSE of the
+        questions are reused. Falls back to whole-paper generation when the
+        source questions cannot be parsed or the bank covers none of them.
+        """
+        bank = get_question_bank()
+        source_questions = parse_questions(text)
+        title = parse_title(text)
+        subject = paper_subject(text)
+        if source_questions:
+            await run_in_threadpool(bank.add_questions, source_questions, "original", "upload", subject)
+
+        replacements: Dict[int, Any] = {}
+        used: set = set()
+        max_reused = int(len(source_questions) * QUESTION_BANK_MAX_REUSE)
+        for index, question in enumerate(source_questions):
+            if len(replacements) >= max_reused:
+                break
+            match = await run_in_threadpool(bank.find_replacement, question, difficulty, used, subject)
+            if match is not None:
+                used.add(match["id"])
+                replacements[index] = match
+
+        if not replacements:
+            generated_content = await self.write_paper(text, difficulty, mode)
+            generated_questions = parse_questions(generated_content)
+            await run_in_threadpool(bank.add_questions, generated_questions, difficulty, "generated", subject)
+            bank_stats["questions_generated"] += len(generated_questions)
+            return generated_content
+
+        gaps = [i for i in range(len(source_questions)) if i not in replacements]
+        generated: Dict[int, Any] = {}
+        # The original's title and instructions unless the generated paper has its own
+        header = paper_header(text)
+        if gaps:
+            gap_markdown = "\n\n".join(source_questions[i].to_markdown(n) for n, i in enumerate(gaps, 1))
+            prompt = (
+                f"Generate a {difficulty} difficulty version of each of these exam questions. "
+                f"Return ONLY the paper's # title and ## General Instructions for the {difficulty} version, "
+                f"then one '### Question N (Y marks)' block per question, numbered 1 to {len(gaps)} "
+                f"in the same order, with no other text:\n\n{gap_markdown}"
+            )
+            # Output scales with the number of questions still to write
+            max_tokens = min(4096, 200 + 400 * len(gaps))
+            gap_content = await self.write_paper(text, difficulty, mode, prompt=prompt, max_tokens=max_tokens)
+            gap_questions = parse_questions(gap_content)
+            for n, question in enumerate(gap_questions[:len(gaps)]):
+                question.topic = source_questions[gaps[n]].topic
+                generated[gaps[n]] = question
+            header = paper_header(gap_content) or header
+            await run_in_threadpool(bank.add_questions, gap_questions, difficulty, "generated", subject)
+            bank_stats["questions_generated"] += len(gap_questions)
+        else:
+            bank_stats["papers_from_bank"] += 1
+
+        bank_stats["questions_reused"] += len(replacements)
+        questions = []
+        for index, source in enumerate(source_questions):
+            if index in replacements:
+                match = replacements[index]
+                questions.append(ParsedQuestion(source.number, match["marks"], match["body"], source.topic))
+            elif index in generated:
+                questions.append(generated[index])
+            else:
+                # Claude returned fewer questions than asked; keep the original rather than drop it
+                questions.append(source)
+        return assemble_paper(title, difficulty, questions, header)
+
     async def make_pdf(self, content: Dict[str, Any]) -> bytes:
         """
         Convert markdown content to PDF using markdown and pdfkit
@@ -156,179 +525,9 @@ REMEMBER: YOUR RESPONSE MUST BE PURE MARKDOWN ONLY. DO NOT ADD ANY EXPLANATIONS
             bytes: The generated PDF as bytes
         """
         try:
-            import markdown
-            import pdfkit
-            from io import BytesIO
-
-            # Convert markdown to HTML with extensions for better formatting
-            md = markdown.Markdown(extensions=[
-                'markdown.extensions.tables',
-                'markdown.extensions.fenced_code',
-                'markdown.extensions.nl2br',
-                'markdown.extensions.sane_lists'
-            ])
-            html_content = md.convert(content["generated_content"])
-            
-            # Add HTML wrapper with comprehensive styling
-            html_document = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="UTF-8">
-                <style>
-                    @page {{
-                        size: A4;
-                        margin: 2.5cm 2cm;
-                    }}
-                    
-                    body {{
-                        font-family: 'Arial', sans-serif;
-                        line-height: 1.6;
-                        color: #333;
-                        max-width: 800px;
-                        margin: 0 auto;
-                        padding: 20px;
-                    }}
-                    
-                    /* Headers */
-                    h1, h2, h3, h4, h5, h6 {{
-                        font-family: 'Arial', sans-serif;
-                        margin-top: 1.5em;
-                        margin-bottom: 0.5em;
-                        line-height: 1.2;
-                        color: #2c3e50;
-                    }}
-                    
-                    h1 {{
-                        font-size: 24px;
-                        border-bottom: 2px solid #eee;
-                        padding-bottom: 10px;
-                    }}
-                    
-                    h2 {{
-                        font-size: 20px;
-                        border-bottom: 1px solid #eee;
-                        padding-bottom: 8px;
-                    }}
-                    
-                    /* Paragraphs and Lists */
-                    p {{
-                        margin: 1em 0;
-                        text-align: justify;
-                    }}
-                    
-                    ul, ol {{
-                        margin: 1em 0;
-                        padding-left: 2em;
-                    }}
-                    
-                    li {{
-                        margin: 0.5em 0;
-                    }}
-                    
-                    /* Code Blocks */
-                    pre {{
-                        background-color: #f5f5f5;
-                        padding: 15px;
-                        border-radius: 5px;
-                        overflow-x: auto;
-                        font-family: 'Courier New', monospace;
-                        margin: 1em 0;
-                    }}
-                    
-                    code {{
-                        font-family: 'Courier New', monospace;
-                        background-color: #f5f5f5;
-                        padding: 2px 5px;
-                        border-radius: 3px;
-                    }}
-                    
-                    /* Tables */
-                    table {{
-                        border-collapse: collapse;
-                        width: 100%;
-                        margin: 1em 0;
-                    }}
-                    
-                    th, td {{
-                        border: 1px solid #ddd;
-                        padding: 12px;
-                        text-align: left;
-                    }}
-                    
-                    th {{
-                        background-color: #f5f5f5;
-                        font-weight: bold;
-                    }}
-                    
-                    /* Blockquotes */
-                    blockquote {{
-                        margin: 1em 0;
-                        padding-left: 1em;
-                        border-left: 4px solid #ddd;
-                        color: #666;
-                    }}
-                    
-                    /* Math and Equations */
-                    .math {{
-                        font-family: 'Times New Roman', serif;
-                        font-style: italic;
-                    }}
-                    
-                    /* Question Formatting */
-                    .question {{
-                        margin: 1.5em 0;
-                        padding: 15px;
-                        border: 1px solid #ddd;
-                        border-radius: 5px;
-                    }}
-                    
-                    .question-number {{
-                        font-weight: bold;
-                        color: #2c3e50;
-                        margin-right: 10px;
-                    }}
-                    
-                    /* Page Breaks */
-                    .page-break {{
-                        page-break-after: always;
-                    }}
-                </style>
-            </head>
-            <body>
-                {html_content}
-            </body>
-            </html>
-            """
-            
-            # Configure pdfkit options for better rendering
-            options = {
-                'page-size': 'A4',
-                'margin-top': '25mm',
-                'margin-right': '20mm',
-                'margin-bottom': '25mm',
-                'margin-left': '20mm',
-                'encoding': 'UTF-8',
-                'no-outline': None,
-                'enable-local-file-access': None,
-                'print-media-type': None,
-                'javascript-delay': '1000',
-                'enable-smart-shrinking': None,
-                'dpi': '300'
-            }
-            
-            # Convert HTML to PDF bytes with improved options
-            pdf_bytes = pdfkit.from_string(
-                html_document,
-                False,
-                options=options,
-                css=None
-            )
-            
-            return pdf_bytes
-            
+            return render_pdf(content["generated_content"])
         except Exception as e:
-            print(f"Error creating PDF: {str(e)}")
+            logger.warning("Error creating PDF: %s", e)
             raise HTTPException(status_code=500, detail=f"Error creating PDF: {str(e)}")
 
     def get_paper_path(self, paper_id: str) -> Optional[str]:
@@ -343,22 +542,21 @@ REMEMBER: YOUR RESPONSE MUST BE PURE MARKDOWN ONLY. DO NOT ADD ANY EXPLANATIONS
         2. Sends to Claude
         3. Returns PDF bytes directly
         """
+        # Read the uploaded PDF
+        return await self.generate_from_content(await pdf_file.read(), difficulty)
+
+    async def generate_from_content(self, pdf_content: bytes, difficulty: str, mode: str = PAPER_GENERATION_MODE) -> bytes:
+        """Generate a new paper PDF from uploaded PDF bytes that have already been read"""
         try:
-            # Read the uploaded PDF
-            pdf_content = await pdf_file.read()
-            
             # Extract text from PDF
-            extracted_text = await self.extract_text_from_pdf(pdf_content)
-            print("Extracted text from PDF:")
-            print("-" * 50)
-            print(extracted_text)
-            print("-" * 50)
-
-            # Generate new paper content using Claude
-            generated_content = await self.generate_new_paper_content(extracted_text, difficulty)
+            with span("extraction"):
+                extracted_text = await self.extract_text_from_pdf(pdf_content)
+            log_payload("Extracted text from PDF", extracted_text)
+
+            # Generate new paper content, reusing banked questions where possible
+            generated_content = await self.compose_paper_content(extracted_text, difficulty, mode)
             
-            print("Generated paper content:")
-            print(generated_content)
+            log_payload("Generated paper content", generated_content)
             
             # Create the PDF and return bytes directly
             content_dict = {"generated_content": generated_content}
@@ -366,5 +564,7 @@ REMEMBER: YOUR RESPONSE MUST BE PURE MARKDOWN ONLY. DO NOT ADD ANY EXPLANATIONS
             
             return pdf_bytes
             
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -0,0 +1,132 @@
+import io
+import os
+import re
+import sys
+import uuid
+from collections import deque
+from typing import Iterable, Iterator, Optional
+
+from services.ocr import OcrSession
+
+# Uploads at least this large (bytes) are read in large-document mode, page by page
+LARGE_DOCUMENT_BYTES = int(os.getenv("LARGE_DOCUMENT_BYTES", str(2 * 1024 * 1024)))
+# Most memory one request may use for an upload plus the text buffered from it (MB)
+DOCUMENT_MEMORY_BUDGET_MB = float(os.getenv("DOCUMENT_MEMORY_BUDGET_MB", "64"))
+# Pages parsed (and OCRed) together; parsed objects are dropped after each window
+PDF_PAGE_WINDOW = int(os.getenv("PDF_PAGE_WINDOW", "16"))
+# Pages parsed ahead of the one being yielded while earlier pages are still being OCRed
+OCR_LOOKAHEAD_PAGES = int(os.getenv("OCR_LOOKAHEAD_PAGES", "128"))
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def unique_temp_path(directory: str, suffix: str = ".pdf") -> str:
+    """Temp file path that cannot collide between requests, workers or hosts sharing a volume"""
+    return os.path.join(directory, f"{os.getpid()}_{uuid.uuid4().hex}{suffix}")
+
+
+def is_large_document(pdf_content: bytes) -> bool:
+    return len(pdf_content) >= LARGE_DOCUMENT_BYTES
+
+
+class DocumentTooLarge(ValueError):
+    """Raised when a document needs more memory than the request's budget; becomes a 413"""
+
+
+class MemoryBudget:
+    """Per-request account of upload, OCR and text bytes held while reading a document."""
+    def __init__(self, limit_mb: float = DOCUMENT_MEMORY_BUDGET_MB):
+        self.limit = int(limit_mb * 1024 * 1024)
+        self.used = 0
+
+    def charge(self, nbytes: int, what: str) -> None:
+        self.used += nbytes
+        if self.used > self.limit:
+            raise DocumentTooLarge(f"Document too large: {what} needs more than the {self.limit // (1024 * 1024)} MB per-request budget")
+
+
+def iter_page_texts(pdf_content: bytes, window: int = PDF_PAGE_WINDOW, budget: Optional[MemoryBudget] = None, document_hash: Optional[str] = None) -> Iterator[str]:
+    """
+    Yield the text of each page in order. Pages are parsed window at a time
+    straight from the upload bytes and the reader's cache of parsed objects
+    is emptied after each window. Pages without a text layer (scanned pages)
+    are queued for OCR as their window is parsed, and parsing carries on up
+    to OCR_LOOKAHEAD_PAGES ahead while the OCR workers catch up, so the
+    document is OCRed as one pipeline rather than a window at a time. Pass
+    the upload's hash if the caller has it. Closing the generator releases
+    the reader and the OCR workers' copy of the upload.
+    """
+    # Imported here to keep application startup fast
+    from PyPDF2 import PdfReader # type: ignore
+
+    reader = PdfReader(io.BytesIO(pdf_content))
+    total = len(reader.pages)
+    ocr = OcrSession(pdf_content, document_hash, budget)
+    # (first page, texts, OCR started for the window's pages without text)
+    parsed: deque = deque()
+    parsed_pages = 0
+    try:
+        first = 0
+        while first < total or parsed:
+            if first < total:
+                indices = list(range(first, min(first + window, total)))
+                texts = [reader.pages[i].extract_text() or "" for i in indices]
+                missing = [i for i, text in zip(indices, texts) if not text.strip()]
+                parsed.append((first, texts, ocr.submit(missing)))
+                parsed_pages += len(texts)
+                # Objects are re-read from the upload if a later page refers to them
+                reader.resolved_objects.clear()
+                first += window
+            # Yield windows whose OCR has finished; wait for the oldest once the lookahead is used up
+            while parsed and (first >= total or parsed_pages > OCR_LOOKAHEAD_PAGES or OcrSession.done(parsed[0][2])):
+                start, texts, started = parsed.popleft()
+                parsed_pages -= len(texts)
+                for index, text in ocr.collect(started).items():
+                    texts[index - start] = text
+                yield from texts
+    finally:
+        ocr.close()
+
+
+def normalise_pages(pages: Iterable[str]) -> Iterator[str]:
+    """
+    Collapse whitespace across a stream of page texts. The pieces joined
+    together equal re.sub(r"\\s+", " ", "".join(pages)).strip(), so words
+    split across a page boundary stay joined, as when the pages are concatenated.
+    """
+    pending_space = False
+    started = False
+    for page in pages:
+        text = WHITESPACE.sub(" ", page)
+        if text.startswith(" "):
+            pending_space = True
+            text = text[1:]
+        if not text:
+            continue
+        if pending_space and started:
+            yield " "
+        pending_space = text.endswith(" ")
+        if pending_space:
+            text = text[:-1]
+        if text:
+            yield text
+            started = True
+
+
+def extract_text(pdf_content: bytes, budget: Optional[MemoryBudget] = None) -> str:
+    """
+    Extract text content from PDF bytes. Pages without a text layer (scanned
+    pages) are sent through OCR; pages with text are never rasterised.
+    The upload and the text count against the request's memory budget.
+    """
+    budget = budget or MemoryBudget()
+    budget.charge(len(pdf_content), "the upload")
+    page_texts = []
+    for text in iter_page_texts(pdf_content, budget=budget):
+        budget.charge(sys.getsizeof(text), "the extracted text")
+        page_texts.append(text)
+    text = "".join(page_texts)
+    budget.charge(sys.getsizeof(text), "the extracted text")
+    if page_texts and not text.strip():
+        raise ValueError("The PDF has no text layer and OCR could not recover any text")
+    return text
@@ -1,8 +1,10 @@
 import os
-from portia import Config, LLMProvider, LLMModel, Portia
 
 def get_portia_instance():
     """Initialize and return a configured Portia instance"""
+    # Portia is heavy to import, so only load it when an instance is needed
+    from portia import Config, LLMProvider, LLMModel, Portia
+
     config = Config.from_default(
         llm_provider=LLMProvider.ANTHROPIC,
         llm_model_name=LLMModel.CLAUDE_3_5_SONNET,
@@ -0,0 +1,258 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Questions parsed from uploaded and generated papers, searchable with SQLite FTS5
+QUESTION_BANK_PATH = os.getenv("QUESTION_BANK_PATH", "state/question_bank.db")
+# Minimum share of a source question's words a stored question must contain to replace it
+QUESTION_BANK_MIN_OVERLAP = float(os.getenv("QUESTION_BANK_MIN_OVERLAP", "0.5"))
+# Most of a paper's questions that may come from the bank; the rest are always
+# generated, so a repeat request gets a new paper rather than a copy
+QUESTION_BANK_MAX_REUSE = float(os.getenv("QUESTION_BANK_MAX_REUSE", "0.5"))
+
+# "### Question 3 (10 marks)" as mandated by the paper prompt; the heading
+# marks are optional so questions in extracted PDF text are found too
+QUESTION_PATTERN = re.compile(
+    r"^[ \t]*(?:#{1,6}[ \t]*)?Question[ \t]+(\d+)[ \t]*[\(\[][ \t]*(\d+)[ \t]*marks?[ \t]*[\)\]][^\n]*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+SECTION_PATTERN = re.compile(r"^##[ \t]+(?!#)(.+)$", re.MULTILINE)
+TITLE_PATTERN = re.compile(r"^#[ \t]+(?!#)(.+)$", re.MULTILINE)
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Counters reported under /stats
+bank_stats = {"questions_reused": 0, "questions_generated": 0, "papers_from_bank": 0}
+
+
+class ParsedQuestion:
+    """One exam question with its marks and the section it appeared under."""
+    def __init__(self, number: int, marks: int, body: str, topic: Optional[str] = None):
+        self.number = number
+        self.marks = marks
+        self.body = body
+        self.topic = topic
+
+    def to_markdown(self, number: Optional[int] = None) -> str:
+        return f"### Question {number or self.number} ({self.marks} marks)\n{self.body}"
+
+
+def parse_title(text: str) -> Optional[str]:
+    """Return the paper's # title, if it has one"""
+    match = TITLE_PATTERN.search(text)
+    return match.group(1).strip() if match else None
+
+
+def paper_subject(text: str) -> Optional[str]:
+    """What a paper's questions are banked under: its # title, or the first line of extracted text"""
+    title = parse_title(text)
+    if title:
+        return title
+    line = next((line.strip() for line in text.splitlines() if line.strip()), None)
+    return line[:200] if line else None
+
+
+def paper_header(text: str) -> Optional[str]:
+    """The title and instructions before a paper's first question, if it has any"""
+    header = QUESTION_PATTERN.search(text)
+    end = header.start() if header else 0
+    sections = list(SECTION_PATTERN.finditer(text, 0, end))
+    # assemble_paper writes the first question's section heading itself
+    if sections and sections[-1].group(1).strip() != "General Instructions":
+        end = sections[-1].start()
+    preamble = text[:end].strip()
+    return preamble or None
+
+
+def _question_spans(text: str) -> Iterator[Tuple[re.Match, int, Optional[str]]]:
+    """(header match, end of body, section topic) for each non-empty question in a paper"""
+    headers = list(QUESTION_PATTERN.finditer(text))
+    sections = [(m.start(), m.group(1).strip()) for m in SECTION_PATTERN.finditer(text)]
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        # A new ## section ends the previous question
+        next_section = next((start for start, _ in sections if header.end() < start < end), None)
+        end = next_section or end
+        topic = None
+        for start, name in sections:
+            if start < header.start():
+                topic = name
+        if text[header.end():end].strip():
+            yield header, end, topic
+
+
+def parse_questions(text: str) -> List[ParsedQuestion]:
+    """Split a paper (markdown or extracted text) into its numbered questions"""
+    return [
+        ParsedQuestion(int(header.group(1)), int(header.group(2)), text[header.end():end].strip(), topic)
+        for header, end, topic in _question_spans(text)
+    ]
+
+
+def apply_question_edits(text: str, edits: Dict[int, Tuple[int, str]]) -> str:
+    """
+    Replace questions in a paper, keyed by their 1-based position in
+    parse_questions order, with (marks, body); everything else is kept as is.
+    """
+    parts = []
+    cursor = 0
+    for position, (header, end, _) in enumerate(_question_spans(text), 1):
+        if position in edits:
+            marks, body = edits[position]
+            parts.append(text[cursor:header.start()])
+            parts.append(f"### Question {header.group(1)} ({marks} marks)\n{body.strip()}\n\n")
+            cursor = end
+    parts.append(text[cursor:])
+    return "".join(parts)
+
+
+def _words(text: str) -> set:
+    return set(WORD_PATTERN.findall(text.lower()))
+
+
+def _fts_query(text: str, max_terms: int = 32) -> str:
+    """Turn free text into an FTS5 OR query of quoted terms"""
+    terms = sorted(_words(text), key=len, reverse=True)[:max_terms]
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+class QuestionBank:
+    """Structured question store backed by SQLite with an FTS5 full-text index."""
+
+    def __init__(self, path: str = QUESTION_BANK_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY,
+                subject TEXT,
+                topic TEXT,
+                marks INTEGER NOT NULL,
+                difficulty TEXT NOT NULL,
+                body TEXT NOT NULL,
+                source TEXT NOT NULL,
+                content_hash TEXT NOT NULL UNIQUE
+            );
+            CREATE INDEX IF NOT EXISTS questions_difficulty ON questions (difficulty);
+            CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+                body, topic, subject, content='questions', content_rowid='id'
+            );
+        """)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self.local.conn = conn
+        return conn
+
+    def add_questions(self, questions: List[ParsedQuestion], difficulty: str, source: str, subject: Optional[str] = None) -> int:
+        """Store questions (skipping exact duplicates) and index them; returns the number added"""
+        conn = self._conn()
+        added = 0
+        with conn:
+            for question in questions:
+                content_hash = hashlib.sha256(f"{difficulty}\0{question.body}".encode()).hexdigest()
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO questions (subject, topic, marks, difficulty, body, source, content_hash) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (subject, question.topic, question.marks, difficulty, question.body, source, content_hash),
+                )
+                if cursor.rowcount:
+                    conn.execute(
+                        "INSERT INTO questions_fts (rowid, body, topic, subject) VALUES (?, ?, ?, ?)",
+                        (cursor.lastrowid, question.body, question.topic or "", subject or ""),
+                    )
+                    added += 1
+        return added
+
+    def search(self, query: str, difficulty: Optional[str] = None, marks: Optional[int] = None, subject: Optional[str] = None, limit: int = 5) -> List[Dict]:
+        """Full-text search for stored questions, best BM25 match first"""
+        fts_query = _fts_query(query)
+        if not fts_query:
+            return []
+        sql = (
+            "SELECT q.id, q.subject, q.topic, q.marks, q.difficulty, q.body, q.source "
+            "FROM questions_fts JOIN questions q ON q.id = questions_fts.rowid "
+            "WHERE questions_fts MATCH ?"
+        )
+        params: list = [fts_query]
+        if difficulty is not None:
+            sql += " AND q.difficulty = ?"
+            params.append(difficulty)
+        if marks is not None:
+            sql += " AND q.marks = ?"
+            params.append(marks)
+        if subject is not None:
+            sql += " AND q.subject = ?"
+            params.append(subject)
+        sql += " ORDER BY bm25(questions_fts) LIMIT ?"
+        params.append(limit)
+        columns = ("id", "subject", "topic", "marks", "difficulty", "body", "source")
+        return [dict(zip(columns, row)) for row in self._conn().execute(sql, params).fetchall()]
+
+    def find_replacement(self, question: ParsedQuestion, difficulty: str, exclude: set, subject: Optional[str]) -> Optional[Dict]:
+        """
+        Find a stored question of the requested difficulty covering the same
+        material as the given question, or None if the bank has a gap. Only
+        questions banked under the same subject are considered, and none
+        when the paper has no subject.
+        """
+        source_words = _words(question.body)
+        if not source_words or not subject:
+            return None
+        for candidate in self.search(question.body, difficulty=difficulty, marks=question.marks, subject=subject):
+            if candidate["id"] in exclude or candidate["body"] == question.body:
+                continue
+            overlap = len(source_words & _words(candidate["body"])) / len(source_words)
+            if overlap >= QUESTION_BANK_MIN_OVERLAP:
+                return candidate
+        return None
+
+
+def assemble_paper(title: Optional[str], difficulty: str, questions: List[ParsedQuestion], header: Optional[str] = None) -> str:
+    """
+    Build paper markdown in the structure the paper prompt mandates. header
+    (a paper's title and instructions, see paper_header) is kept as it is;
+    without one a plain title and instructions are written.
+    """
+    if header:
+        parts = [header, ""]
+    else:
+        total = sum(question.marks for question in questions)
+        parts = [
+            f"# {title or 'Practice Examination Paper'}",
+            "",
+            "## General Instructions",
+            f"- Difficulty: {difficulty}",
+            "- Answer ALL questions",
+            f"- Total marks: {total}",
+            "",
+        ]
+    topic = None
+    for number, question in enumerate(questions, 1):
+        if question.topic and question.topic != topic and question.topic != "General Instructions":
+            topic = question.topic
+            parts += [f"## {topic}", ""]
+        parts += [question.to_markdown(number), ""]
+    return "\n".join(parts)
+
+
+_bank: Optional[QuestionBank] = None
+_bank_lock = threading.Lock()
+
+
+def get_question_bank() -> QuestionBank:
+    """Return the shared question bank, created on first use"""
+    global _bank
+    if _bank is None:
+        with _bank_lock:
+            if _bank is None:
+                _bank = QuestionBank()
+    return _bank
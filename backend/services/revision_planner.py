@@ -0,0 +1,151 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+# Score multiplier for repeating the previous session's subject on the same
+# day, so subjects are interleaved unless one is running out of time
+INTERLEAVE_PENALTY = 0.75
+
+
+class StudyGoal:
+    """Hours of revision wanted for a subject before its exam."""
+    def __init__(self, name: str, target_hours: float, exam_date: str, priority: float = 1.0):
+        if target_hours < 0 or priority <= 0:
+            raise ValueError(f"{name}: target_hours must be >= 0 and priority > 0")
+        self.name = name
+        self.target_minutes = round(target_hours * 60)
+        self.exam_date = exam_date
+        # A bare date means revision has to finish before that day starts
+        self.deadline = parse_time(exam_date)
+        self.priority = priority
+        self.remaining = self.target_minutes
+
+
+def parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.strip().replace("Z", "+00:00")).replace(tzinfo=None)
+
+
+def split_sessions(
+    free_slots: List[Dict],
+    session_minutes: int = 60,
+    min_session_minutes: int = 30,
+    break_minutes: int = 10,
+) -> List[tuple]:
+    """Cut free slots into candidate (start, end) study sessions with breaks between them"""
+    session, minimum, gap = (timedelta(minutes=m) for m in (session_minutes, min_session_minutes, break_minutes))
+    intervals = sorted((parse_time(slot["start"]), parse_time(slot["end"])) for slot in free_slots)
+    candidates = []
+    for start, end in intervals:
+        # Overlapping or touching slots (from separate queries) are treated as one
+        if candidates and start < candidates[-1][1] + gap:
+            start = candidates[-1][1] + gap
+        while end - start >= minimum:
+            length = min(session, end - start)
+            candidates.append((start, start + length))
+            start += length + gap
+    return candidates
+
+
+def plan_revision(
+    goals: List[StudyGoal],
+    free_slots: List[Dict],
+    session_minutes: int = 60,
+    min_session_minutes: int = 30,
+    break_minutes: int = 10,
+    max_daily_hours: Optional[float] = None,
+) -> Dict:
+    """
+    Pack revision sessions for several subjects into free calendar slots.
+    Sessions are filled in time order; each goes to the subject with the least
+    slack (remaining minutes over free minutes left before its exam, scaled by
+    priority), unless that would leave too little time to finish every subject
+    in exam order, in which case the next best subject is taken. Since
+    earliest-deadline-first is optimal for this kind of problem, every target
+    is met whenever the free time allows.
+    Runs in O(sessions * subjects^2 * log sessions).
+    """
+    if min_session_minutes <= 0 or session_minutes < min_session_minutes:
+        raise ValueError("session_minutes must be at least min_session_minutes, which must be positive")
+    candidates = split_sessions(free_slots, session_minutes, min_session_minutes, break_minutes)
+    if max_daily_hours is not None:
+        # Trim candidates to the daily cap up front so capacity below is exact
+        capped, used_per_day = [], {}
+        for start, end in candidates:
+            day = start.date()
+            minutes = min((end - start).total_seconds() / 60, max_daily_hours * 60 - used_per_day.get(day, 0))
+            if minutes >= min_session_minutes:
+                capped.append((start, start + timedelta(minutes=minutes)))
+                used_per_day[day] = used_per_day.get(day, 0) + minutes
+        candidates = capped
+    ends = [end for _, end in candidates]
+    # capacity[i] is the free minutes in candidates before index i
+    capacity = [0.0]
+    for start, end in candidates:
+        capacity.append(capacity[-1] + (end - start).total_seconds() / 60)
+    by_deadline = sorted(goals, key=lambda goal: goal.deadline)
+
+    def capacity_between(index: int, deadline: datetime) -> float:
+        return capacity[bisect_right(ends, deadline)] - capacity[index]
+
+    def still_feasible(chosen: StudyGoal, minutes: float, next_index: int) -> bool:
+        """Whether remaining targets fit in the later sessions, taken in exam order"""
+        demand = 0.0
+        for goal in by_deadline:
+            remaining = goal.remaining - (minutes if goal is chosen else 0)
+            if remaining > 0:
+                demand += remaining
+                if demand > capacity_between(next_index, goal.deadline):
+                    return False
+        return True
+
+    sessions = []
+    last_subject = None
+    last_day = None
+    for index, (start, end) in enumerate(candidates):
+        day = start.date().isoformat()
+        length = (end - start).total_seconds() / 60
+        scored = []
+        for goal in goals:
+            if goal.remaining <= 0 or end > goal.deadline:
+                continue
+            score = goal.remaining / capacity_between(index, goal.deadline) * goal.priority
+            if goal.name == last_subject and day == last_day and score < 1:
+                score *= INTERLEAVE_PENALTY
+            scored.append((score, goal))
+        if not scored:
+            continue
+        scored.sort(key=lambda item: -item[0])
+        # If no choice keeps every target reachable, some will be missed anyway
+        best = scored[0][1]
+        for _, goal in scored:
+            if still_feasible(goal, min(length, max(goal.remaining, min_session_minutes)), index + 1):
+                best = goal
+                break
+        minutes = min(length, max(best.remaining, min_session_minutes))
+        session_end = start + timedelta(minutes=minutes)
+        best.remaining -= minutes
+        last_subject, last_day = best.name, day
+        sessions.append({
+            "subject": best.name,
+            "start": start.isoformat(timespec="seconds"),
+            "end": session_end.isoformat(timespec="seconds"),
+            "summary": f"Revision: {best.name}",
+            "description": f"Revision session for {best.name} (exam {best.exam_date})",
+        })
+
+    summary = [
+        {
+            "subject": goal.name,
+            "exam_date": goal.exam_date,
+            "target_hours": round(goal.target_minutes / 60, 2),
+            "scheduled_hours": round((goal.target_minutes - max(goal.remaining, 0)) / 60, 2),
+            "shortfall_hours": round(max(goal.remaining, 0) / 60, 2),
+        }
+        for goal in goals
+    ]
+    return {
+        "sessions": sessions,
+        "summary": summary,
+        "feasible": all(goal.remaining <= 0 for goal in goals),
+        "free_hours": round(capacity[-1] / 60, 2),
+    }
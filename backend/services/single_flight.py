@@ -0,0 +1,60 @@
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict
+
+
+def request_key(content: bytes, **params: Any) -> str:
+    """Build a coalescing key from the uploaded file content and request parameters"""
+    digest = hashlib.sha256(content)
+    for name in sorted(params):
+        digest.update(f"\0{name}={params[name]!r}".encode())
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """Share one in-flight call between concurrent callers using the same key."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run fn once for all concurrent callers with the same key.
+        Callers arriving while the call is in flight await the same result
+        (or exception) instead of starting their own.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # The shared call runs in its own task, so it carries on for the
+            # other callers when the caller that started it goes away
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            self.executed += 1
+            task.add_done_callback(lambda done: self._finished(key, done))
+        # shield so a cancelled caller, the first one included, does not cancel the shared call
+        return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark retrieved so a call whose callers all went away does not log a warning
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        """Return counters for this single-flight group"""
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
+
+
+# Shared groups for the expensive generation endpoints
+flashcard_flight = SingleFlight("flashcards")
+paper_flight = SingleFlight("papers")
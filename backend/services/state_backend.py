@@ -0,0 +1,156 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+# Shared state for caches, jobs and generated papers. Every worker process
+# opens the same backend, so results are visible whichever worker serves a request.
+DEFAULT_STATE_BACKEND_URL = "sqlite:///state/state.db"
+# How long generated flashcards and papers are reused for identical uploads (seconds)
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+# How long generated papers stay retrievable by id (seconds)
+PAPER_TTL = float(os.getenv("PAPER_TTL", str(7 * 24 * 3600)))
+# How often SQLite deletes expired entries nobody has read, checked on write (seconds)
+STATE_SWEEP_INTERVAL = float(os.getenv("STATE_SWEEP_INTERVAL", "60"))
+
+
+class StateBackend(ABC):
+    """Minimal key/value interface with optional expiry, shared between workers."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    def get_json(self, key: str) -> Any:
+        value = self.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.set(key, json.dumps(value).encode(), ttl)
+
+
+class SQLiteBackend(StateBackend):
+    """
+    State stored in a local SQLite file, safe for several processes on one
+    host. Expired entries are deleted when read, and every sweep_interval
+    seconds a write also deletes the ones nobody has read since.
+    """
+
+    def __init__(self, path: str, sweep_interval: float = STATE_SWEEP_INTERVAL):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self.last_sweep = time.monotonic()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.local = threading.local()
+        conn = self._conn()
+        # WAL lets readers in other workers proceed while one worker writes
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self.local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._conn().execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(key)
+            return None
+        return bytes(value)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, sqlite3.Binary(value), expires_at),
+        )
+        if time.monotonic() - self.last_sweep >= self.sweep_interval:
+            self.last_sweep = time.monotonic()
+            self.sweep(conn)
+        conn.commit()
+
+    def sweep(self, conn: Optional[sqlite3.Connection] = None) -> int:
+        """Delete every expired entry; returns how many were deleted"""
+        own = conn is None
+        conn = conn or self._conn()
+        deleted = conn.execute("DELETE FROM kv WHERE expires_at < ?", (time.time(),)).rowcount
+        if own:
+            conn.commit()
+        return deleted
+
+    def delete(self, key: str) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+        conn.commit()
+
+
+class RedisBackend(StateBackend):
+    """
+    State stored in Redis for multi-node deployments. Only GET, SET EX and DEL
+    are used, so any Redis-compatible server can stand in for it.
+    """
+
+    def __init__(self, url: str):
+        try:
+            import redis  # type: ignore
+        except ImportError:
+            raise RuntimeError("The redis package is required for a redis:// STATE_BACKEND_URL")
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        self.client.set(key, value, ex=int(ttl) if ttl else None)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(key)
+
+
+def create_state_backend(url: str) -> StateBackend:
+    """Create a backend from a URL such as sqlite:///state/state.db or redis://localhost:6379/0"""
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative/path and sqlite:////absolute/path
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if parsed.scheme in ("redis", "rediss"):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported STATE_BACKEND_URL: {url}")
+
+
+_backend: Optional[StateBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_state_backend() -> StateBackend:
+    """Return this process's backend, created from STATE_BACKEND_URL on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_state_backend(os.getenv("STATE_BACKEND_URL", DEFAULT_STATE_BACKEND_URL))
+    return _backend
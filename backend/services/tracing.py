@@ -0,0 +1,189 @@
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Iterator, List, Optional
+
+# OpenTelemetry is optional (requirements-otel.txt): spans are exported through
+# it when installed and configured, otherwise only the Prometheus histograms
+# below are recorded
+try:
+    from opentelemetry import trace as otel_trace  # type: ignore
+    _tracer = otel_trace.get_tracer("studentools")
+except ImportError:
+    otel_trace = None
+    _tracer = None
+
+logger = logging.getLogger("studentools")
+
+# Fraction of requests whose full payloads (extracted text, raw responses) are logged
+DEBUG_PAYLOAD_SAMPLE_RATE = float(os.getenv("DEBUG_PAYLOAD_SAMPLE_RATE", "0"))
+DEBUG_PAYLOAD_MAX_CHARS = int(os.getenv("DEBUG_PAYLOAD_MAX_CHARS", "2000"))
+
+# Bucket upper bounds in seconds, from fast text preprocessing up to long LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """Thread-safe Prometheus-style histogram with a single label."""
+
+    def __init__(self, name: str, description: str, label: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # label value -> (bucket counts, sum, count)
+        self.series: Dict[str, List[Any]] = {}
+
+    def observe(self, label_value: str, value: float) -> None:
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        """Render the histogram in the Prometheus text exposition format"""
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            for label_value, (counts, total, count) in sorted(self.series.items()):
+                label = f'{self.label}="{label_value}"'
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{label}}} {total}")
+                lines.append(f"{self.name}_count{{{label}}} {count}")
+        return lines
+
+
+stage_duration = Histogram(
+    "studentools_stage_duration_seconds",
+    "Time spent in each pipeline stage",
+    "stage",
+)
+
+
+def observe(stage: str, seconds: float) -> None:
+    """Record a duration measured outside of a span (e.g. LLM queue wait)"""
+    stage_duration.observe(stage, seconds)
+
+
+@contextmanager
+def span(stage: str, **attributes: Any) -> Iterator[None]:
+    """
+    Time a pipeline stage. The duration goes into the stage histogram and,
+    when OpenTelemetry is available, a span with the given attributes is exported.
+    """
+    otel_span = _tracer.start_as_current_span(stage, attributes=attributes) if _tracer else None
+    if otel_span is not None:
+        otel_span.__enter__()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_duration.observe(stage, time.perf_counter() - started)
+        if otel_span is not None:
+            otel_span.__exit__(None, None, None)
+
+
+class RequestSpanMiddleware:
+    """
+    Opens a server span for each HTTP request, so the stage spans recorded
+    while handling it (in the request task, the threadpool or a shared
+    single-flight call) are its children and a request shows up as one trace.
+    The span is named after the matched route rather than the raw path.
+    When a server span is already open (FastAPI's own telemetry in newer
+    releases, or opentelemetry-instrument) the stage spans use that one instead.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        current = otel_trace.get_current_span()
+        if scope["type"] != "http" or getattr(current, "kind", None) == otel_trace.SpanKind.SERVER:
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        attributes = {"http.request.method": method, "url.path": scope["path"]}
+        with _tracer.start_as_current_span(method, kind=otel_trace.SpanKind.SERVER, attributes=attributes) as request_span:
+            async def send_with_status(message):
+                if message["type"] == "http.response.start":
+                    request_span.set_attribute("http.response.status_code", message["status"])
+                    if message["status"] >= 500:
+                        request_span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = scope.get("route")
+                if route is not None and hasattr(route, "path"):
+                    request_span.set_attribute("http.route", route.path)
+                    request_span.update_name(f"{method} {route.path}")
+
+
+def add_request_spans(app) -> None:
+    """Give each request a root span for its stage spans when OpenTelemetry is installed"""
+    if _tracer is not None:
+        app.add_middleware(RequestSpanMiddleware)
+
+
+def format_gauges(name: str, description: str, values: Dict[str, float], label: str) -> List[str]:
+    """Render labelled gauge values in the Prometheus text exposition format"""
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+    for label_value, value in sorted(values.items()):
+        lines.append(f'{name}{{{label}="{label_value}"}} {value}')
+    return lines
+
+
+def render_metrics(extra_lines: Optional[List[str]] = None) -> str:
+    """Render all metrics for the /metrics endpoint"""
+    lines = stage_duration.render() + (extra_lines or [])
+    return "\n".join(lines) + "\n"
+
+
+def log_payload(label: str, payload: Any) -> None:
+    """
+    Log a large debug payload for a sample of calls. Sampling and truncation
+    happen before formatting so unsampled calls cost almost nothing.
+    """
+    if DEBUG_PAYLOAD_SAMPLE_RATE <= 0 or random.random() >= DEBUG_PAYLOAD_SAMPLE_RATE:
+        return
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    text = payload if isinstance(payload, str) else repr(payload)
+    if len(text) > DEBUG_PAYLOAD_MAX_CHARS:
+        text = text[:DEBUG_PAYLOAD_MAX_CHARS] + f"... [{len(text) - DEBUG_PAYLOAD_MAX_CHARS} more chars]"
+    logger.debug("%s: %s", label, text)
+
+
+def configure_logging() -> None:
+    """
+    Send application logs through a queue so handler I/O happens on a
+    background thread instead of the request path.
+    """
+    if logger.handlers:
+        return
+    log_queue: queue.Queue = queue.Queue(-1)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
@@ -0,0 +1,160 @@
+"""
+Startup warm-up. Heavy clients and libraries are loaded lazily to keep
+imports fast (see bench/startup.py), which leaves the first request after a
+deploy to pay for the Anthropic SDK and its TLS connections, Markdown
+extensions, the wkhtmltopdf binary, PyPDF2, Portia's config and the local
+databases. The steps below pay those costs once per worker from the FastAPI
+lifespan, and GET /ready answers 503 until they have finished.
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional
+
+from services.tracing import logger, observe
+
+# Set to 0 to skip warm-up; the app then reports ready straight away
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") != "0"
+# Set to 1 to finish warm-up before the server accepts connections (for platforms without readiness probes)
+WARMUP_BLOCKING = os.getenv("WARMUP_BLOCKING", "0") == "1"
+# Keep-alive connections opened to the Anthropic API by each worker
+WARMUP_LLM_CONNECTIONS = int(os.getenv("WARMUP_LLM_CONNECTIONS", "2"))
+# Longest one step may hold up readiness (seconds); it carries on in the background after that
+WARMUP_STEP_TIMEOUT = float(os.getenv("WARMUP_STEP_TIMEOUT", "30"))
+
+# Small, but uses each Markdown extension the paper renderer loads
+WARMUP_DOCUMENT = """# Warm-up
+
+| Question | Marks |
+|----------|-------|
+| 1        | 10    |
+
+1. First line
+second line
+
+```
+code
+```
+"""
+
+
+def open_state() -> None:
+    from services.calendar_mirror import get_calendar_mirror, get_calendar_provider
+    from services.doc_index import get_document_index
+    from services.question_bank import get_question_bank
+    from services.state_backend import get_state_backend
+
+    get_state_backend()
+    get_question_bank()
+    get_document_index()
+    get_calendar_mirror()
+    get_calendar_provider()
+
+
+def load_pdf_reader() -> None:
+    from PyPDF2 import PdfReader  # type: ignore # noqa: F401
+
+
+def open_llm_connections() -> Optional[str]:
+    """Create the shared client and open keep-alive connections with a free request (listing models)"""
+    if not os.getenv("ANTHROPIC_API_KEY"):
+        return "skipped: ANTHROPIC_API_KEY is not set"
+    from services.anthropic_client import get_anthropic_client
+
+    # Copies of the client share its connection pool
+    client = get_anthropic_client().with_options(timeout=WARMUP_STEP_TIMEOUT)
+    connections = max(1, WARMUP_LLM_CONNECTIONS)
+    with ThreadPoolExecutor(max_workers=connections) as pool:
+        list(pool.map(lambda _: client.models.list(limit=1), range(connections)))
+    return None
+
+
+def render_pdf_document() -> None:
+    from services.paper_generator import render_pdf
+
+    render_pdf(WARMUP_DOCUMENT)
+
+
+def load_portia_config() -> None:
+    from portia import Config
+
+    Config.from_default()
+
+
+# Step name -> function run in a thread; a returned string is reported as a note
+WARMUP_STEPS: Dict[str, Callable[[], Optional[str]]] = {
+    "state": open_state,
+    "pdf_reader": load_pdf_reader,
+    "llm_connections": open_llm_connections,
+    "pdf_backend": render_pdf_document,
+    "portia_config": load_portia_config,
+}
+
+
+class Warmup:
+    """Runs the warm-up steps concurrently and records how each went."""
+
+    def __init__(self, steps: Dict[str, Callable[[], Optional[str]]] = WARMUP_STEPS):
+        self.steps = steps
+        self.state = "pending"
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.seconds: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state in ("ready", "disabled")
+
+    async def _run_step(self, name: str, fn: Callable[[], Optional[str]]) -> None:
+        started = time.perf_counter()
+        result: Dict[str, Any] = {"ok": True}
+        try:
+            # An executor future, unlike run_in_threadpool, can be abandoned on timeout
+            note = await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(None, fn), WARMUP_STEP_TIMEOUT)
+            if note:
+                result["note"] = note
+        except asyncio.TimeoutError:
+            result = {"ok": False, "error": f"Timed out after {WARMUP_STEP_TIMEOUT:g}s"}
+        except Exception as e:
+            result = {"ok": False, "error": str(e)}
+        seconds = time.perf_counter() - started
+        observe(f"warmup_{name}", seconds)
+        result["seconds"] = round(seconds, 3)
+        if not result["ok"]:
+            logger.warning("Warm-up step %s failed: %s", name, result["error"])
+        self.results[name] = result
+
+    async def run(self) -> None:
+        """Run every step; failed steps are reported but do not hold back readiness"""
+        self.state = "running"
+        started = time.perf_counter()
+        await asyncio.gather(*(self._run_step(name, fn) for name, fn in self.steps.items()))
+        self.seconds = round(time.perf_counter() - started, 3)
+        self.state = "ready"
+        logger.info("Warm-up finished in %.2fs", self.seconds)
+
+    def status(self) -> Dict[str, Any]:
+        steps = {name: self.results[name] for name in self.steps if name in self.results}
+        return {"ready": self.ready, "state": self.state, "seconds": self.seconds, "steps": steps}
+
+
+warmup = Warmup()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """FastAPI lifespan that warms the worker up, in the background unless WARMUP_BLOCKING is set"""
+    task = None
+    if not WARMUP_ENABLED:
+        warmup.state = "disabled"
+    elif WARMUP_BLOCKING:
+        await warmup.run()
+    else:
+        task = asyncio.create_task(warmup.run())
+    try:
+        yield
+    finally:
+        if task is not None and not task.done():
+            task.cancel()
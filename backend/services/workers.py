@@ -0,0 +1,34 @@
+"""
+Host-wide budgets and cores split between the worker processes on this
+host. Each uvicorn worker has its own limiter, scheduler and process pools,
+so a budget such as the Anthropic tier's tokens per minute, or a pool of
+one process per core, would otherwise be granted once per worker.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Worker processes serving this host; serve.py sets it for the workers it starts
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+# Cores for each worker's process pools (OCR, bulk extraction)
+CPUS_PER_WORKER = max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)
+# How pool processes are started. fork would copy the worker with its event
+# loop, threads and any locks they hold, so forkserver is used where available
+PROCESS_START_METHOD = os.getenv(
+    "PROCESS_START_METHOD", "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+def per_worker(total):
+    """This worker's share of a budget for the whole host; 0 (off) stays 0 and integer budgets stay at least 1"""
+    if not total:
+        return total
+    if isinstance(total, int):
+        return max(1, total // WEB_CONCURRENCY)
+    return total / WEB_CONCURRENCY
+
+
+def process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Process pool whose processes are started with PROCESS_START_METHOD"""
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(PROCESS_START_METHOD))
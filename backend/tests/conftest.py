@@ -0,0 +1,79 @@
+"""
+Shared setup: the app runs against the local Anthropic stub and fake Portia
+from bench.stubs, with its state in a temporary directory. Settings are read
+at import, so the environment is set before any app module is imported.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.stubs import StubConfig, install_portia_stub, start_anthropic_stub  # noqa: E402
+
+STUB_CONFIG = StubConfig(latency=0.2, output_tokens_per_second=1e9, portia_latency=0.0)
+anthropic_stub = start_anthropic_stub(STUB_CONFIG)
+install_portia_stub(STUB_CONFIG)
+
+STATE_DIR = tempfile.mkdtemp(prefix="tests_state_")
+os.environ.update({
+    "ANTHROPIC_BASE_URL": f"http://127.0.0.1:{anthropic_stub.server_address[1]}",
+    "ANTHROPIC_API_KEY": "stub-key",
+    "PORTIA_API_KEY": "stub-key",
+    "STATE_BACKEND_URL": f"sqlite:///{STATE_DIR}/state.db",
+    "DOC_INDEX_PATH": os.path.join(STATE_DIR, "doc_index.db"),
+    "QUESTION_BANK_PATH": os.path.join(STATE_DIR, "question_bank.db"),
+    "CALENDAR_MIRROR_PATH": os.path.join(STATE_DIR, "calendar_mirror.db"),
+    "LLM_OUTPUT_TOKENS_PER_MINUTE": "1000000",
+    "LLM_INPUT_TOKENS_PER_MINUTE": "1000000",
+    "WARMUP_ENABLED": "0",
+})
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def stub_calls():
+    """Number of messages calls the Anthropic stub has served since the test started"""
+    handler = anthropic_stub.RequestHandlerClass
+    start = handler.calls
+    return lambda: handler.calls - start
+
+
+@pytest.fixture
+def make_pdf():
+    """Small text PDFs; different seeds give different bytes, so uploads are not served from cache"""
+    from bench.memory import synthetic_pdf
+
+    return lambda seed=0, pages=3: synthetic_pdf(pages, image_kb=1, seed=seed)
+
+
+@pytest.fixture
+async def client():
+    import httpx
+
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver", timeout=60) as client:
+        yield client
+
+
+@pytest.fixture
+def fake_calendar(tmp_path, monkeypatch):
+    """Serve the calendar mirror from an empty FakeCalendarProvider and a fresh mirror database"""
+    from bench.stubs import FakeCalendarProvider
+    from services import calendar_mirror
+
+    provider = FakeCalendarProvider()
+    monkeypatch.setattr(calendar_mirror, "_provider", provider)
+    monkeypatch.setattr(calendar_mirror, "_provider_loaded", True)
+    monkeypatch.setattr(calendar_mirror, "_mirror", calendar_mirror.CalendarMirror(str(tmp_path / "calendar_mirror.db")))
+    return provider
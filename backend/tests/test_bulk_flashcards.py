@@ -0,0 +1,84 @@
+import io
+import json
+import zipfile
+
+import pytest
+from fastapi import HTTPException
+
+from services import bulk_flashcards
+from services.bulk_flashcards import expand_uploads
+
+
+def zip_of(files) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files:
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+@pytest.mark.anyio
+async def test_bulk_stream_reports_each_file_then_the_combined_deck(client, make_pdf, stub_calls):
+    pdfs = [(f"week{i}.pdf", make_pdf(seed=3600 + i)) for i in range(3)]
+    archive = zip_of([("week3.pdf", make_pdf(seed=3603)), ("notes.txt", b"skipped")])
+    files = [("pdf_files", (name, content, "application/pdf")) for name, content in pdfs]
+    files.append(("pdf_files", ("more.zip", archive, "application/zip")))
+
+    response = await client.post("/flashcards/bulk", files=files, data={"count": "4"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in response.text.splitlines()]
+    names = ["week0.pdf", "week1.pdf", "week2.pdf", "more.zip/week3.pdf"]
+    assert events[0] == {"event": "started", "files": names}
+    assert sorted(event["file"] for event in events if event["event"] == "file_done") == sorted(names)
+    assert sum(event["event"] == "extracted" for event in events) == 4
+
+    deck = events[-1]
+    assert deck["event"] == "deck"
+    assert len(deck["flashcards"]) == 16
+    assert [card["id"] for card in deck["flashcards"]] == [str(i) for i in range(1, 17)]
+    assert {card["source_file"] for card in deck["flashcards"]} == set(names)
+    assert stub_calls() == 4
+
+    stored = await client.get(f"/flashcards/decks/{deck['deck_id']}")
+    assert stored.json()["flashcards"] == deck["flashcards"]
+
+
+@pytest.mark.anyio
+async def test_a_failing_file_is_reported_without_failing_the_deck(client, make_pdf):
+    files = [
+        ("pdf_files", ("good.pdf", make_pdf(seed=3610), "application/pdf")),
+        ("pdf_files", ("broken.pdf", b"not a pdf", "application/pdf")),
+    ]
+
+    response = await client.post("/flashcards/bulk", files=files, data={"count": "4"})
+
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["file"] for event in events if event["event"] == "file_error"] == ["broken.pdf"]
+    assert events[-1]["files"] == [{"file": "good.pdf", "cards": 4}, {"file": "broken.pdf", "cards": 0}]
+
+
+def test_zip_file_count_is_checked_before_each_entry_is_read(monkeypatch):
+    monkeypatch.setattr(bulk_flashcards, "BULK_MAX_FILES", 3)
+    archive = zip_of([(f"{i}.pdf", b"%PDF") for i in range(10)])
+    reads = []
+    original_read = zipfile.ZipFile.read
+    monkeypatch.setattr(zipfile.ZipFile, "read", lambda self, info: reads.append(info) or original_read(self, info))
+
+    with pytest.raises(HTTPException) as rejected:
+        expand_uploads([("all.zip", archive)])
+
+    assert rejected.value.status_code == 413
+    assert len(reads) == 3
+
+
+def test_total_uncompressed_size_is_limited(monkeypatch):
+    monkeypatch.setattr(bulk_flashcards, "BULK_MAX_BYTES", 1000)
+    # Compresses to almost nothing, but expands past the limit
+    archive = zip_of([("big.pdf", b"0" * 5000)])
+    assert len(archive) < 1000
+
+    with pytest.raises(HTTPException) as rejected:
+        expand_uploads([("small.pdf", b"%PDF"), ("bomb.zip", archive)])
+    assert rejected.value.status_code == 413
@@ -0,0 +1,168 @@
+import json
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+import google_calendar
+from services import calendar_mirror
+from services.calendar_mirror import get_calendar_mirror, normalise_time
+
+USER = "student-1"
+
+
+def event(event_id, start, end, summary="Lecture"):
+    return {"id": event_id, "summary": summary, "start": start, "end": end}
+
+
+def test_times_are_converted_to_utc_before_the_zone_is_dropped():
+    assert normalise_time("2026-10-19T10:00:00+02:00") == "2026-10-19T08:00:00"
+    assert normalise_time("2026-10-19T08:00:00Z") == "2026-10-19T08:00:00"
+    assert normalise_time("2026-10-19T23:30:00-05:00") == "2026-10-20T04:30:00"
+    assert normalise_time("2026-10-19T08:00") == "2026-10-19T08:00:00"
+
+
+def test_events_in_other_zones_block_the_right_hours(fake_calendar):
+    fake_calendar.put_event(USER, event("a", "2026-10-19T11:00:00+02:00", "2026-10-19T12:00:00+02:00"))
+    fake_calendar.put_event(USER, event("b", "2026-10-19T13:00:00Z", "2026-10-19T14:30:00Z"))
+
+    slots = get_calendar_mirror().free_slots(USER, fake_calendar, "2026-10-19", "08:00", "17:00")
+
+    assert slots == [
+        {"start": "2026-10-19T08:00:00", "end": "2026-10-19T09:00:00"},
+        {"start": "2026-10-19T10:00:00", "end": "2026-10-19T13:00:00"},
+        {"start": "2026-10-19T14:30:00", "end": "2026-10-19T17:00:00"},
+    ]
+
+
+def test_mirror_syncs_incrementally_after_invalidation(fake_calendar):
+    mirror = get_calendar_mirror()
+    fake_calendar.put_event(USER, event("a", "2026-10-19T09:00:00", "2026-10-19T10:00:00"))
+    mirror.free_slots(USER, fake_calendar, "2026-10-19", "08:00", "12:00")
+    fake_calendar.put_event(USER, event("b", "2026-10-19T10:30:00", "2026-10-19T11:00:00"))
+
+    # Within the sync interval the mirror answers on its own
+    stale = mirror.free_slots(USER, fake_calendar, "2026-10-19", "08:00", "12:00")
+    assert fake_calendar.sync_calls == 1
+    assert len(stale) == 2
+
+    mirror.invalidate(USER, "2026-10-19")
+    fresh = mirror.free_slots(USER, fake_calendar, "2026-10-19", "08:00", "12:00")
+    assert fake_calendar.sync_calls == 2
+    assert len(fresh) == 3
+
+
+def test_expired_sync_token_falls_back_to_a_full_sync(fake_calendar):
+    mirror = get_calendar_mirror()
+    fake_calendar.put_event(USER, event("a", "2026-10-19T09:00:00", "2026-10-19T10:00:00"))
+    mirror.free_slots(USER, fake_calendar, "2026-10-19", "08:00", "12:00")
+    fake_calendar.delete_event(USER, "a")
+    fake_calendar.compact(USER)
+    full_syncs = calendar_mirror.calendar_stats["full_syncs"]
+
+    mirror.invalidate(USER)
+    slots = mirror.free_slots(USER, fake_calendar, "2026-10-19", "08:00", "12:00")
+
+    assert slots == [{"start": "2026-10-19T08:00:00", "end": "2026-10-19T12:00:00"}]
+    assert calendar_mirror.calendar_stats["full_syncs"] == full_syncs + 1
+
+
+@pytest.mark.anyio
+async def test_free_time_uses_the_configured_provider(client, fake_calendar):
+    fake_calendar.put_event(USER, event("a", "2026-10-19T09:00:00", "2026-10-19T10:00:00"))
+
+    response = await client.post(
+        "/calendar/free", json={"date": "2026-10-19", "start_time": "08:00", "end_time": "11:00"}, headers={"X-User-Id": USER}
+    )
+
+    assert response.json()["free_slots"] == [
+        {"start": "2026-10-19T08:00:00", "end": "2026-10-19T09:00:00"},
+        {"start": "2026-10-19T10:00:00", "end": "2026-10-19T11:00:00"},
+    ]
+
+
+@pytest.mark.anyio
+async def test_free_time_without_a_provider_asks_portia_for_availability(client, monkeypatch):
+    monkeypatch.setattr(calendar_mirror, "_provider", None)
+    monkeypatch.setattr(calendar_mirror, "_provider_loaded", True)
+    prompts = []
+    from portia import Portia
+
+    original_plan = Portia.plan
+    monkeypatch.setattr(Portia, "plan", lambda self, prompt: prompts.append(prompt) or original_plan(self, prompt))
+
+    response = await client.post("/calendar/free", json={"date": "2025-01-01", "start_time": "09:00", "end_time": "17:00"})
+
+    assert response.json()["free_slots"] == [
+        {"start": "2025-01-01T10:00:00", "end": "2025-01-01T11:00:00"},
+        {"start": "2025-01-01T14:00:00", "end": "2025-01-01T15:30:00"},
+    ]
+    assert len(prompts) == 1 and "Check my Google Calendar availability" in prompts[0]
+
+
+def test_created_event_is_reported_even_if_invalidation_fails(monkeypatch, caplog):
+    class BrokenMirror:
+        def invalidate(self, user_id, date=None):
+            raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(google_calendar, "get_calendar_mirror", lambda: BrokenMirror())
+
+    with caplog.at_level(logging.ERROR):
+        result = google_calendar.create_event_in_calendar("2026-10-19T09:00", "2026-10-19T10:00", user_id=USER)
+
+    assert result["success"] is True
+    assert "database is locked" in caplog.text
+
+
+def test_window_and_slots_are_in_the_users_zone(fake_calendar):
+    # Berlin is UTC+2 on this date; the naive event is Berlin wall-clock time too
+    fake_calendar.put_event(USER, event("a", "2026-10-19T09:00:00+02:00", "2026-10-19T10:00:00+02:00"))
+    fake_calendar.put_event(USER, event("b", "2026-10-19T10:00:00Z", "2026-10-19T10:30:00Z"))
+    fake_calendar.put_event(USER, event("c", "2026-10-19T15:00:00", "2026-10-19T16:00:00"))
+
+    slots = get_calendar_mirror().free_slots(USER, fake_calendar, "2026-10-19", "08:00", "17:00", "Europe/Berlin")
+
+    assert slots == [
+        {"start": "2026-10-19T08:00:00", "end": "2026-10-19T09:00:00"},
+        {"start": "2026-10-19T10:00:00", "end": "2026-10-19T12:00:00"},
+        {"start": "2026-10-19T12:30:00", "end": "2026-10-19T15:00:00"},
+        {"start": "2026-10-19T16:00:00", "end": "2026-10-19T17:00:00"},
+    ]
+
+
+@pytest.mark.anyio
+async def test_mirror_and_portia_agree_outside_utc(client, fake_calendar, monkeypatch):
+    fake_calendar.put_event(USER, event("a", "2026-10-19T09:00:00-04:00", "2026-10-19T10:00:00-04:00"))
+    request = {"date": "2026-10-19", "start_time": "08:00", "end_time": "12:00", "time_zone": "America/New_York"}
+
+    mirrored = await client.post("/calendar/free", json=request, headers={"X-User-Id": USER})
+
+    # Portia answers with offsets, in UTC or the calendar's own zone
+    from portia import Portia
+
+    availability = [
+        {"start": "2026-10-19T12:00:00Z", "end": "2026-10-19T13:00:00Z"},
+        {"start": "2026-10-19T10:00:00-04:00", "end": "2026-10-19T12:00:00-04:00"},
+    ]
+    monkeypatch.setattr(calendar_mirror, "_provider", None)
+    monkeypatch.setattr(Portia, "run_plan", lambda self, plan: SimpleNamespace(model_dump=lambda: {
+        "outputs": {"step_outputs": {"$availability": {"value": json.dumps(availability)}}}
+    }))
+    asked = await client.post("/calendar/free", json=request, headers={"X-User-Id": USER})
+
+    expected = [
+        {"start": "2026-10-19T08:00:00", "end": "2026-10-19T09:00:00"},
+        {"start": "2026-10-19T10:00:00", "end": "2026-10-19T12:00:00"},
+    ]
+    assert mirrored.json()["free_slots"] == expected
+    assert asked.json()["free_slots"] == expected
+
+
+@pytest.mark.anyio
+async def test_unknown_time_zone_is_rejected(client):
+    response = await client.post(
+        "/calendar/free", json={"date": "2026-10-19", "start_time": "08:00", "end_time": "12:00", "time_zone": "Mars/Olympus"}
+    )
+
+    assert response.status_code == 422
+    assert "Unknown time zone" in response.text
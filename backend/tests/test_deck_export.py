@@ -0,0 +1,73 @@
+import io
+import os
+import tempfile
+
+import pytest
+
+from bench.export import synthetic_deck
+from services import deck_export
+from services.deck_export import parquet_available, read_apkg, read_binary, read_csv, write_apkg, write_binary, write_csv, write_parquet
+from services.state_backend import get_state_backend
+
+
+def read_parquet(data: bytes):
+    import pyarrow.parquet as pq  # type: ignore
+    return pq.read_table(io.BytesIO(data)).to_pylist()
+
+
+FORMATS = {
+    "csv": (write_csv, lambda data: read_csv(io.StringIO(data.decode(), newline=""))),
+    "binary": (write_binary, lambda data: read_binary(io.BytesIO(data))),
+    "apkg": (write_apkg, lambda data: read_apkg(io.BytesIO(data))),
+    "parquet": (write_parquet, read_parquet),
+}
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize("name", FORMATS)
+def test_export_round_trip(name, temp_dir, monkeypatch):
+    if name == "parquet" and not parquet_available():
+        pytest.skip("pyarrow is not installed")
+    # Several batches, and a field that needs CSV quoting
+    monkeypatch.setattr(deck_export, "EXPORT_BATCH_SIZE", 64)
+    batch_sizes = []
+    batches = deck_export._batches
+    monkeypatch.setattr(deck_export, "_batches", lambda cards: (batch_sizes.append(len(b)) or b for b in batches(cards)))
+    deck = synthetic_deck(300, seed=3700)
+    deck[0]["question"] = 'Comma, "quotes" and\na newline?'
+    write, read = FORMATS[name]
+
+    chunks = list(write(iter(deck)))
+    restored = list(read(b"".join(chunks)))
+
+    assert batch_sizes == [64, 64, 64, 64, 44]
+    if name == "csv":
+        assert len(chunks) == 5
+    elif name == "binary":
+        # Magic, one block per batch and the terminator
+        assert len(chunks) == 7
+    elif name == "parquet":
+        import pyarrow.parquet as pq  # type: ignore
+        assert pq.ParquetFile(io.BytesIO(b"".join(chunks))).num_row_groups == 5
+    assert restored == deck
+    assert os.listdir(temp_dir) == []
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("export_format", ["csv", "apkg", "columnar"])
+async def test_export_endpoint_deletes_its_temp_file(client, temp_dir, export_format):
+    deck = synthetic_deck(50, seed=3701)
+    get_state_backend().set_json("deck:export-test", deck)
+
+    response = await client.get("/flashcards/decks/export-test/export", params={"format": export_format})
+
+    assert response.status_code == 200
+    assert response.headers["content-disposition"].startswith('attachment; filename="deck_export-test.')
+    if export_format == "apkg":
+        assert list(read_apkg(io.BytesIO(response.content))) == deck
+    assert os.listdir(temp_dir) == []
@@ -0,0 +1,131 @@
+import pytest
+
+from services import doc_index
+from services.doc_index import DocumentIndex
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(doc_index, "EMBEDDING_MODEL", None)
+    # Small batches so a stream commits several before it ends
+    monkeypatch.setattr(doc_index, "INDEX_BATCH_CHUNKS", 2)
+    return DocumentIndex(str(tmp_path / "doc_index.db"))
+
+
+def count(index, table):
+    return index._conn().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def texts(hits):
+    return [hit["text"] for hit in hits]
+
+
+def test_indexing_the_same_document_twice_adds_it_once(index):
+    chunks = ["mitochondria make energy", "ribosomes make protein", "the nucleus holds dna"]
+
+    assert index.index_chunks("alice", "hash-1", chunks, "cells.pdf") == 3
+    assert index.index_chunks("alice", "hash-1", chunks, "cells.pdf") == 0
+
+    assert index.has_document("alice", "hash-1")
+    assert count(index, "documents") == 1
+    assert count(index, "chunks") == 3
+    assert texts(index.search("alice", "ribosomes")) == ["ribosomes make protein"]
+
+
+def test_search_only_returns_the_users_own_chunks(index):
+    index.index_chunks("alice", "hash-1", ["alice studies photosynthesis"])
+    index.index_chunks("bob", "hash-1", ["bob studies photosynthesis"])
+
+    assert texts(index.search("alice", "photosynthesis")) == ["alice studies photosynthesis"]
+    assert texts(index.search("bob", "photosynthesis")) == ["bob studies photosynthesis"]
+    assert index.search("carol", "photosynthesis") == []
+    assert not index.has_document("carol", "hash-1")
+
+
+def test_search_orders_by_bm25(index):
+    index.index_chunks("alice", "hash-1", [
+        "enzymes speed up reactions in the cell",
+        "enzymes enzymes enzymes: how enzymes bind substrates",
+        "the krebs cycle runs in the mitochondria",
+        "enzymes lower activation energy",
+    ])
+
+    hits = index.search("alice", "enzymes")
+
+    assert hits[0]["text"] == "enzymes enzymes enzymes: how enzymes bind substrates"
+    assert len(hits) == 3
+    assert [hit["score"] for hit in hits] == sorted(hit["score"] for hit in hits)
+
+
+def test_failed_stream_removes_the_partial_document(index):
+    def chunks():
+        for i in range(5):
+            yield f"chapter {i} covers glycolysis"
+        raise RuntimeError("PDF could not be read")
+
+    with pytest.raises(RuntimeError):
+        index.index_chunks("alice", "hash-1", chunks())
+
+    assert count(index, "documents") == 0
+    assert count(index, "chunks") == 0
+    assert index.search("alice", "glycolysis") == []
+    # The next upload indexes it from scratch
+    assert index.index_chunks("alice", "hash-1", ["glycolysis splits glucose"]) == 1
+    assert texts(index.search("alice", "glycolysis")) == ["glycolysis splits glucose"]
+
+
+def test_document_is_hidden_until_its_last_batch(index):
+    seen = {}
+
+    def chunks():
+        for i in range(4):
+            yield f"section {i} on osmosis"
+        # Two batches are committed by now
+        seen["hits"] = index.search("alice", "osmosis")
+        seen["has_document"] = index.has_document("alice", "hash-1")
+        seen["concurrent"] = index.index_chunks("alice", "hash-1", ["osmosis again"])
+        yield "section 4 on osmosis"
+
+    assert index.index_chunks("alice", "hash-1", chunks()) == 5
+
+    assert seen == {"hits": [], "has_document": False, "concurrent": 0}
+    assert len(index.search("alice", "osmosis")) == 5
+
+
+def test_document_left_incomplete_by_a_dead_process_is_indexed_again(index, monkeypatch):
+    def killed():
+        yield from ("diffusion part one", "diffusion part two", "diffusion part three")
+        raise KeyboardInterrupt
+
+    # A killed process never gets to clean up
+    monkeypatch.setattr(index, "_remove_document", lambda document_id: None)
+    with pytest.raises(KeyboardInterrupt):
+        index.index_chunks("alice", "hash-1", killed())
+    monkeypatch.undo()
+    monkeypatch.setattr(doc_index, "INDEX_BATCH_CHUNKS", 2)
+
+    assert not index.has_document("alice", "hash-1")
+    # Still looks like it is being indexed
+    assert index.index_chunks("alice", "hash-1", ["diffusion"]) == 0
+
+    monkeypatch.setattr(doc_index, "DOC_INDEX_STALE_SECONDS", 0)
+    assert index.index_chunks("alice", "hash-1", ["diffusion in full", "diffusion summary"]) == 2
+
+    assert index.has_document("alice", "hash-1")
+    assert count(index, "documents") == 1
+    assert sorted(texts(index.search("alice", "diffusion"))) == ["diffusion in full", "diffusion summary"]
+    assert count(index, "chunks") == 2
+
+
+def test_libraries_from_before_the_complete_flag_stay_searchable(tmp_path):
+    path = str(tmp_path / "old.db")
+    old = DocumentIndex(path)
+    old.index_chunks("alice", "hash-1", ["meiosis halves chromosomes"])
+    conn = old._conn()
+    conn.execute("ALTER TABLE documents DROP COLUMN complete")
+    conn.commit()
+
+    migrated = DocumentIndex(path)
+
+    assert migrated.has_document("alice", "hash-1")
+    assert texts(migrated.search("alice", "meiosis")) == ["meiosis halves chromosomes"]
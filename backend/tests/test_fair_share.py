@@ -0,0 +1,124 @@
+import asyncio
+
+import httpx
+import pytest
+from starlette.responses import PlainTextResponse
+
+from services.fair_share import FairScheduler, FairShareMiddleware, QuotaExceeded, user_key
+
+
+def scheduler(**overrides) -> FairScheduler:
+    settings = dict(concurrency=2, max_running=2, max_pending=20, queue_timeout=5.0, token_quota=0, cpu_quota=0.0, weights={})
+    settings.update(overrides)
+    return FairScheduler(**settings)
+
+
+@pytest.mark.anyio
+async def test_light_user_is_served_before_heavy_backlog():
+    fair = scheduler()
+    heavy_jobs = [await fair.acquire("heavy") for _ in range(2)]
+    heavy_waiting = [asyncio.ensure_future(fair.acquire("heavy")) for _ in range(5)]
+    await asyncio.sleep(0)
+    light = asyncio.ensure_future(fair.acquire("light"))
+    await asyncio.sleep(0.2)
+
+    fair.release(heavy_jobs[0])
+    light_job = await asyncio.wait_for(light, 1)
+    assert not any(task.done() for task in heavy_waiting)
+
+    fair.release(light_job)
+    for job in heavy_jobs[1:]:
+        fair.release(job)
+    for task in heavy_waiting:
+        fair.release(await task)
+    assert fair.running == 0
+
+
+@pytest.mark.anyio
+async def test_too_many_pending_requests_are_rejected_with_retry_after():
+    fair = scheduler(concurrency=1, max_running=1, max_pending=2)
+    job = await fair.acquire("user")
+    waiting = asyncio.ensure_future(fair.acquire("user"))
+    await asyncio.sleep(0)
+    with pytest.raises(QuotaExceeded) as rejected:
+        await fair.acquire("user")
+    assert rejected.value.retry_after > 0
+    # Other users are not affected
+    other = asyncio.ensure_future(fair.acquire("other"))
+    fair.release(job)
+    fair.release(await waiting)
+    fair.release(await other)
+
+
+@pytest.mark.anyio
+async def test_queue_timeout_is_rejected():
+    fair = scheduler(concurrency=1, max_running=1, queue_timeout=0.05)
+    job = await fair.acquire("a")
+    with pytest.raises(QuotaExceeded):
+        await fair.acquire("b")
+    fair.release(job)
+    assert fair.timeouts == 1
+
+
+def test_user_id_is_only_believed_from_trusted_proxies():
+    assert user_key({"headers": [(b"x-user-id", b"alice")], "client": ("127.0.0.1", 1)}) == "alice"
+    # Anyone else is keyed by address, whatever header they send
+    assert user_key({"headers": [(b"x-user-id", b"alice")], "client": ("203.0.113.5", 1)}) == "anonymous:203.0.113.5"
+    assert user_key({"headers": [], "client": ("203.0.113.5", 1)}) == "anonymous:203.0.113.5"
+    # A trusted proxy without a user id forwards the client address
+    forwarded = [(b"x-forwarded-for", b"198.51.100.1, 198.51.100.7")]
+    assert user_key({"headers": forwarded, "client": ("::1", 1)}) == "anonymous:198.51.100.7"
+
+
+def test_anonymous_accounts_get_the_anonymous_weight():
+    fair = scheduler(weights={"teacher": 4}, anonymous_weight=0.25)
+    assert fair._account("anonymous:203.0.113.5").weight == 0.25
+    assert fair._account("teacher").weight == 4
+    assert fair._account("alice").weight == 1
+
+
+@pytest.mark.anyio
+async def test_requests_without_a_user_id_are_queued():
+    fair = scheduler(concurrency=1, max_running=1)
+    release = asyncio.Event()
+
+    async def slow(scope, receive, send):
+        await release.wait()
+        await PlainTextResponse("done")(scope, receive, send)
+
+    app = FairShareMiddleware(slow, scheduler=fair)
+    clients = [
+        httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=(address, 1)), base_url="http://test")
+        for address in ("203.0.113.5", "203.0.113.5", "198.51.100.7")
+    ]
+    # Rotating the header does not make the second request a new user
+    requests = [
+        asyncio.ensure_future(client.post("/calendar/free", headers={"X-User-Id": f"user-{i}"}))
+        for i, client in enumerate(clients)
+    ]
+    await asyncio.sleep(0.1)
+
+    assert fair.running == 1
+    assert fair.queued == 2
+    assert fair.stats()["users"] == 2
+    release.set()
+    responses = await asyncio.gather(*requests)
+    assert [response.status_code for response in responses] == [200] * 3
+    assert fair.running == 0
+    for client in clients:
+        await client.aclose()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("headers", [{}, {"X-User-Id": "class-7b"}], ids=["anonymous", "one-user"])
+async def test_identical_requests_join_without_taking_slots(client, make_pdf, stub_calls, headers):
+    pdf = make_pdf(seed=4300 + len(headers))
+    files = {"pdf_file": ("handout.pdf", pdf, "application/pdf")}
+    data = {"subject": "Biology", "count": "4"}
+
+    responses = await asyncio.gather(*(
+        client.post("/flashcards", files=files, data=data, headers=headers) for _ in range(100)
+    ))
+
+    assert [response.status_code for response in responses] == [200] * 100
+    assert stub_calls() == 1
@@ -0,0 +1,113 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from FlashCardTools import FlashcardGenerator, parse_stats
+
+TEXT = "Photosynthesis turns light into chemical energy. " * 20
+CARDS = [{"id": str(i), "question": f"Question {i}?", "answer": f"Answer {i}"} for i in range(1, 4)]
+
+
+def tool_use(tool_input):
+    return SimpleNamespace(type="tool_use", input=tool_input)
+
+
+def text_block(text):
+    return SimpleNamespace(type="text", text=text)
+
+
+class ScriptedMessages:
+    """Anthropic messages API that answers with the given content blocks in turn and records each request"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def create(self, **request):
+        self.requests.append(request)
+        return SimpleNamespace(content=self.responses.pop(0), usage=SimpleNamespace(input_tokens=10, output_tokens=10))
+
+
+def generator_answering(*responses):
+    generator = FlashcardGenerator()
+    generator.client = SimpleNamespace(messages=ScriptedMessages(*responses))
+    return generator
+
+
+@pytest.fixture
+def counters():
+    """Change in each mode's parse_stats counters since the test started"""
+    before = {mode: dict(vars(stats)) for mode, stats in parse_stats.items()}
+    return lambda mode: {
+        name: value - before[mode][name] for name, value in vars(parse_stats[mode]).items() if name != "postprocess_seconds"
+    }
+
+
+@pytest.mark.parametrize("mode", ["tool", "text"])
+def test_both_modes_parse_the_stub_response(mode, counters):
+    result = FlashcardGenerator().generate_flashcards(TEXT, count=5, mode=mode)
+
+    assert [card["id"] for card in result["flashcards"]] == ["1", "2", "3", "4", "5"]
+    assert counters(mode) == {"responses": 1, "parse_failures": 0, "repairs": 0, "fallbacks": 0}
+
+
+@pytest.mark.parametrize("flashcards", [
+    json.dumps(CARDS),
+    json.dumps({"flashcards": CARDS}),
+    # Trailing comma, fixed by the free-text repairs
+    json.dumps(CARDS)[:-1] + ",]",
+], ids=["array", "object", "trailing-comma"])
+def test_flashcards_sent_as_a_json_string_are_repaired_in_place(flashcards, counters):
+    generator = generator_answering([tool_use({"flashcards": flashcards})])
+
+    result = generator.generate_flashcards(TEXT, count=3, mode="tool")
+
+    assert result["flashcards"] == CARDS
+    assert len(generator.client.messages.requests) == 1
+    assert counters("tool") == {"responses": 1, "parse_failures": 0, "repairs": 1, "fallbacks": 0}
+
+
+def test_numeric_ids_are_not_counted_as_repairs(counters):
+    cards = [dict(card, id=int(card["id"])) for card in CARDS]
+    generator = generator_answering([tool_use({"flashcards": cards})])
+
+    assert generator.generate_flashcards(TEXT, count=3, mode="tool")["flashcards"] == CARDS
+    assert counters("tool")["repairs"] == 0
+
+
+@pytest.mark.parametrize("tool_input", [
+    {"flashcards": "not json at all"},
+    {"flashcards": [{"id": "1", "question": "No answer"}]},
+    {"cards": CARDS},
+], ids=["unparseable", "invalid-card", "wrong-key"])
+def test_unusable_tool_input_is_asked_for_again_in_text_mode(tool_input, counters):
+    generator = generator_answering([tool_use(tool_input)], [text_block(json.dumps({"flashcards": CARDS}))])
+
+    result = generator.generate_flashcards(TEXT, count=3, mode="tool")
+
+    assert result["flashcards"] == CARDS
+    first, retry = generator.client.messages.requests
+    assert "tools" in first and "tools" not in retry
+    assert counters("tool") == {"responses": 1, "parse_failures": 0, "repairs": 0, "fallbacks": 1}
+    assert counters("text") == {"responses": 1, "parse_failures": 0, "repairs": 0, "fallbacks": 0}
+
+
+def test_text_blocks_next_to_unusable_tool_input_are_used(counters):
+    generator = generator_answering([text_block(json.dumps({"flashcards": CARDS})), tool_use({"flashcards": None})])
+
+    assert generator.generate_flashcards(TEXT, count=3, mode="tool")["flashcards"] == CARDS
+    assert len(generator.client.messages.requests) == 1
+    assert counters("tool")["fallbacks"] == 1
+
+
+def test_unparseable_text_response_is_a_parse_failure(counters):
+    generator = generator_answering([text_block("Sorry, I can't help with that.")])
+
+    with pytest.raises(HTTPException) as failed:
+        generator.generate_flashcards(TEXT, count=3, mode="text")
+
+    assert failed.value.status_code == 500
+    assert "Could not find flashcards array" in failed.value.detail
+    assert counters("text") == {"responses": 1, "parse_failures": 1, "repairs": 0, "fallbacks": 0}
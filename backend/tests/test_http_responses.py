@@ -0,0 +1,125 @@
+import json
+import sys
+from datetime import date, datetime, timezone
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from services import http_responses
+from services.http_responses import DefaultResponse, add_compression, dumps
+
+DECK = [{"id": str(i), "question": f"What does enzyme {i} do?", "answer": "It lowers activation energy. " * 4} for i in range(40)]
+
+
+def compressed_app(monkeypatch, brotli=False):
+    """Small app with the API's compression setup; gzip only unless brotli is asked for"""
+    if not brotli:
+        monkeypatch.setitem(sys.modules, "brotli_asgi", None)
+    app = FastAPI(default_response_class=DefaultResponse)
+    add_compression(app)
+
+    @app.get("/deck")
+    async def deck():
+        return {"flashcards": DECK}
+
+    @app.get("/tiny")
+    async def tiny():
+        return {"ok": True}
+
+    @app.get("/progress")
+    async def progress():
+        lines = (dumps({"event": "file_done", "file": f"week{i}.pdf"}) + b"\n" for i in range(100))
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+
+    @app.get("/flashcards/decks/{deck_id}/export")
+    async def export(deck_id: str):
+        return Response("question,answer\n" * 200, media_type="text/csv")
+
+    @app.get("/papers/{paper_id}")
+    async def paper(paper_id: str):
+        return Response(b"%PDF-" + b"0" * 4000, media_type="application/pdf")
+
+    return TestClient(app)
+
+
+def test_gzip_is_used_when_the_client_accepts_it(monkeypatch):
+    client = compressed_app(monkeypatch)
+
+    response = client.get("/deck", headers={"Accept-Encoding": "br, gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == {"flashcards": DECK}
+
+
+def test_brotli_only_clients_get_identity_without_brotli_asgi(monkeypatch):
+    client = compressed_app(monkeypatch)
+
+    response = client.get("/deck", headers={"Accept-Encoding": "br"})
+
+    assert "content-encoding" not in response.headers
+    assert response.json() == {"flashcards": DECK}
+
+
+def test_brotli_is_preferred_when_installed(monkeypatch):
+    pytest.importorskip("brotli_asgi")
+    client = compressed_app(monkeypatch, brotli=True)
+
+    assert client.get("/deck", headers={"Accept-Encoding": "gzip, br"}).headers["content-encoding"] == "br"
+    assert client.get("/deck", headers={"Accept-Encoding": "gzip"}).headers["content-encoding"] == "gzip"
+
+
+def test_small_responses_are_not_compressed(monkeypatch):
+    client = compressed_app(monkeypatch)
+
+    response = client.get("/tiny", headers={"Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in response.headers
+    assert response.content == b'{"ok":true}'
+
+
+@pytest.mark.parametrize("path", ["/progress", "/flashcards/decks/abc/export", "/papers/abc"])
+def test_streams_exports_and_papers_are_sent_uncompressed(monkeypatch, path):
+    client = compressed_app(monkeypatch)
+
+    response = client.get(path, headers={"Accept-Encoding": "gzip, br"})
+
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert len(response.content) > http_responses.COMPRESSION_MIN_BYTES
+
+
+@pytest.mark.anyio
+async def test_stored_deck_answers_if_none_match_with_304(client):
+    from services.state_backend import get_state_backend
+
+    get_state_backend().set_json("deck:etag-test", DECK)
+
+    first = await client.get("/flashcards/decks/etag-test")
+    etag = first.headers["etag"]
+    again = await client.get("/flashcards/decks/etag-test", headers={"If-None-Match": etag})
+    weak = await client.get("/flashcards/decks/etag-test", headers={"If-None-Match": f'"other", W/{etag}'})
+    changed = await client.get("/flashcards/decks/etag-test", headers={"If-None-Match": '"other"'})
+
+    assert first.status_code == 200 and first.json()["flashcards"] == DECK
+    assert again.status_code == 304 and again.headers["etag"] == etag and again.content == b""
+    assert weak.status_code == 304 and weak.headers["etag"] == etag
+    assert changed.status_code == 200 and changed.headers["etag"] == etag
+
+
+@pytest.mark.parametrize("value", [
+    {"flashcards": DECK, "count": 40, "subject": "Biology: enzymes — ü", "ratio": 0.25, "cached": None},
+    {"slots": [{"start": datetime(2026, 3, 1, 9, 30, tzinfo=timezone.utc), "day": date(2026, 3, 1)}]},
+    {"usage": {1: 5, 2: 7}, "nested": [[1, 2], {"3": [True, False]}]},
+], ids=["deck", "datetimes", "int-keys"])
+def test_orjson_renders_responses_as_the_json_encoder_did(value):
+    pytest.importorskip("orjson")
+    from fastapi.encoders import jsonable_encoder
+
+    # FastAPI runs jsonable_encoder before the response class renders
+    encoded = jsonable_encoder(value)
+
+    assert DefaultResponse(encoded).body == JSONResponse(encoded).body
+    # Returned as they are, datetimes and int keys come out as jsonable_encoder would make them
+    assert DefaultResponse(value).body == JSONResponse(encoded).body
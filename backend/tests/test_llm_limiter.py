@@ -0,0 +1,175 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import FlashCardTools
+from bench.stubs import StubConfig, start_anthropic_stub
+from services import paper_generator
+from services.llm_limiter import AdmissionController, LLMQueueTimeout, LLMUnavailable
+
+
+@pytest.fixture
+def rate_limited_client():
+    """An Anthropic client for a stub that returns 429 (retry-after: 1) above 4 requests a second"""
+    from anthropic import Anthropic
+
+    stub = start_anthropic_stub(StubConfig(latency=0.05, output_tokens_per_second=1e9, max_requests_per_second=4))
+    client = Anthropic(api_key="stub-key", base_url=f"http://127.0.0.1:{stub.server_address[1]}", max_retries=0)
+    yield client
+    stub.shutdown()
+
+
+def controller(**overrides) -> AdmissionController:
+    settings = dict(
+        initial_limit=8, input_tokens_per_minute=1_000_000, output_tokens_per_minute=1_000_000,
+        max_retries=20, queue_timeout=60.0, base_backoff=0.1,
+    )
+    settings.update(overrides)
+    return AdmissionController(**settings)
+
+
+REQUEST = dict(
+    model="claude-3-haiku-20240307", max_tokens=100,
+    messages=[{"role": "user", "content": "Create EXACTLY 1 flashcards"}],
+)
+
+
+def test_calls_above_the_stub_rate_are_retried_until_served(rate_limited_client):
+    limiter = controller()
+    calls = 16
+
+    def one(_):
+        return limiter.call(rate_limited_client.messages.create, input_tokens=10, max_output_tokens=100, **REQUEST)
+
+    with ThreadPoolExecutor(max_workers=calls) as pool:
+        results = list(pool.map(one, range(calls)))
+
+    assert len(results) == calls
+    stats = limiter.stats()
+    assert stats["throttled"] > 0
+    assert stats["retries"] == stats["throttled"]
+    assert stats["admitted"] == calls + stats["retries"]
+    assert stats["in_flight"] == 0
+
+
+@pytest.mark.anyio
+async def test_async_calls_above_the_stub_rate_are_retried_until_served(rate_limited_client):
+    limiter = controller()
+    calls = 16
+
+    results = await asyncio.gather(*(
+        limiter.acall(rate_limited_client.messages.create, input_tokens=10, max_output_tokens=100, **REQUEST)
+        for _ in range(calls)
+    ))
+
+    assert len(results) == calls
+    assert limiter.stats()["throttled"] > 0
+    assert limiter.in_flight == 0
+
+
+def test_output_reservation_is_settled_against_usage():
+    limiter = controller(output_tokens_per_minute=10000)
+    response = SimpleNamespace(usage=SimpleNamespace(input_tokens=50, output_tokens=100))
+
+    limiter.call(lambda: response, input_tokens=50, max_output_tokens=4000)
+
+    # Only the tokens used stay spent, not the 4000 allowed
+    assert limiter.output_bucket.tokens == pytest.approx(10000 - 100, abs=5)
+    assert limiter.output_ratio < 0.5
+
+
+def test_timeout_waiting_for_output_tokens_refunds_input_tokens():
+    limiter = controller(input_tokens_per_minute=600, output_tokens_per_minute=60, queue_timeout=0.2)
+    limiter.output_bucket.tokens = 0
+
+    with pytest.raises(LLMQueueTimeout):
+        limiter.call(lambda: None, input_tokens=100, max_output_tokens=1000)
+
+    assert limiter.input_bucket.tokens == pytest.approx(600, abs=1)
+    assert limiter.stats()["timeouts"] == 1
+
+
+@pytest.mark.anyio
+async def test_async_timeout_waiting_for_a_slot_refunds_tokens():
+    limiter = controller(initial_limit=1, input_tokens_per_minute=600, output_tokens_per_minute=600, queue_timeout=0.2)
+    limiter.in_flight = 1
+
+    with pytest.raises(LLMQueueTimeout):
+        await limiter.acall(lambda: None, input_tokens=100, max_output_tokens=200)
+
+    assert limiter.input_bucket.tokens == pytest.approx(600, abs=1)
+    assert limiter.output_bucket.tokens == pytest.approx(600, abs=1)
+
+
+@pytest.mark.anyio
+async def test_blocking_llm_work_holds_a_bounded_number_of_threads():
+    limiter = controller(worker_threads=2)
+    lock = threading.Lock()
+    running = peak = 0
+
+    def work():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+
+    await asyncio.gather(*(limiter.run_in_thread(work) for _ in range(8)))
+    assert peak == 2
+
+
+def test_api_still_throttling_after_the_retries_is_reported_as_unavailable():
+    from anthropic import Anthropic
+
+    stub = start_anthropic_stub(StubConfig(latency=0, error_rate=1.0))
+    client = Anthropic(api_key="stub-key", base_url=f"http://127.0.0.1:{stub.server_address[1]}", max_retries=0)
+    limiter = controller(max_retries=2, base_backoff=0.01)
+    try:
+        with pytest.raises(LLMUnavailable, match="529 after 2 retries") as turned_away:
+            limiter.call(client.messages.create, input_tokens=10, max_output_tokens=100, **REQUEST)
+    finally:
+        stub.shutdown()
+    assert turned_away.value.__cause__.status_code == 529
+    assert limiter.stats()["throttled"] == 3
+
+
+@pytest.mark.anyio
+async def test_flashcards_not_admitted_in_time_get_503_with_retry_after(client, make_pdf, monkeypatch):
+    limiter = controller(input_tokens_per_minute=600, output_tokens_per_minute=60, queue_timeout=0.2)
+    limiter.output_bucket.tokens = 0
+    monkeypatch.setattr(FlashCardTools, "llm_limiter", limiter)
+    files = {"pdf_file": ("notes.pdf", make_pdf(seed=2700), "application/pdf")}
+
+    response = await client.post("/flashcards", files=files, data={"count": "4"})
+
+    assert response.status_code == 503
+    assert "busy" in response.json()["detail"]
+    # How long the empty output bucket takes to refill (60 tokens at 1 a second)
+    assert response.headers["Retry-After"] == "60"
+    assert limiter.stats()["timeouts"] == 1
+
+
+@pytest.mark.anyio
+async def test_papers_still_throttled_after_the_retries_get_503_with_retry_after(client, make_pdf, monkeypatch):
+    from anthropic import Anthropic
+
+    stub = start_anthropic_stub(StubConfig(latency=0, error_rate=1.0))
+    overloaded = Anthropic(api_key="stub-key", base_url=f"http://127.0.0.1:{stub.server_address[1]}", max_retries=0)
+    monkeypatch.setattr(paper_generator.PaperGeneratorService, "anthropic", property(lambda self: overloaded))
+    monkeypatch.setattr(paper_generator, "llm_limiter", controller(max_retries=1, base_backoff=0.01))
+    files = {"pdf_file": ("paper.pdf", make_pdf(seed=2701), "application/pdf")}
+
+    try:
+        response = await client.post("/papers/generate", files=files, data={"difficulty": "same", "mode": "single"})
+    finally:
+        stub.shutdown()
+
+    assert response.status_code == 503
+    assert "529" in response.json()["detail"]
+    assert int(response.headers["Retry-After"]) >= 1
@@ -0,0 +1,30 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from bench.memory import synthetic_pdf
+from bench.run import BACKEND_DIR
+
+# Well under bench/memory.py's 16 MB default; a 500-page upload is about 3.5 MB
+CAP_MB = 8
+
+
+@pytest.fixture(scope="module")
+def large_pdf(tmp_path_factory):
+    path = tmp_path_factory.mktemp("memory") / "textbook.pdf"
+    path.write_bytes(synthetic_pdf(500))
+    return path
+
+
+@pytest.mark.parametrize("scenario", ["flashcards", "library"])
+def test_large_document_mode_stays_under_the_memory_cap(large_pdf, scenario):
+    completed = subprocess.run(
+        [sys.executable, "-m", "bench.memory", "--child", "--mode", "large", "--scenario", scenario, "--pdf", str(large_pdf)],
+        cwd=BACKEND_DIR, check=True, capture_output=True, text=True, timeout=300,
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    assert result["cards"] == 8
+    assert result["peak_mb_above_baseline"] <= CAP_MB, result
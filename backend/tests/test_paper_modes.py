@@ -0,0 +1,46 @@
+import logging
+
+import pytest
+
+from services import paper_generator
+from services.paper_generator import PAPER_DRAFT_MODEL, PAPER_MODEL, PaperGeneratorService, _configured_mode
+from services.question_bank import ParsedQuestion, QuestionBank, parse_questions
+from tests.test_question_bank import SOURCE
+
+
+def test_unknown_configured_mode_falls_back_to_single_with_a_warning(caplog):
+    with caplog.at_level(logging.WARNING):
+        assert _configured_mode("fast") == "single"
+    assert "PAPER_GENERATION_MODE='fast'" in caplog.text
+    assert _configured_mode("draft_refine") == "draft_refine"
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("mode, models, calls", [
+    ("single", [PAPER_MODEL], 1),
+    ("draft_refine", [PAPER_DRAFT_MODEL], 2),
+])
+async def test_gap_questions_are_generated_with_the_requested_mode(tmp_path, monkeypatch, stub_calls, mode, models, calls):
+    bank = QuestionBank(str(tmp_path / "bank.db"))
+    monkeypatch.setattr(paper_generator, "get_question_bank", lambda: bank)
+    source_questions = parse_questions(SOURCE)
+    bank.add_questions(
+        [ParsedQuestion(q.number, q.marks, q.body + " Use a diagram.") for q in source_questions], "harder", "generated",
+        "Biology Mock Examination",
+    )
+    service = PaperGeneratorService()
+    used_models = []
+    generate = service.generate_new_paper_content
+
+    async def recording(*args, model=PAPER_MODEL, **kwargs):
+        used_models.append(model)
+        return await generate(*args, model=model, **kwargs)
+
+    monkeypatch.setattr(service, "generate_new_paper_content", recording)
+
+    paper = await service.compose_paper_content(SOURCE, "harder", mode)
+
+    assert used_models == models
+    # The draft model writes the gaps and the strong model reviews them
+    assert stub_calls() == calls
+    assert len(parse_questions(paper)) == 4
@@ -0,0 +1,105 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from bench.memory import synthetic_pdf
+from services import ocr
+from services.ocr import OcrSession
+from services.pdf_text import DocumentTooLarge, MemoryBudget, iter_page_texts
+from services.workers import process_pool
+
+
+@pytest.fixture
+def fake_ocr(monkeypatch):
+    """OCR that runs in threads and records each batch, the window it came from and the hashing"""
+    record = SimpleNamespace(batches=[], hashes=0, running=set(), overlapping_windows=0)
+    lock = threading.Lock()
+    sha256 = ocr.hashlib.sha256
+
+    def counting_sha256(data):
+        record.hashes += 1
+        return sha256(data)
+
+    def recognise(shared_name, size, page_indices, dpi, lang):
+        window = page_indices[0] // 16
+        with lock:
+            record.batches.append(page_indices)
+            record.running.add(window)
+            record.overlapping_windows = max(record.overlapping_windows, len(record.running))
+        time.sleep(0.02)
+        with lock:
+            record.running.discard(window)
+        return [f"ocr page {index}" for index in page_indices]
+
+    pool = ThreadPoolExecutor(max_workers=8)
+    monkeypatch.setattr(ocr, "ocr_available", lambda: True)
+    monkeypatch.setattr(ocr, "_get_pool", lambda: pool)
+    monkeypatch.setattr(ocr, "_ocr_page_batch", recognise)
+    monkeypatch.setattr(ocr, "OCR_WORKERS", 2)
+    monkeypatch.setattr(ocr, "hashlib", SimpleNamespace(sha256=counting_sha256))
+    yield record
+    pool.shutdown()
+
+
+def scanned_pdf(pages: int, seed: int) -> bytes:
+    return synthetic_pdf(pages, lines_per_page=0, image_kb=1, seed=seed)
+
+
+def test_scanned_pages_are_ocred_as_one_pipeline(fake_ocr):
+    pdf = scanned_pdf(64, seed=4400)
+
+    texts = list(iter_page_texts(pdf))
+
+    assert texts == [f"ocr page {index}" for index in range(64)]
+    assert fake_ocr.hashes == 1
+    assert sorted(index for batch in fake_ocr.batches for index in batch) == list(range(64))
+    # Later windows are recognised while earlier ones are still running
+    assert fake_ocr.overlapping_windows > 1
+
+
+def test_ocred_pages_are_cached_under_the_hash_passed_in(fake_ocr):
+    pdf = scanned_pdf(20, seed=4401)
+
+    list(iter_page_texts(pdf, document_hash="given"))
+    batches = len(fake_ocr.batches)
+    again = list(iter_page_texts(pdf, document_hash="given"))
+
+    assert fake_ocr.hashes == 0
+    assert len(fake_ocr.batches) == batches
+    assert again == [f"ocr page {index}" for index in range(20)]
+
+
+def test_copy_shared_with_ocr_workers_counts_against_the_budget(fake_ocr):
+    pdf = scanned_pdf(8, seed=4402)
+    budget = MemoryBudget(limit_mb=1.5 * len(pdf) / (1024 * 1024))
+    budget.charge(len(pdf), "the upload")
+
+    with pytest.raises(DocumentTooLarge, match="shared with OCR workers"):
+        list(iter_page_texts(pdf, budget=budget))
+    assert fake_ocr.batches == []
+
+
+def test_text_pages_are_not_sent_to_ocr(fake_ocr):
+    pdf = synthetic_pdf(20, lines_per_page=2, image_kb=1, seed=4403)
+
+    texts = list(iter_page_texts(pdf))
+
+    assert all(text.startswith(f"Page {index + 1}:") for index, text in enumerate(texts))
+    assert fake_ocr.batches == []
+    assert fake_ocr.hashes == 0
+
+
+def test_worker_processes_read_the_shared_upload():
+    session = OcrSession(b"%PDF shared with the workers")
+    name = session._shared_name()
+    try:
+        with process_pool(2) as pool:
+            copies = list(pool.map(ocr._read_shared, [name] * 4, [len(session.pdf_content)] * 4))
+        # Still there after the workers have exited
+        assert bytes(session._shared.buf[:4]) == b"%PDF"
+    finally:
+        session.close()
+    assert copies == [session.pdf_content] * 4
@@ -0,0 +1,64 @@
+import pytest
+
+from services import paper_generator
+from services.paper_generator import PaperGeneratorService
+from services.question_bank import ParsedQuestion, QuestionBank, paper_header, parse_questions
+
+SOURCE = """Biology Mock Examination
+General Instructions
+Answer ALL questions. Time allowed: 90 minutes.
+
+Question 1 (10 marks)
+Explain how enzymes lower the activation energy of a reaction.
+
+Question 2 (10 marks)
+Describe the role of chloroplasts in photosynthesis.
+
+Question 3 (10 marks)
+Compare diffusion and osmosis across a cell membrane.
+
+Question 4 (10 marks)
+Outline the stages of aerobic respiration in mitochondria.
+"""
+
+
+@pytest.fixture
+def bank(tmp_path, monkeypatch):
+    bank = QuestionBank(str(tmp_path / "bank.db"))
+    monkeypatch.setattr(paper_generator, "get_question_bank", lambda: bank)
+    return bank
+
+
+def harder(question: ParsedQuestion) -> ParsedQuestion:
+    return ParsedQuestion(question.number, question.marks, question.body + " Justify your answer with an example.")
+
+
+def test_replacements_come_only_from_the_same_subject(bank):
+    question = parse_questions(SOURCE)[0]
+    bank.add_questions([harder(question)], "harder", "generated", "Chemistry Mock Examination")
+
+    assert bank.find_replacement(question, "harder", set(), "Biology Mock Examination") is None
+    assert bank.find_replacement(question, "harder", set(), None) is None
+    assert bank.find_replacement(question, "harder", set(), "Chemistry Mock Examination") is not None
+
+
+@pytest.mark.anyio
+async def test_a_warm_bank_reuses_at_most_half_and_keeps_the_generated_header(bank, stub_calls):
+    source_questions = parse_questions(SOURCE)
+    bank.add_questions([harder(q) for q in source_questions], "harder", "generated", "Biology Mock Examination")
+
+    paper = await PaperGeneratorService().compose_paper_content(SOURCE, "harder")
+
+    questions = parse_questions(paper)
+    assert len(questions) == 4
+    reused = [q for q in questions if q.body.endswith("Justify your answer with an example.")]
+    assert len(reused) == 2
+    assert stub_calls() == 1
+    # The generated paper's title and instructions, not a rewritten header
+    assert paper_header(paper) == "# Stub Examination Paper\n## General Instructions\n- Time allowed: 2 hours"
+
+
+def test_header_keeps_instructions_but_not_the_first_section_heading():
+    paper = "# Physics\n## General Instructions\n- Answer all\n\n## Section A\n### Question 1 (5 marks)\nState Ohm's law."
+
+    assert paper_header(paper) == "# Physics\n## General Instructions\n- Answer all"
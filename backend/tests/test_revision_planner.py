@@ -0,0 +1,126 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+import google_calendar
+from services.revision_planner import StudyGoal, plan_revision, split_sessions
+
+USER = "student-1"
+
+
+def slot(start, end):
+    return {"start": start, "end": end}
+
+
+def days(first, last, start="09:00", end="12:00"):
+    return [slot(f"2026-11-{day:02d}T{start}:00", f"2026-11-{day:02d}T{end}:00") for day in range(first, last + 1)]
+
+
+def assert_no_overlaps(sessions, break_minutes=0):
+    spans = sorted((datetime.fromisoformat(s["start"]), datetime.fromisoformat(s["end"])) for s in sessions)
+    for (_, end), (start, _) in zip(spans, spans[1:]):
+        assert (start - end).total_seconds() >= break_minutes * 60
+
+
+def test_every_session_ends_before_its_exam():
+    goals = [StudyGoal("Maths", 4, "2026-11-03"), StudyGoal("History", 6, "2026-11-06")]
+
+    plan = plan_revision(goals, days(1, 5), break_minutes=0)
+
+    assert plan["feasible"]
+    for session in plan["sessions"]:
+        deadline = datetime.fromisoformat("2026-11-03" if session["subject"] == "Maths" else "2026-11-06")
+        assert datetime.fromisoformat(session["end"]) <= deadline
+    assert {row["subject"]: row["scheduled_hours"] for row in plan["summary"]} == {"Maths": 4, "History": 6}
+
+
+def test_later_exam_with_more_slack_does_not_starve_the_earlier_one():
+    # History looks more urgent by slack at first, but Maths' exam is sooner
+    # and needs every hour before it
+    goals = [StudyGoal("History", 9, "2026-11-06", priority=3), StudyGoal("Maths", 6, "2026-11-03")]
+
+    plan = plan_revision(goals, days(1, 5), break_minutes=0)
+
+    assert plan["feasible"]
+    maths = [s for s in plan["sessions"] if s["subject"] == "Maths"]
+    assert sum((datetime.fromisoformat(s["end"]) - datetime.fromisoformat(s["start"])).seconds for s in maths) == 6 * 3600
+
+
+def test_overlapping_slots_from_separate_queries_are_merged():
+    free = [slot("2026-11-01T09:00:00", "2026-11-01T11:00:00"), slot("2026-11-01T10:00:00", "2026-11-01T12:30:00")]
+
+    sessions = split_sessions(free, session_minutes=60, min_session_minutes=30, break_minutes=10)
+
+    assert [(s.isoformat(), e.isoformat()) for s, e in sessions] == [
+        ("2026-11-01T09:00:00", "2026-11-01T10:00:00"),
+        ("2026-11-01T10:10:00", "2026-11-01T11:00:00"),
+        ("2026-11-01T11:10:00", "2026-11-01T12:10:00"),
+    ]
+    plan = plan_revision([StudyGoal("Maths", 3, "2026-11-02")], free, break_minutes=10)
+    assert_no_overlaps(plan["sessions"], break_minutes=10)
+
+
+def test_infeasible_plan_reports_the_shortfall():
+    goals = [StudyGoal("Maths", 5, "2026-11-03"), StudyGoal("History", 2, "2026-11-03")]
+
+    plan = plan_revision(goals, days(1, 2), break_minutes=0)
+
+    assert not plan["feasible"]
+    assert plan["free_hours"] == 6
+    assert sum(row["shortfall_hours"] for row in plan["summary"]) == 1
+
+
+def test_invalid_session_lengths_are_rejected():
+    with pytest.raises(ValueError):
+        plan_revision([StudyGoal("Maths", 1, "2026-11-03")], days(1, 1), session_minutes=20, min_session_minutes=30)
+
+
+@pytest.mark.anyio
+async def test_plan_reads_the_calendar_range_with_one_sync_and_avoids_events(client, fake_calendar):
+    fake_calendar.put_event(USER, {"id": "lecture", "start": "2026-11-02T09:00:00Z", "end": "2026-11-02T11:00:00Z"})
+    body = {
+        "subjects": [{"name": "Maths", "target_hours": 6, "exam_date": "2026-11-06"}],
+        "start_date": "2026-11-01", "day_start": "09:00", "day_end": "12:00", "break_minutes": 0,
+    }
+
+    response = await client.post("/calendar/plan", json=body, headers={"X-User-Id": USER})
+
+    plan = response.json()
+    assert response.status_code == 200
+    assert fake_calendar.sync_calls == 1
+    assert plan["feasible"]
+    # Three hours a day up to the exam day, less the two-hour lecture
+    assert plan["free_hours"] == 16
+    lecture = (datetime(2026, 11, 2, 9), datetime(2026, 11, 2, 11))
+    for session in plan["sessions"]:
+        start, end = datetime.fromisoformat(session["start"]), datetime.fromisoformat(session["end"])
+        assert end <= lecture[0] or start >= lecture[1]
+
+
+def test_days_are_asked_of_portia_concurrently_without_a_mirror(monkeypatch):
+    from services import calendar_mirror
+
+    monkeypatch.setattr(calendar_mirror, "_provider", None)
+    monkeypatch.setattr(calendar_mirror, "_provider_loaded", True)
+    lock = threading.Lock()
+    running = peak = 0
+
+    def one_day(date, start_time, end_time, constraints=[], user_id=None, zone=None):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        return {"success": True, "date": date, "free_slots": [slot(f"{date}T{start_time}:00", f"{date}T{end_time}:00")]}
+
+    monkeypatch.setattr(google_calendar, "find_free_time_in_calendar", one_day)
+    dates = [f"2026-11-{day:02d}" for day in range(1, 9)]
+
+    result = google_calendar.find_free_time_in_range(dates, "09:00", "12:00", user_id=USER)
+
+    assert [s["start"][:10] for s in result["free_slots"]] == dates
+    assert peak > 1
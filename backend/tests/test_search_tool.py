@@ -0,0 +1,126 @@
+import time
+import uuid
+
+import httpx
+import pytest
+
+from bench.search import load_search_tool
+from bench.stubs import start_search_stub
+
+LATENCY = 0.2
+
+
+@pytest.fixture(scope="module")
+def stub():
+    server = start_search_stub(LATENCY, failing_terms=("unreachable",))
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(scope="module")
+def search_module():
+    # Loaded once, so the tests share its pooled client like the app does
+    return load_search_tool()
+
+
+@pytest.fixture
+def search_tool(search_module, stub, monkeypatch):
+    monkeypatch.setattr(search_module, "SEARCH_API_URL", f"http://127.0.0.1:{stub.server_address[1]}/search")
+    monkeypatch.setenv("TAVILY_API_KEY", "stub-key")
+    return search_module
+
+
+@pytest.fixture
+def stub_calls(stub):
+    """Number of searches the stub has served since the test started"""
+    handler = stub.RequestHandlerClass
+    start = handler.calls
+    return lambda: handler.calls - start
+
+
+@pytest.fixture
+def topic():
+    """Fresh words for each test's queries, so nothing comes from another test's cache"""
+    return f"topic{uuid.uuid4().hex[:8]}"
+
+
+def urls(results):
+    return [result["url"] for result in results]
+
+
+def test_queries_differing_only_in_case_and_spacing_share_a_cache_entry(search_tool, stub_calls, topic):
+    first = search_tool.search_many([f"Krebs cycle {topic}"])
+    again = search_tool.search_many([f"  krebs   CYCLE {topic} "])
+    both = search_tool.search_many([f"krebs cycle {topic}", f"KREBS CYCLE {topic}"])
+
+    assert stub_calls() == 1
+    assert urls(first) == urls(again) == urls(both)
+    assert len(first) == search_tool.MAX_RESULTS
+
+
+def test_cached_results_expire_after_the_ttl(search_tool, stub_calls, monkeypatch, topic):
+    monkeypatch.setattr(search_tool, "SEARCH_CACHE_TTL", 0.1)
+
+    search_tool.search_many([f"osmosis {topic}"])
+    search_tool.search_many([f"osmosis {topic}"])
+    time.sleep(0.2)
+    search_tool.search_many([f"osmosis {topic}"])
+
+    assert stub_calls() == 2
+
+
+def test_batch_is_fetched_concurrently_and_merged_by_rank(search_tool, stub_calls, topic):
+    queries = [f"{name} {topic}" for name in ("mitosis", "meiosis", "osmosis", "diffusion")]
+
+    started = time.perf_counter()
+    results = search_tool.search_many(queries)
+    elapsed = time.perf_counter() - started
+
+    assert stub_calls() == 4
+    assert elapsed < 2 * LATENCY
+    assert len(results) == 4 * search_tool.MAX_RESULTS
+    # Each query's best result first, then each query's second, and so on
+    assert [result["title"] for result in results[:4]] == [f"{query} (1)" for query in queries]
+
+
+def test_results_with_the_same_url_are_kept_once(search_tool, topic):
+    # Different queries, but the stub builds the same URLs from both
+    results = search_tool.search_many([f"photosynthesis {topic}?", f"photosynthesis {topic}!"])
+
+    assert len(results) == search_tool.MAX_RESULTS
+    assert len(set(urls(results))) == len(results)
+
+
+def test_failed_queries_leave_the_others_results(search_tool, stub_calls, topic):
+    results = search_tool.search_many([f"enzymes {topic}", f"unreachable {topic}"])
+
+    assert [result["title"] for result in results] == [f"enzymes {topic} ({i})" for i in range(1, 4)]
+    # Only the successful query was cached
+    search_tool.search_many([f"enzymes {topic}", f"unreachable {topic}"])
+    assert stub_calls() == 3
+
+
+def test_all_queries_failing_raises(search_tool, topic):
+    with pytest.raises(httpx.HTTPStatusError):
+        search_tool.search_many([f"unreachable {topic}", f"also unreachable {topic}"])
+
+
+def test_search_needs_an_api_key(search_tool, monkeypatch, topic):
+    from portia.errors import ToolHardError
+
+    monkeypatch.delenv("TAVILY_API_KEY")
+
+    with pytest.raises(ToolHardError):
+        search_tool.search_many([f"glycolysis {topic}"])
+
+
+@pytest.mark.anyio
+async def test_async_search_shares_the_cache_and_partial_failures(search_tool, stub_calls, topic):
+    results = await search_tool.asearch_many([f"Ribosomes {topic}", f"unreachable {topic}", f"ribosomes  {topic}"])
+    cached = search_tool.search_many([f"ribosomes {topic}"])
+
+    assert stub_calls() == 2
+    assert urls(results) == urls(cached)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await search_tool.asearch_many([f"unreachable {topic}"])
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from services.single_flight import SingleFlight
+
+
+@pytest.mark.anyio
+async def test_identical_concurrent_flashcard_requests_make_one_llm_call(client, make_pdf, stub_calls):
+    files = {"pdf_file": ("handout.pdf", make_pdf(seed=2600), "application/pdf")}
+    data = {"subject": "Chemistry", "count": "4"}
+
+    responses = await asyncio.gather(*(client.post("/flashcards", files=files, data=data) for _ in range(100)))
+
+    assert {response.status_code for response in responses} == {200}
+    assert len({response.content for response in responses}) == 1
+    assert stub_calls() == 1
+
+
+@pytest.mark.anyio
+async def test_callers_share_one_call():
+    flight = SingleFlight("test")
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "result"
+
+    results = await asyncio.gather(*(flight.do("key", work) for _ in range(100)))
+
+    assert results == ["result"] * 100
+    assert calls == 1
+    assert flight.stats() == {"executed": 1, "coalesced": 99, "in_flight": 0}
+
+
+@pytest.mark.anyio
+async def test_first_caller_going_away_does_not_cancel_the_others():
+    flight = SingleFlight("test")
+    started = asyncio.Event()
+
+    async def work():
+        started.set()
+        await asyncio.sleep(0.05)
+        return "result"
+
+    leader = asyncio.ensure_future(flight.do("key", work))
+    await started.wait()
+    followers = [asyncio.ensure_future(flight.do("key", work)) for _ in range(3)]
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    assert await asyncio.gather(*followers) == ["result"] * 3
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+
+
+@pytest.mark.anyio
+async def test_errors_reach_every_caller_and_are_not_kept():
+    flight = SingleFlight("test")
+    attempts = 0
+
+    async def failing():
+        nonlocal attempts
+        attempts += 1
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(*(flight.do("key", failing) for _ in range(5)), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert attempts == 1
+
+    # The next call starts afresh
+    with pytest.raises(ValueError):
+        await flight.do("key", failing)
+    assert attempts == 2
@@ -0,0 +1,37 @@
+import time
+
+import pytest
+
+from services.state_backend import SQLiteBackend, StateBackend
+
+
+def test_state_backend_is_abstract():
+    class Incomplete(StateBackend):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_expired_entries_nobody_reads_are_swept_on_write(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "state.db"), sweep_interval=0.1)
+    for i in range(50):
+        backend.set(f"old:{i}", b"x", ttl=0.01)
+    backend.set("kept", b"x")
+    time.sleep(0.15)
+
+    backend.set("trigger", b"x", ttl=60)
+
+    rows = backend._conn().execute("SELECT key FROM kv ORDER BY key").fetchall()
+    assert rows == [("kept",), ("trigger",)]
+
+
+def test_sweep_deletes_only_expired_entries(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "state.db"), sweep_interval=3600)
+    backend.set("expired", b"x", ttl=0.01)
+    backend.set("live", b"x", ttl=60)
+    time.sleep(0.05)
+
+    assert backend.sweep() == 1
+    assert backend.get("live") == b"x"
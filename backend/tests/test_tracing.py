@@ -0,0 +1,91 @@
+import pytest
+
+pytest.importorskip("opentelemetry.sdk")
+
+import httpx  # noqa: E402
+from opentelemetry import trace  # noqa: E402
+from opentelemetry.sdk.trace import TracerProvider  # noqa: E402
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor  # noqa: E402
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter  # noqa: E402
+from opentelemetry.trace import StatusCode  # noqa: E402
+from starlette.applications import Starlette  # noqa: E402
+from starlette.responses import PlainTextResponse  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+
+from services.tracing import RequestSpanMiddleware, span  # noqa: E402
+
+_exporter = InMemorySpanExporter()
+
+
+@pytest.fixture
+def spans():
+    if not isinstance(trace.get_tracer_provider(), TracerProvider):
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(_exporter))
+        trace.set_tracer_provider(provider)
+    _exporter.clear()
+    yield _exporter
+    _exporter.clear()
+
+
+@pytest.mark.anyio
+async def test_stage_spans_are_children_of_the_request_span(client, make_pdf, spans):
+    files = {"pdf_file": ("notes.pdf", make_pdf(seed=2900), "application/pdf")}
+
+    response = await client.post("/flashcards", files=files, data={"count": "4"}, headers={"X-User-Id": "tracer"})
+
+    assert response.status_code == 200
+    finished = spans.get_finished_spans()
+    roots = [s for s in finished if s.kind == trace.SpanKind.SERVER]
+    assert len(roots) == 1
+    root = roots[0]
+    assert root.name == "POST /flashcards"
+    assert root.parent is None
+    assert root.attributes["http.response.status_code"] == 200
+    by_id = {s.context.span_id: s for s in finished}
+    stages = {s.name: s for s in finished if s is not root}
+    # Stages in the request task, the threadpool and the shared single-flight call
+    for name in ("upload_read", "extraction", "preprocess"):
+        assert stages[name].context.trace_id == root.context.trace_id
+    # Newer FastAPI releases add their own spans in between
+    ancestor = stages["upload_read"]
+    while ancestor.parent is not None:
+        ancestor = by_id[ancestor.parent.span_id]
+    assert ancestor is root
+
+
+@pytest.mark.anyio
+async def test_request_span_is_named_after_the_route_template(client, spans):
+    await client.get("/flashcards/decks/missing-deck")
+
+    [root] = [s for s in spans.get_finished_spans() if s.kind == trace.SpanKind.SERVER]
+    assert root.name == "GET /flashcards/decks/{deck_id}"
+    assert root.attributes["http.response.status_code"] == 404
+
+
+def starlette_app():
+    async def deck(request):
+        with span("load_deck"):
+            pass
+        status = 500 if request.path_params["deck_id"] == "broken" else 404
+        return PlainTextResponse("", status_code=status)
+
+    app = Starlette(routes=[Route("/decks/{deck_id}", deck)])
+    app.add_middleware(RequestSpanMiddleware)
+    return app
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("deck_id, status", [("missing", 404), ("broken", 500)])
+async def test_middleware_opens_the_root_span_when_the_framework_does_not(spans, deck_id, status):
+    transport = httpx.ASGITransport(app=starlette_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.get(f"/decks/{deck_id}")
+
+    finished = {s.name: s for s in spans.get_finished_spans()}
+    root = finished["GET /decks/{deck_id}"]
+    assert root.kind == trace.SpanKind.SERVER
+    assert root.attributes["http.route"] == "/decks/{deck_id}"
+    assert root.attributes["http.response.status_code"] == status
+    assert (root.status.status_code == StatusCode.ERROR) == (status >= 500)
+    assert finished["load_deck"].parent.span_id == root.context.span_id
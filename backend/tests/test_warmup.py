@@ -0,0 +1,58 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from services.warmup import Warmup, render_pdf_document
+
+
+@pytest.fixture
+def fake_pdfkit(monkeypatch):
+    """pdfkit that records what it was asked to render instead of starting wkhtmltopdf"""
+    calls = []
+
+    def from_string(html, output_path, options=None, css=None):
+        calls.append(SimpleNamespace(html=html, output_path=output_path, options=options))
+        return b"%PDF-warm-up"
+
+    monkeypatch.setitem(sys.modules, "pdfkit", SimpleNamespace(from_string=from_string))
+    return calls
+
+
+def test_pdf_backend_step_renders_through_every_markdown_extension(fake_pdfkit):
+    render_pdf_document()
+
+    [call] = fake_pdfkit
+    assert call.output_path is False
+    assert call.options["page-size"] == "A4"
+    assert "<table>" in call.html
+    assert "<pre><code>" in call.html
+    assert "<br />" in call.html
+
+
+@pytest.mark.anyio
+async def test_pdf_backend_step_is_timed_and_reported(fake_pdfkit):
+    warmup = Warmup({"pdf_backend": render_pdf_document})
+
+    await warmup.run()
+
+    status = warmup.status()
+    assert status["ready"] is True
+    assert status["steps"]["pdf_backend"]["ok"] is True
+    assert status["steps"]["pdf_backend"]["seconds"] >= 0
+    assert len(fake_pdfkit) == 1
+
+
+@pytest.mark.anyio
+async def test_missing_pdfkit_fails_the_step_without_holding_back_readiness(monkeypatch):
+    # A None entry makes the import raise ImportError
+    monkeypatch.setitem(sys.modules, "pdfkit", None)
+    warmup = Warmup({"pdf_backend": render_pdf_document, "noop": lambda: "nothing to do"})
+
+    await warmup.run()
+
+    steps = warmup.status()["steps"]
+    assert warmup.ready
+    assert steps["pdf_backend"]["ok"] is False
+    assert "pdfkit" in steps["pdf_backend"]["error"]
+    assert steps["noop"] == {"ok": True, "note": "nothing to do", "seconds": steps["noop"]["seconds"]}
@@ -0,0 +1,40 @@
+import importlib
+import os
+
+import pytest
+
+from services import workers
+
+
+@pytest.fixture
+def four_workers(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    importlib.reload(workers)
+    yield workers
+    monkeypatch.delenv("WEB_CONCURRENCY")
+    importlib.reload(workers)
+
+
+def test_host_budgets_are_split_between_workers(four_workers, monkeypatch):
+    monkeypatch.setenv("LLM_INPUT_TOKENS_PER_MINUTE", "40000")
+    monkeypatch.setenv("LLM_MAX_CONCURRENCY", "2")
+    from services.llm_limiter import AdmissionController
+
+    limiter = AdmissionController.from_env()
+
+    assert limiter.input_bucket.capacity == 10000
+    assert limiter.max_limit == 1
+    assert limiter.limit == 1
+    assert four_workers.per_worker(0) == 0
+    assert four_workers.per_worker(2) == 1
+
+
+def test_process_pools_share_the_cores_between_workers(four_workers):
+    assert four_workers.CPUS_PER_WORKER == max(1, (os.cpu_count() or 1) // 4)
+
+
+def test_process_pools_do_not_fork_the_web_worker():
+    assert workers.PROCESS_START_METHOD in ("forkserver", "spawn")
+    with workers.process_pool(1) as pool:
+        assert pool.submit(os.getpid).result() != os.getpid()
+        assert pool._mp_context.get_start_method() == workers.PROCESS_START_METHOD
@@ -0,0 +1,10 @@
+import { NextRequest } from 'next/server';
+
+// The backend schedules requests fairly per user and, without a user id,
+// per client address. Calls made from this server would otherwise all come
+// from one address, so pass on the browser's (the backend trusts this
+// server's X-Forwarded-For when it is listed in TRUSTED_PROXIES).
+export function clientHeaders(request: NextRequest): Record<string, string> {
+  const forwarded = request.headers.get('x-forwarded-for') ?? request.ip;
+  return forwarded ? { 'X-Forwarded-For': forwarded } : {};
+}
@@ -1,9 +1,10 @@
 import { NextRequest, NextResponse } from 'next/server';
+import { clientHeaders } from '../clientHeaders';
 
 export async function POST(request: NextRequest) {
   try {
     const body = await request.json();
-    const { date, startTime, endTime, email } = body;
+    const { date, startTime, endTime, email, timeZone } = body;
 
     console.log('API route received request:', { date, startTime, endTime, email });
 
@@ -20,6 +21,7 @@ export async function POST(request: NextRequest) {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        ...clientHeaders(request),
       },
       body: JSON.stringify({
         date,
@@ -27,6 +29,7 @@ export async function POST(request: NextRequest) {
         end_time: endTime,
         email,
         constraints: [],
+        time_zone: timeZone,
       }),
     });
 
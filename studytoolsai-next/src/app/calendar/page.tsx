@@ -243,6 +243,8 @@ export default function Calendar() {
                     startTime: startTimeFormatted,
                     endTime: endTimeFormatted,
                     email: email,
+                    // Times above are wall-clock times in the browser's zone
+                    timeZone: Intl.DateTimeFormat().resolvedOptions().timeZone,
                 }),
             });
 
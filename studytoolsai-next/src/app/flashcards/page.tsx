@@ -108,7 +108,8 @@ export default function Flashcards() {
                 throw new Error('Invalid response format from server');
             }
 
-            const generatedFlashcards = JSON.parse(data.flashcards);
+            // Older backends sent the cards as a JSON-encoded string
+            const generatedFlashcards = typeof data.flashcards === 'string' ? JSON.parse(data.flashcards) : data.flashcards;
 
             if (!Array.isArray(generatedFlashcards)) {
                 throw new Error('Invalid flashcards data format');